@@ -24,6 +24,9 @@ def run_crossref(args: argparse.Namespace) -> None:
         contact_email=args.contact_email,
         start_date=args.start_date,
         end_date=args.end_date,
+        concurrency=args.concurrency,
+        max_rate=args.max_rate,
+        content_hash_db=args.content_hash_db,
     )
     worker.run(continuous=args.continuous)
 
@@ -36,6 +39,10 @@ def run_datacite(args: argparse.Namespace) -> None:
         contact_email=args.contact_email,
         start_date=args.start_date,
         end_date=args.end_date,
+        concurrency=args.concurrency,
+        max_rate=args.max_rate,
+        slices_per_day=args.slices_per_day,
+        content_hash_db=args.content_hash_db,
     )
     worker.run(continuous=args.continuous)
 
@@ -47,6 +54,9 @@ def run_arxiv(args: argparse.Namespace) -> None:
         state_topic=f"fatcat-{args.env}.oaipmh-arxiv-state",
         start_date=args.start_date,
         end_date=args.end_date,
+        sets=args.sets,
+        concurrency=args.concurrency,
+        max_rate=args.max_rate,
     )
     worker.run(continuous=args.continuous)
 
@@ -58,6 +68,8 @@ def run_pubmed(args: argparse.Namespace) -> None:
         state_topic=f"fatcat-{args.env}.ftp-pubmed-state",
         start_date=args.start_date,
         end_date=args.end_date,
+        prefetch=args.prefetch,
+        download_dir=args.download_dir,
     )
     worker.run(continuous=args.continuous)
 
@@ -116,21 +128,90 @@ def main() -> None:
         "crossref", help="harvest DOI metadata from Crossref API (JSON)"
     )
     sub_crossref.set_defaults(func=run_crossref)
+    sub_crossref.add_argument(
+        "--content-hash-db",
+        default=None,
+        help="local SQLite file of record content hashes, used to skip unchanged records",
+    )
+    sub_crossref.add_argument(
+        "--concurrency",
+        default=1,
+        type=int,
+        help="number of API requests (eg, dates) to run in parallel",
+    )
+    sub_crossref.add_argument(
+        "--max-rate",
+        default=None,
+        type=float,
+        help="global limit on API requests per second",
+    )
 
     sub_datacite = subparsers.add_parser(
         "datacite", help="harvest DOI metadata from Datacite API (JSON)"
     )
     sub_datacite.set_defaults(func=run_datacite)
+    sub_datacite.add_argument(
+        "--content-hash-db",
+        default=None,
+        help="local SQLite file of record content hashes, used to skip unchanged records",
+    )
+    sub_datacite.add_argument(
+        "--concurrency",
+        default=1,
+        type=int,
+        help="number of API requests (eg, dates or slices) to run in parallel",
+    )
+    sub_datacite.add_argument(
+        "--max-rate",
+        default=None,
+        type=float,
+        help="global limit on API requests per second",
+    )
+    sub_datacite.add_argument(
+        "--slices-per-day",
+        default=1,
+        type=int,
+        help="split each date in to this many time windows, each with a separate cursor",
+    )
 
     sub_arxiv = subparsers.add_parser(
         "arxiv", help="harvest metadata from arxiv.org OAI-PMH endpoint (XML)"
     )
     sub_arxiv.set_defaults(func=run_arxiv)
+    sub_arxiv.add_argument(
+        "--sets",
+        default=None,
+        nargs="+",
+        help="harvest each of these OAI sets (eg, cs math physics) separately",
+    )
+    sub_arxiv.add_argument(
+        "--concurrency",
+        default=1,
+        type=int,
+        help="number of partitions (sets or dates) to harvest in parallel",
+    )
+    sub_arxiv.add_argument(
+        "--max-rate",
+        default=None,
+        type=float,
+        help="global limit on OAI-PMH requests per second",
+    )
 
     sub_pubmed = subparsers.add_parser(
         "pubmed", help="harvest MEDLINE/PubMed metadata from daily FTP updates (XML)"
     )
     sub_pubmed.set_defaults(func=run_pubmed)
+    sub_pubmed.add_argument(
+        "--prefetch",
+        default=2,
+        type=int,
+        help="number of upcoming update files to download in the background",
+    )
+    sub_pubmed.add_argument(
+        "--download-dir",
+        default=None,
+        help="directory to keep verified update files in, and re-use them from",
+    )
 
     # DOAJ stuff disabled because API range-requests are broken
     # sub_doaj_article = subparsers.add_parser('doaj-article')
@@ -1,13 +1,23 @@
+import concurrent.futures
 import datetime
 import json
 import sys
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import parse_qs, urlparse
 
 from confluent_kafka import KafkaException, Producer
 
-from .harvest_common import HarvestState, requests_retry_session
+from .harvest_common import (
+    ContentHashIndex,
+    HarvestState,
+    RateLimiter,
+    iter_json_items,
+    requests_retry_session,
+)
+
+# sub-day time window (start and end, inclusive) within a date being harvested
+TimeWindow = Tuple[datetime.datetime, datetime.datetime]
 
 
 class HarvestCrossrefWorker:
@@ -56,10 +66,42 @@ class HarvestCrossrefWorker:
         - start a loop for just that date, using resumption token for this query
         - when done, publish to state feed, with immediate sync
 
-    TODO: what sort of parallelism? I guess multi-processing on dates, but need
-    to be careful how state is serialized back into kafka.
+    With `concurrency` greater than one, several pending dates are fetched at
+    the same time, in threads sharing a single Kafka producer. Registrars
+    which support time-of-day filters (Datacite) can also split each date in
+    to `slices_per_day` time windows, each walked with its own cursor. A date
+    is only marked complete (in the state topic, from the main thread) once
+    all of its windows have been fetched. `max_rate` is a global limit on API
+    requests per second, across all threads.
+
+    API response pages are parsed incrementally, and each item is produced to
+    Kafka as the original JSON text from the response, without re-encoding.
+
+    If the registrar's cursors stay valid indefinitely (`cursor_param` is set),
+    progress within a date is checkpointed to the state topic every
+    `checkpoint_interval` seconds, and a restarted harvest resumes from the
+    last checkpointed cursor instead of the start of the date. Crossref
+    cursors expire after five minutes of disuse, so can't be resumed.
+
+    With a `content_hash_db` (a local SQLite file), records whose content,
+    ignoring `volatile_fields` like citation counts and index timestamps, is
+    the same as when they were last harvested are not produced at all, since
+    importing them would be a no-op.
     """
 
+    # top-level fields which change without any change to the metadata we import
+    volatile_fields: Tuple[str, ...] = (
+        "indexed",
+        "deposited",
+        "score",
+        "reference-count",
+        "references-count",
+        "is-referenced-by-count",
+    )
+
+    # location of the array of items (works) in API response pages
+    items_path: Tuple[str, ...] = ("message", "items")
+
     def __init__(
         self,
         kafka_hosts: str,
@@ -69,6 +111,9 @@ class HarvestCrossrefWorker:
         api_host_url: str = "https://api.crossref.org/works",
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
+        concurrency: int = 1,
+        max_rate: Optional[float] = None,
+        content_hash_db: Optional[str] = None,
     ) -> None:
 
         self.api_host_url = api_host_url
@@ -86,6 +131,14 @@ class HarvestCrossrefWorker:
         self.loop_sleep = 60 * 60  # how long to wait, in seconds, between date checks
         self.api_batch_size = 50
         self.name = "Crossref"
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(max_rate) if max_rate else None
+        # Crossref date filters have day granularity, so dates can't be sliced
+        self.slices_per_day = 1
+        # name of the resumable cursor request parameter, if there is one
+        self.cursor_param: Optional[str] = None
+        self.checkpoint_interval = 60.0
+        self.content_hashes = ContentHashIndex(content_hash_db) if content_hash_db else None
         self.producer = self._kafka_producer()
 
     def _kafka_producer(self) -> Producer:
@@ -109,7 +162,7 @@ class HarvestCrossrefWorker:
         )
         return Producer(producer_conf)
 
-    def params(self, date_str: str) -> Dict[str, Any]:
+    def params(self, date_str: str, window: Optional[TimeWindow] = None) -> Dict[str, Any]:
         filter_param = "from-update-date:{},until-update-date:{}".format(date_str, date_str)
         return {
             "filter": filter_param,
@@ -124,10 +177,73 @@ class HarvestCrossrefWorker:
     def extract_key(self, obj: Dict[str, Any]) -> bytes:
         return obj["DOI"].encode("utf-8")
 
+    def content_hash(self, obj: Dict[str, Any]) -> bytes:
+        return ContentHashIndex.hash_content(
+            {k: v for k, v in obj.items() if k not in self.volatile_fields}
+        )
+
+    def flush(self) -> None:
+        """
+        Flushes the producer, and then records the content hashes of
+        everything that was delivered.
+        """
+        if self.content_hashes:
+            self.content_hashes.commit(flush=self.producer.flush)
+        else:
+            self.producer.flush()
+
+    def date_windows(self, date: datetime.date) -> List[Optional[TimeWindow]]:
+        """
+        Splits a date in to `slices_per_day` equal time windows, or returns
+        [None] (the whole day) if it is not to be split.
+        """
+        if self.slices_per_day <= 1:
+            return [None]
+        day_start = datetime.datetime.combine(date, datetime.time())
+        step = datetime.timedelta(days=1) / self.slices_per_day
+        windows: List[Optional[TimeWindow]] = []
+        for i in range(self.slices_per_day):
+            start = day_start + step * i
+            end = day_start + step * (i + 1) - datetime.timedelta(milliseconds=1)
+            windows.append((start, end))
+        return windows
+
     def fetch_date(self, date: datetime.date) -> None:
+        for window in self.date_windows(date):
+            self.fetch_window(date, window)
+        self.flush()
+
+    def fetch_window(self, date: datetime.date, window: Optional[TimeWindow] = None) -> int:
+        """
+        Fetches all records updated on the date (or within the time window of
+        the date), producing them to Kafka. Does not flush the producer.
+
+        Returns the number of records produced (including by any previous,
+        resumed, run).
+        """
 
         date_str = date.isoformat()
-        params = self.params(date_str)
+        params = self.params(date_str, window)
+        window_key = window[0].isoformat() if window else ""
+        count = 0
+        resume = self.state.resume_point(date, window_key) if self.cursor_param else None
+        if resume and resume["done"]:
+            print(
+                "... {} {} already fetched ({} records)".format(
+                    date_str, window_key, resume["count"]
+                ),
+                file=sys.stderr,
+            )
+            return resume["count"]
+        if resume:
+            assert self.cursor_param
+            params[self.cursor_param] = resume["cursor"]
+            count = resume["count"]
+            print(
+                "... resuming {} {} after {} records".format(date_str, window_key, count),
+                file=sys.stderr,
+            )
+        last_checkpoint = time.monotonic()
         http_session = requests_retry_session()
         http_session.headers.update(
             {
@@ -136,10 +252,12 @@ class HarvestCrossrefWorker:
                 ),
             }
         )
-        count = 0
         while True:
-            http_resp = http_session.get(self.api_host_url, params=params)
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+            http_resp = http_session.get(self.api_host_url, params=params, stream=True)
             if http_resp.status_code == 503:
+                http_resp.close()
                 # crude backoff; now redundant with session exponential
                 # backoff, but allows for longer backoff/downtime on remote end
                 print(
@@ -151,47 +269,134 @@ class HarvestCrossrefWorker:
                 time.sleep(30.0)
                 continue
             http_resp.raise_for_status()
+            resp: Dict[str, Any] = dict()
+            # the whole page is parsed before any of it is produced, so that a
+            # page which fails part-way through doesn't get partially produced
+            # (and then produced again when the harvest is re-run). Only the
+            # original JSON text of each item is kept.
+            page: List[Tuple[bytes, str, Optional[bytes]]] = []
             try:
-                resp_body = http_resp.text
-                resp = json.loads(resp_body)
+                for raw, work in iter_json_items(
+                    http_resp.iter_content(chunk_size=64 * 1024), self.items_path, resp
+                ):
+                    content_hash = self.content_hash(work) if self.content_hashes else None
+                    page.append((self.extract_key(work), raw, content_hash))
             except json.JSONDecodeError as exc:
-                # Datacite API returned HTTP 200, but JSON seemed unparseable.
-                # It might be a glitch, so we retry.
+                # API returned HTTP 200, but JSON seemed unparseable. Nothing
+                # from this page has been produced; fail, and the harvest gets
+                # re-tried (from the last checkpoint) on the next run.
                 print(
-                    "failed to decode body from {}: {}".format(http_resp.url, resp_body),
+                    "failed to decode body from {} (after {} items): {}".format(
+                        http_resp.url, len(page), exc
+                    ),
                     file=sys.stderr,
                 )
                 raise exc
-            items = self.extract_items(resp)
-            count += len(items)
-            print(
-                "... got {} ({} of {}), HTTP fetch took {}".format(
-                    len(items), count, self.extract_total(resp), http_resp.elapsed
-                ),
-                file=sys.stderr,
-            )
-            # print(json.dumps(resp))
-            for work in items:
+            finally:
+                http_resp.close()
+            batch_count = len(page)
+            unchanged = 0
+            for key, raw, content_hash in page:
+                if (
+                    self.content_hashes
+                    and content_hash is not None
+                    and self.content_hashes.unchanged(key, content_hash)
+                ):
+                    unchanged += 1
+                    continue
                 self.producer.produce(
                     self.produce_topic,
-                    json.dumps(work).encode("utf-8"),
-                    key=self.extract_key(work),
+                    raw.encode("utf-8"),
+                    key=key,
                     on_delivery=self._kafka_fail_fast,
                 )
+                if self.content_hashes and content_hash is not None:
+                    self.content_hashes.record(key, content_hash)
+            count += batch_count
+            print(
+                "... got {} ({} of {}, {} unchanged), HTTP fetch took {}".format(
+                    batch_count, count, self.extract_total(resp), unchanged, http_resp.elapsed
+                ),
+                file=sys.stderr,
+            )
             self.producer.poll(0)
-            if len(items) < self.api_batch_size:
+            if batch_count < self.api_batch_size:
                 break
             params = self.update_params(params, resp)
-        self.producer.flush()
-
-    def extract_items(self, resp: Dict[str, Any]) -> List[Dict]:
-        return resp["message"]["items"]
+            if self.cursor_param and (
+                time.monotonic() - last_checkpoint >= self.checkpoint_interval
+            ):
+                self.checkpoint(date, window_key, params[self.cursor_param], count)
+                last_checkpoint = time.monotonic()
+        if self.cursor_param and self.slices_per_day > 1:
+            # other windows of the date may not be complete yet
+            self.checkpoint(date, window_key, None, count, done=True)
+        return count
+
+    def checkpoint(
+        self,
+        date: datetime.date,
+        window_key: str,
+        cursor: Any,
+        count: int,
+        done: bool = False,
+    ) -> None:
+        # records before the cursor must be durable before the checkpoint is
+        self.flush()
+        self.state.checkpoint(
+            date,
+            cursor,
+            count,
+            window=window_key,
+            done=done,
+            kafka_topic=self.state_topic,
+            kafka_config=self.kafka_config,
+        )
 
     def extract_total(self, resp: Dict[str, Any]) -> int:
         return resp["message"]["total-results"]
 
+    def fetch_dates(
+        self, executor: concurrent.futures.ThreadPoolExecutor, dates: List[datetime.date]
+    ) -> None:
+        """
+        Fetches all time windows of all the dates concurrently, marking each
+        date complete as soon as all of its windows are done.
+        """
+        remaining: Dict[datetime.date, int] = dict()
+        futures: Dict[concurrent.futures.Future, datetime.date] = dict()
+        for date in dates:
+            windows = self.date_windows(date)
+            remaining[date] = len(windows)
+            print(
+                "Fetching DOIs updated on {} (UTC), in {} slices".format(date, len(windows)),
+                file=sys.stderr,
+            )
+            for window in windows:
+                futures[executor.submit(self.fetch_window, date, window)] = date
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                date = futures[future]
+                future.result()
+                remaining[date] -= 1
+                if remaining[date] == 0:
+                    # everything for the date must be delivered before it is
+                    # recorded as complete
+                    self.flush()
+                    self.state.complete(
+                        date, kafka_topic=self.state_topic, kafka_config=self.kafka_config
+                    )
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
     def run(self, continuous: bool = False) -> None:
 
+        if self.concurrency > 1 or self.slices_per_day > 1:
+            self.run_concurrent(continuous)
+            return
+
         while True:
             current = self.state.next_span(continuous)
             if current:
@@ -209,6 +414,22 @@ class HarvestCrossrefWorker:
                 break
         print("{} DOI ingest caught up".format(self.name), file=sys.stderr)
 
+    def run_concurrent(self, continuous: bool = False) -> None:
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                dates = self.state.pending_spans(continuous)
+                if dates:
+                    self.fetch_dates(executor, dates)
+                    continue
+
+                if continuous:
+                    print("Sleeping {} seconds...".format(self.loop_sleep), file=sys.stderr)
+                    time.sleep(self.loop_sleep)
+                else:
+                    break
+        print("{} DOI ingest caught up".format(self.name), file=sys.stderr)
+
 
 class HarvestDataciteWorker(HarvestCrossrefWorker):
     """
@@ -231,6 +452,10 @@ class HarvestDataciteWorker(HarvestCrossrefWorker):
         api_host_url: str = "https://api.datacite.org/dois",
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
+        concurrency: int = 1,
+        max_rate: Optional[float] = None,
+        slices_per_day: int = 1,
+        content_hash_db: Optional[str] = None,
     ):
         super().__init__(
             kafka_hosts=kafka_hosts,
@@ -240,32 +465,70 @@ class HarvestDataciteWorker(HarvestCrossrefWorker):
             contact_email=contact_email,
             start_date=start_date,
             end_date=end_date,
+            concurrency=concurrency,
+            max_rate=max_rate,
+            content_hash_db=content_hash_db,
         )
 
         # for datecite, it's "from-update-date"
         self.name = "Datacite"
+        self.items_path = ("data",)
+        self.volatile_fields = (
+            "updated",
+            "citationCount",
+            "citationsOverTime",
+            "viewCount",
+            "viewsOverTime",
+            "downloadCount",
+            "downloadsOverTime",
+            "referenceCount",
+            "partCount",
+            "partOfCount",
+            "versionCount",
+            "versionOfCount",
+        )
+        self.cursor_param = "page[cursor]"
+        self.slices_per_day = slices_per_day
 
-    def params(self, date_str: str) -> Dict[str, Any]:
+    def params(self, date_str: str, window: Optional[TimeWindow] = None) -> Dict[str, Any]:
         """
         Dates have to be supplied in 2018-10-27T22:36:30.000Z format.
         """
-        return {
-            "query": "updated:[{}T00:00:00.000Z TO {}T23:59:59.999Z]".format(
+        if window:
+            start, end = window
+            updated = "updated:[{}.{:03d}Z TO {}.{:03d}Z]".format(
+                start.strftime("%Y-%m-%dT%H:%M:%S"),
+                start.microsecond // 1000,
+                end.strftime("%Y-%m-%dT%H:%M:%S"),
+                end.microsecond // 1000,
+            )
+        else:
+            updated = "updated:[{}T00:00:00.000Z TO {}T23:59:59.999Z]".format(
                 date_str, date_str
-            ),
+            )
+        return {
+            "query": updated,
             "page[size]": self.api_batch_size,
             "page[cursor]": 1,
         }
 
-    def extract_items(self, resp: Dict[str, Any]) -> List[Dict]:
-        return resp["data"]
-
     def extract_total(self, resp: Dict[str, Any]) -> int:
         return resp["meta"]["total"]
 
     def extract_key(self, obj: Dict[str, Any]) -> bytes:
         return obj["attributes"]["doi"].encode("utf-8")
 
+    def content_hash(self, obj: Dict[str, Any]) -> bytes:
+        """
+        Ignores "relationships" (citations, views, etc) and volatile
+        attributes.
+        """
+        normalized = {k: v for k, v in obj.items() if k not in ("attributes", "relationships")}
+        normalized["attributes"] = {
+            k: v for k, v in obj["attributes"].items() if k not in self.volatile_fields
+        }
+        return ContentHashIndex.hash_content(normalized)
+
     def update_params(self, params: Dict[str, Any], resp: Dict[str, Any]) -> Dict[str, Any]:
         """
         Using cursor mechanism (https://support.datacite.org/docs/pagination#section-cursor).
@@ -1,7 +1,13 @@
+import codecs
 import datetime
+import hashlib
 import json
+import re
+import sqlite3
 import sys
-from typing import Any, Dict, Optional, Sequence, Set
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
 import requests
 from confluent_kafka import Consumer, KafkaException, Producer, TopicPartition
@@ -38,6 +44,242 @@ def requests_retry_session(
     return session
 
 
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# characters which can continue a JSON number
+_JSON_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+_JSON_DECODER = json.JSONDecoder()
+
+
+class _JsonStream:
+    """
+    Incrementally decoded text of a JSON document, arriving as a sequence of
+    (UTF-8) bytes chunks. Text before `pos` has been consumed, and is dropped
+    as more chunks are read.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self) -> bool:
+        """
+        Reads the next chunk. Returns False if there was nothing left to read.
+        """
+        if self.eof:
+            return False
+        self.text = self.text[self.pos :]
+        self.pos = 0
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.text += self.decoder.decode(b"", final=True)
+            self.eof = True
+            return True
+        self.text += self.decoder.decode(chunk)
+        return True
+
+    def peek(self) -> str:
+        """
+        Skips whitespace, and returns the next character ("" at end).
+        """
+        while True:
+            self.pos = _JSON_WHITESPACE.match(self.text, self.pos).end()  # type: ignore
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if not c or c not in chars:
+            raise json.JSONDecodeError(
+                "Expecting one of {!r}".format(chars), self.text, self.pos
+            )
+        self.pos += 1
+        return c
+
+    def value(self) -> Tuple[str, Any]:
+        """
+        Decodes the next JSON value. Returns the original text of the value
+        along with the decoded value.
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = _JSON_DECODER.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # value may be incomplete
+                if self.more():
+                    continue
+                raise
+            # a number at the end of the text may have been cut short, either
+            # where it ends (eg, "12" of "123") or just after a "." or "e"
+            # which the decoder leaves behind (eg, "1" of "1.5")
+            tail = _JSON_NUMBER_TAIL.match(self.text, end).end()  # type: ignore
+            if tail == len(self.text) and self.more():
+                continue
+            raw = self.text[self.pos : end]
+            self.pos = end
+            return raw, obj
+
+
+def _iter_json_object(
+    stream: _JsonStream, path: Sequence[str], envelope: Dict[str, Any]
+) -> Iterator[Tuple[str, Any]]:
+    stream.expect("{")
+    if stream.peek() == "}":
+        stream.pos += 1
+        return
+    while True:
+        _, key = stream.value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting object key", stream.text, stream.pos)
+        stream.expect(":")
+        if path and key == path[0] and len(path) == 1:
+            envelope[key] = []
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.pos += 1
+            else:
+                while True:
+                    yield stream.value()
+                    if stream.expect(",]") == "]":
+                        break
+        elif path and key == path[0]:
+            envelope[key] = dict()
+            yield from _iter_json_object(stream, path[1:], envelope[key])
+        else:
+            envelope[key] = stream.value()[1]
+        if stream.expect(",}") == "}":
+            return
+
+
+def iter_json_items(
+    chunks: Iterable[bytes], path: Sequence[str], envelope: Dict[str, Any]
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Incrementally parses a JSON object from a sequence of bytes chunks (eg,
+    `requests.Response.iter_content()`), yielding the elements of the array
+    found at `path` (a sequence of object keys) one at a time, as tuples of
+    (original JSON text, decoded value). Only a single element needs to be
+    held in memory at a time.
+
+    Everything else in the document is decoded in to the `envelope` dict,
+    with an empty list in place of the array, and can be used once iteration
+    is complete.
+
+    Raises json.JSONDecodeError if the document is malformed.
+    """
+    stream = _JsonStream(chunks)
+    yield from _iter_json_object(stream, path, envelope)
+    if stream.peek():
+        raise json.JSONDecodeError("Extra data", stream.text, stream.pos)
+
+
+class ContentHashIndex:
+    """
+    Local (SQLite) index of a content hash per record key, used to recognize
+    harvested records whose (normalized) content hasn't changed since they
+    were last harvested.
+
+    Callers check a record with `unchanged()`, and `record()` its hash only
+    after producing it. Recorded hashes are held as pending until `commit()`,
+    which takes a `flush` callback: pending hashes are set aside first, then
+    flushed, then written, so only hashes of records which were produced
+    before the flush (and so have been delivered) get written.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS content_hash "
+            "(key BLOB PRIMARY KEY, hash BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.db.commit()
+        self.pending: Dict[bytes, bytes] = dict()
+        # set aside by an in-progress commit(), but not yet written
+        self.committing: Dict[bytes, bytes] = dict()
+        self.lock = threading.Lock()
+        # commits are serialized, so that an older hash is never written over
+        # a newer one
+        self.commit_lock = threading.Lock()
+
+    @staticmethod
+    def hash_content(content: Any) -> bytes:
+        """
+        Hashes a JSON-serializable object, independent of key order.
+        """
+        normalized = json.dumps(content, sort_keys=True, separators=(",", ":"))
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+    def unchanged(self, key: bytes, content_hash: bytes) -> bool:
+        """
+        Returns True if the hash is the same as the last one recorded for the
+        key.
+        """
+        with self.lock:
+            previous = self.pending.get(key) or self.committing.get(key)
+            if previous is None:
+                row = self.db.execute(
+                    "SELECT hash FROM content_hash WHERE key = ?", (key,)
+                ).fetchone()
+                previous = row[0] if row else None
+            return previous == content_hash
+
+    def record(self, key: bytes, content_hash: bytes) -> None:
+        """
+        Records a new hash for the key (as pending). Call only once the record
+        has been produced.
+        """
+        with self.lock:
+            self.pending[key] = content_hash
+
+    def commit(self, flush: Optional[Callable[[], Any]] = None) -> None:
+        with self.commit_lock:
+            with self.lock:
+                self.committing, self.pending = self.pending, dict()
+            if flush:
+                flush()
+            with self.lock:
+                if self.committing:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO content_hash (key, hash) VALUES (?, ?)",
+                        self.committing.items(),
+                    )
+                    self.db.commit()
+                self.committing = dict()
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+class RateLimiter:
+    """
+    Spaces out calls to `wait()` so that, across all threads sharing the
+    limiter, there are at most `rate` calls per second.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            when = max(now, self.next_time)
+            self.next_time = when + self.interval
+        if when > now:
+            time.sleep(when - now)
+
+
 class HarvestState:
     """
     First version of this works with full days (dates)
@@ -51,6 +293,11 @@ class HarvestState:
     - creates an to_process set
     - for each update, pops date from in_progress (if exits)
 
+    Harvesters with resumable cursors can also checkpoint progress part-way
+    through a date (or a time window within a date): the cursor to resume
+    from, and the number of records produced so far. These are kept in
+    `in_progress` (by date, then window) until the date is completed.
+
     NOTE: this thing is sorta over-engineered... but might grow in the future
     NOTE: should this class manage the state topic as well? Hrm.
     """
@@ -63,13 +310,15 @@ class HarvestState:
     ):
         self.to_process: Set[datetime.date] = set()
         self.completed: Set[datetime.date] = set()
+        self.in_progress: Dict[datetime.date, Dict[str, Dict[str, Any]]] = dict()
+        self.lock = threading.Lock()
 
         if catchup_days or start_date or end_date:
             self.enqueue_period(start_date, end_date, catchup_days)
 
     def __str__(self) -> str:
-        return "<HarvestState to_process={}, completed={}>".format(
-            len(self.to_process), len(self.completed)
+        return "<HarvestState to_process={}, completed={}, in_progress={}>".format(
+            len(self.to_process), len(self.completed), len(self.in_progress)
         )
 
     def enqueue_period(
@@ -107,14 +356,22 @@ class HarvestState:
         timespans; the idea is to call next_span() repeatedly, and it will return a
         new timespan when it becomes "available".
         """
+        spans = self.pending_spans(continuous)
+        if not spans:
+            return None
+        return spans[0]
+
+    def pending_spans(self, continuous: bool = False) -> List[datetime.date]:
+        """
+        Like next_span(), but returns all timespans (dates) remaining to be
+        processed, oldest first, so they can be worked on concurrently.
+        """
         if continuous:
             # enqueue yesterday
             self.enqueue_period(
                 start_date=datetime.datetime.utcnow().date() - datetime.timedelta(days=1)
             )
-        if not self.to_process:
-            return None
-        return sorted(list(self.to_process))[0]
+        return sorted(self.to_process)
 
     def update(self, state_json: str) -> None:
         """
@@ -127,6 +384,16 @@ class HarvestState:
         if "completed-date" in state:
             date = datetime.datetime.strptime(state["completed-date"], DATE_FMT).date()
             self.complete(date)
+        elif "checkpoint-date" in state:
+            date = datetime.datetime.strptime(state["checkpoint-date"], DATE_FMT).date()
+            if date not in self.completed:
+                self.checkpoint(
+                    date,
+                    state["cursor"],
+                    state["count"],
+                    window=state.get("window", ""),
+                    done=state.get("done", False),
+                )
 
     def complete(
         self,
@@ -142,38 +409,94 @@ class HarvestState:
 
         kafka_topic should be a string. A producer will be created and destroyed.
         """
-        try:
-            self.to_process.remove(date)
-        except KeyError:
-            pass
-        self.completed.add(date)
+        with self.lock:
+            try:
+                self.to_process.remove(date)
+            except KeyError:
+                pass
+            self.completed.add(date)
+            self.in_progress.pop(date, None)
+            state_json = json.dumps(
+                {
+                    "in-progress-dates": [str(d) for d in self.to_process],
+                    "completed-date": str(date),
+                }
+            ).encode("utf-8")
+        if kafka_topic:
+            assert kafka_config
+            self._publish(state_json, kafka_topic, kafka_config)
+        return state_json
+
+    def checkpoint(
+        self,
+        date: datetime.date,
+        cursor: Any,
+        count: int,
+        window: str = "",
+        done: bool = False,
+        kafka_topic: Optional[str] = None,
+        kafka_config: Optional[Dict] = None,
+    ) -> bytes:
+        """
+        Records progress part-way through a date: `cursor` is where to resume
+        fetching from, and `count` is the number of records produced so far.
+        `window` identifies a time window within the date, if the date is
+        being fetched in slices; `done` indicates that the window is complete.
+
+        Callers must ensure everything fetched before the cursor has been
+        delivered before publishing a checkpoint to Kafka.
+
+        Like complete(), returns a JSON representation, and will publish to a
+        kafka topic if passed as an argument.
+        """
+        with self.lock:
+            self.in_progress.setdefault(date, dict())[window] = dict(
+                cursor=cursor, count=count, done=done
+            )
         state_json = json.dumps(
             {
-                "in-progress-dates": [str(d) for d in self.to_process],
-                "completed-date": str(date),
+                "checkpoint-date": str(date),
+                "window": window,
+                "cursor": cursor,
+                "count": count,
+                "done": done,
             }
         ).encode("utf-8")
         if kafka_topic:
             assert kafka_config
+            self._publish(state_json, kafka_topic, kafka_config)
+        return state_json
 
-            def fail_fast(err: Any, _msg: Any) -> None:
-                if err:
-                    raise KafkaException(err)
+    def resume_point(self, date: datetime.date, window: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Returns the most recent checkpoint (a dict with cursor, count, and
+        done keys) for the date and window, if there is one.
+        """
+        with self.lock:
+            return self.in_progress.get(date, dict()).get(window)
 
-            print("Committing status to Kafka: {}".format(kafka_topic), file=sys.stderr)
-            producer_conf = kafka_config.copy()
-            producer_conf.update(
-                {
-                    "delivery.report.only.error": True,
-                    "default.topic.config": {
-                        "request.required.acks": -1,  # all brokers must confirm
-                    },
-                }
-            )
-            producer = Producer(producer_conf)
-            producer.produce(kafka_topic, state_json, on_delivery=fail_fast)
-            producer.flush()
-        return state_json
+    def _publish(self, state_json: bytes, kafka_topic: str, kafka_config: Dict) -> None:
+        """
+        A producer is created and destroyed for each state update.
+        """
+
+        def fail_fast(err: Any, _msg: Any) -> None:
+            if err:
+                raise KafkaException(err)
+
+        print("Committing status to Kafka: {}".format(kafka_topic), file=sys.stderr)
+        producer_conf = kafka_config.copy()
+        producer_conf.update(
+            {
+                "delivery.report.only.error": True,
+                "default.topic.config": {
+                    "request.required.acks": -1,  # all brokers must confirm
+                },
+            }
+        )
+        producer = Producer(producer_conf)
+        producer.produce(kafka_topic, state_json, on_delivery=fail_fast)
+        producer.flush()
 
     def initialize_from_kafka(self, kafka_topic: str, kafka_config: Dict[str, Any]) -> None:
         """
@@ -1,12 +1,33 @@
+import concurrent.futures
 import datetime
 import sys
 import time
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import requests
 import sickle
 from confluent_kafka import KafkaException, Producer
 
-from .harvest_common import HarvestState
+from .harvest_common import HarvestState, RateLimiter
+
+# an OAI set (or None for all records), and a time window (start and end,
+# inclusive) within a date (or None for the whole date)
+Partition = Tuple[Optional[str], Optional[Tuple[datetime.datetime, datetime.datetime]]]
+
+
+class RateLimitedSickle(sickle.Sickle):
+    """
+    Sickle client which waits on a (shared) RateLimiter before every request.
+    """
+
+    def __init__(self, endpoint: str, rate_limiter: Optional[RateLimiter] = None, **kwargs):
+        super().__init__(endpoint, **kwargs)
+        self.rate_limiter = rate_limiter
+
+    def _request(self, kwargs: Dict[str, Any]) -> requests.Response:
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        return super()._request(kwargs)
 
 
 class HarvestOaiPmhWorker:
@@ -24,6 +45,15 @@ class HarvestOaiPmhWorker:
     Was very tempted to re-use <https://github.com/miku/metha> for this OAI-PMH
     stuff to save on dev time, but i'd already built the Crossref harvester and
     would want something similar operationally. Oh well!
+
+    Each date can optionally be partitioned by OAI set (`sets`), and/or in to
+    `slices_per_day` time windows (only if the endpoint supports seconds
+    granularity), with up to `concurrency` partitions (of any pending dates)
+    harvested at the same time. All partitions share a single Kafka producer.
+    Each partition checkpoints its resumption token to the state topic every
+    `checkpoint_interval` seconds, and resumes from there after a restart (if
+    the endpoint still accepts the token). `max_rate` is a global limit on
+    OAI-PMH requests per second.
     """
 
     def __init__(
@@ -33,6 +63,10 @@ class HarvestOaiPmhWorker:
         state_topic: str,
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
+        sets: Optional[List[str]] = None,
+        slices_per_day: int = 1,
+        concurrency: int = 1,
+        max_rate: Optional[float] = None,
     ):
 
         self.produce_topic = produce_topic
@@ -47,11 +81,17 @@ class HarvestOaiPmhWorker:
         self.endpoint_url = None  # needs override
         self.metadata_prefix = None  # needs override
         self.name = "unnamed"
+        self.sets = sets
+        self.slices_per_day = slices_per_day
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(max_rate) if max_rate else None
+        self.checkpoint_interval = 60.0
         self.state = HarvestState(start_date, end_date)
         self.state.initialize_from_kafka(self.state_topic, self.kafka_config)
         print(self.state, file=sys.stderr)
+        self.producer = self._kafka_producer()
 
-    def fetch_date(self, date: datetime.date) -> None:
+    def _kafka_producer(self) -> Producer:
         def fail_fast(err: Any, _msg: Any) -> None:
             if err is not None:
                 print("Kafka producer delivery error: {}".format(err), file=sys.stderr)
@@ -59,6 +99,8 @@ class HarvestOaiPmhWorker:
                 # TODO: should it be sys.exit(-1)?
                 raise KafkaException(err)
 
+        self._kafka_fail_fast = fail_fast
+
         producer_conf = self.kafka_config.copy()
         producer_conf.update(
             {
@@ -68,42 +110,187 @@ class HarvestOaiPmhWorker:
                 },
             }
         )
-        producer = Producer(producer_conf)
+        return Producer(producer_conf)
 
-        api = sickle.Sickle(self.endpoint_url, max_retries=5, retry_status_codes=[503])
-        date_str = date.isoformat()
-        # this dict kwargs hack is to work around 'from' as a reserved python keyword
-        # recommended by sickle docs
-        try:
-            records = api.ListRecords(
-                **{
-                    "metadataPrefix": self.metadata_prefix,
-                    "from": date_str,
-                    "until": date_str,
-                }
+    def date_partitions(self, date: datetime.date) -> List[Partition]:
+        windows: List[Optional[Tuple[datetime.datetime, datetime.datetime]]] = [None]
+        if self.slices_per_day > 1:
+            day_start = datetime.datetime.combine(date, datetime.time())
+            step = datetime.timedelta(days=1) / self.slices_per_day
+            windows = [
+                (
+                    day_start + step * i,
+                    day_start + step * (i + 1) - datetime.timedelta(seconds=1),
+                )
+                for i in range(self.slices_per_day)
+            ]
+        sets: List[Optional[str]] = list(self.sets) if self.sets else [None]
+        return [(set_spec, window) for set_spec in sets for window in windows]
+
+    def fetch_date(self, date: datetime.date) -> None:
+        for partition in self.date_partitions(date):
+            self.fetch_partition(date, partition)
+        self.producer.flush()
+
+    def fetch_partition(self, date: datetime.date, partition: Partition) -> int:
+        """
+        Harvests all records of one partition of the date, producing them to
+        Kafka. Does not flush the producer.
+
+        Returns the number of records produced (including by any previous,
+        resumed, run).
+        """
+        set_spec, window = partition
+        partition_key = ""
+        if set_spec or window:
+            partition_key = "{}@{}".format(
+                set_spec or "", window[0].isoformat() if window else ""
             )
-        except sickle.oaiexceptions.NoRecordsMatch:
+        date_str = date.isoformat()
+        api = RateLimitedSickle(
+            self.endpoint_url,
+            rate_limiter=self.rate_limiter,
+            max_retries=5,
+            retry_status_codes=[503],
+        )
+
+        count = 0
+        records = None
+        resume = self.state.resume_point(date, partition_key)
+        if resume and resume["done"]:
+            return resume["count"]
+        if resume:
             print(
-                "WARN: no OAI-PMH records for this date: {} (UTC)".format(date_str),
+                "... resuming {} {} after {} records".format(
+                    date_str, partition_key, resume["count"]
+                ),
                 file=sys.stderr,
             )
-            return
+            try:
+                records = api.ListRecords(resumptionToken=resume["cursor"])
+                count = resume["count"]
+            except sickle.oaiexceptions.BadResumptionToken:
+                print(
+                    "WARN: resumption token expired, restarting {} {}".format(
+                        date_str, partition_key
+                    ),
+                    file=sys.stderr,
+                )
+        if records is None:
+            # this dict kwargs hack is to work around 'from' as a reserved python keyword
+            # recommended by sickle docs
+            params = {
+                "metadataPrefix": self.metadata_prefix,
+                "from": date_str,
+                "until": date_str,
+            }
+            if window:
+                params["from"] = window[0].strftime("%Y-%m-%dT%H:%M:%SZ")
+                params["until"] = window[1].strftime("%Y-%m-%dT%H:%M:%SZ")
+            if set_spec:
+                params["set"] = set_spec
+            try:
+                records = api.ListRecords(**params)
+            except sickle.oaiexceptions.NoRecordsMatch:
+                print(
+                    "WARN: no OAI-PMH records for this date: {} {} (UTC)".format(
+                        date_str, partition_key
+                    ),
+                    file=sys.stderr,
+                )
+                records = iter([])
 
-        count = 0
+        # the token which will fetch the next page (changes when it is used)
+        next_token = _resumption_token(records)
+        last_checkpoint = time.monotonic()
         for item in records:
+            token = _resumption_token(records)
+            if token != next_token:
+                # a new page was just fetched with next_token, and everything
+                # before that page has been produced
+                if (
+                    next_token
+                    and time.monotonic() - last_checkpoint >= self.checkpoint_interval
+                ):
+                    self.checkpoint(date, partition_key, next_token, count)
+                    last_checkpoint = time.monotonic()
+                next_token = token
             count += 1
             if count % 50 == 0:
                 print("... up to {}".format(count), file=sys.stderr)
-            producer.produce(
+            self.producer.produce(
                 self.produce_topic,
                 item.raw.encode("utf-8"),
                 key=item.header.identifier.encode("utf-8"),
-                on_delivery=fail_fast,
+                on_delivery=self._kafka_fail_fast,
             )
-        producer.flush()
+            self.producer.poll(0)
+        if len(self.date_partitions(date)) > 1:
+            # other partitions of the date may not be complete yet
+            self.checkpoint(date, partition_key, None, count, done=True)
+        return count
+
+    def checkpoint(
+        self,
+        date: datetime.date,
+        partition_key: str,
+        token: Optional[str],
+        count: int,
+        done: bool = False,
+    ) -> None:
+        # records before the token must be durable before the checkpoint is
+        self.producer.flush()
+        self.state.checkpoint(
+            date,
+            token,
+            count,
+            window=partition_key,
+            done=done,
+            kafka_topic=self.state_topic,
+            kafka_config=self.kafka_config,
+        )
+
+    def fetch_dates(
+        self, executor: concurrent.futures.ThreadPoolExecutor, dates: List[datetime.date]
+    ) -> None:
+        """
+        Harvests all partitions of all the dates concurrently, marking each
+        date complete as soon as all of its partitions are done.
+        """
+        remaining: Dict[datetime.date, int] = dict()
+        futures: Dict[concurrent.futures.Future, datetime.date] = dict()
+        for date in dates:
+            partitions = self.date_partitions(date)
+            remaining[date] = len(partitions)
+            print(
+                "Fetching records updated on {} (UTC), in {} partitions".format(
+                    date, len(partitions)
+                ),
+                file=sys.stderr,
+            )
+            for partition in partitions:
+                futures[executor.submit(self.fetch_partition, date, partition)] = date
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                date = futures[future]
+                future.result()
+                remaining[date] -= 1
+                if remaining[date] == 0:
+                    self.producer.flush()
+                    self.state.complete(
+                        date, kafka_topic=self.state_topic, kafka_config=self.kafka_config
+                    )
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
 
     def run(self, continuous: bool = False) -> None:
 
+        if self.concurrency > 1:
+            self.run_concurrent(continuous)
+            return
+
         while True:
             current = self.state.next_span(continuous)
             if current:
@@ -121,6 +308,29 @@ class HarvestOaiPmhWorker:
                 break
         print("{} OAI-PMH ingest caught up".format(self.name), file=sys.stderr)
 
+    def run_concurrent(self, continuous: bool = False) -> None:
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                dates = self.state.pending_spans(continuous)
+                if dates:
+                    self.fetch_dates(executor, dates)
+                    continue
+
+                if continuous:
+                    print("Sleeping {} seconds...".format(self.loop_sleep), file=sys.stderr)
+                    time.sleep(self.loop_sleep)
+                else:
+                    break
+        print("{} OAI-PMH ingest caught up".format(self.name), file=sys.stderr)
+
+
+def _resumption_token(records: Any) -> Optional[str]:
+    resumption_token = getattr(records, "resumption_token", None)
+    if resumption_token is None:
+        return None
+    return resumption_token.token or None
+
 
 class HarvestArxivWorker(HarvestOaiPmhWorker):
     """
@@ -9,9 +9,11 @@ Assumptions:
 """
 
 import collections
+import concurrent.futures
 import datetime
 import ftplib
 import gzip
+import hashlib
 import io
 import os
 import re
@@ -23,11 +25,10 @@ import tempfile
 import time
 import xml.etree.ElementTree as ET
 import zlib
-from typing import Any, Dict, Generator, Optional
+from typing import IO, Any, Dict, Generator, List, Optional, Union
 from urllib.parse import urlparse
 
 import dateparser
-from bs4 import BeautifulSoup
 from confluent_kafka import KafkaException, Producer
 
 from .harvest_common import HarvestState
@@ -61,6 +62,11 @@ class PubmedFTPWorker:
         <table cellspacing="0" cellpadding="0" border="0" width="300">
         <tr>
 
+    Update files are verified against their .md5 sidecar files before being
+    parsed, and up to `prefetch` upcoming files (including those of later
+    pending dates) are downloaded in the background while the current file
+    is parsed. If `download_dir` is set, verified files are kept there, and
+    not downloaded again by later runs.
     """
 
     def __init__(
@@ -70,6 +76,8 @@ class PubmedFTPWorker:
         state_topic: str,
         start_date: Optional[datetime.date] = None,
         end_date: Optional[datetime.date] = None,
+        prefetch: int = 2,
+        download_dir: Optional[str] = None,
     ):
         self.name = "Pubmed"
         self.host = "ftp.ncbi.nlm.nih.gov"
@@ -84,6 +92,14 @@ class PubmedFTPWorker:
         self.state.initialize_from_kafka(self.state_topic, self.kafka_config)
         self.producer = self._kafka_producer()
         self.date_file_map: Optional[Dict[str, Any]] = None
+        self.prefetch = prefetch
+        self.download_dir = download_dir
+        self.max_download_attempts = 3
+        # TODO: proxy obsolete, when networking issue is resolved
+        self.proxy_hostport = "159.69.240.245:15201"
+        self.download_executor = concurrent.futures.ThreadPoolExecutor(max_workers=prefetch + 1)
+        # background downloads, by path; result is local filename
+        self.downloads: Dict[str, concurrent.futures.Future] = dict()
 
     def _kafka_producer(self) -> Producer:
         def fail_fast(err: Any, _msg: None) -> None:
@@ -128,50 +144,110 @@ class PubmedFTPWorker:
             )
             return False
 
+        paths = sorted(paths)
+        # files of later pending dates can be prefetched as well
+        upcoming = list(paths)
+        for pending in self.state.pending_spans():
+            pending_str = pending.strftime("%Y-%m-%d")
+            if pending_str > date_str:
+                upcoming.extend(sorted(self.date_file_map.get(pending_str, [])))
+
         count = 0
-        for path in paths:
-            # Fetch and decompress file.
+        for i, path in enumerate(paths):
             url = "ftp://{}{}".format(self.host, path)
-            filename = ftpretr(
-                url, proxy_hostport="159.69.240.245:15201"
-            )  # TODO: proxy obsolete, when networking issue is resolved
-            with tempfile.NamedTemporaryFile(prefix="fatcat-ftp-tmp-", delete=False) as decomp:
-                try:
-                    gzf = gzip.open(filename)
-                    shutil.copyfileobj(gzf, decomp)
-                except zlib.error as exc:
-                    print(
-                        "[skip] retrieving {} failed with {} (maybe empty, missing or broken gzip)".format(
-                            url, exc
-                        ),
-                        file=sys.stderr,
-                    )
-                    continue
-
-            # Here, blob is the unparsed XML; we peek into it to use PMID as
-            # message key. We need streaming, since some updates would consume
-            # GBs otherwise.
+            # the next few files keep downloading while this one is parsed
+            self.prefetch_files(upcoming[i : i + 1 + self.prefetch])
+            filename = self.downloads.pop(path).result()
+
+            # Articles are parsed straight from the compressed file, without
+            # decompressing to disk; we take the (first) PMID of each article
+            # element as message key. We need streaming, since some updates
+            # would consume GBs otherwise.
             # WARNING: Parsing foreign XML exposes us at some
             # https://docs.python.org/3/library/xml.html#xml-vulnerabilities
             # here.
-            for blob in xmlstream(decomp.name, "PubmedArticle", encoding="utf-8"):
-                soup = BeautifulSoup(blob, "xml")
-                pmid = soup.find("PMID")
-                if pmid is None:
-                    raise ValueError("no PMID found, please adjust identifier extraction")
-                count += 1
-                if count % 50 == 0:
-                    print("... up to {}".format(count), file=sys.stderr)
-                self.producer.produce(
-                    self.produce_topic, blob, key=pmid.text, on_delivery=self._kafka_fail_fast
+            try:
+                with gzip.open(filename) as gzf:
+                    for elem in xmlelements(gzf, "PubmedArticle"):
+                        pmid = elem.find(".//PMID")
+                        if pmid is None or not pmid.text:
+                            raise ValueError(
+                                "no PMID found, please adjust identifier extraction"
+                            )
+                        count += 1
+                        if count % 50 == 0:
+                            print("... up to {}".format(count), file=sys.stderr)
+                        self.producer.produce(
+                            self.produce_topic,
+                            ET.tostring(elem, encoding="utf-8"),
+                            key=pmid.text,
+                            on_delivery=self._kafka_fail_fast,
+                        )
+            except (zlib.error, EOFError, gzip.BadGzipFile) as exc:
+                print(
+                    "[skip] retrieving {} failed with {} (maybe empty, missing or broken gzip)".format(
+                        url, exc
+                    ),
+                    file=sys.stderr,
                 )
+                continue
 
             self.producer.flush()
-            os.remove(filename)
-            os.remove(decomp.name)
+            if not self.download_dir:
+                os.remove(filename)
 
         return True
 
+    def prefetch_files(self, paths: List[str]) -> None:
+        """
+        Starts background downloads of any of the paths not already started.
+        """
+        for path in paths:
+            if path not in self.downloads:
+                self.downloads[path] = self.download_executor.submit(self.download, path)
+
+    def download(self, path: str) -> str:
+        """
+        Retrieves an update file, and verifies it against its .md5 sidecar
+        file, retrying on mismatch. Returns the local filename.
+        """
+        url = "ftp://{}{}".format(self.host, path)
+        cached = None
+        if self.download_dir:
+            cached = os.path.join(self.download_dir, os.path.basename(path))
+            if os.path.exists(cached) and os.path.exists(cached + ".md5"):
+                with open(cached + ".md5") as f:
+                    if file_md5(cached) == f.read().strip():
+                        print("using cached {}".format(cached), file=sys.stderr)
+                        return cached
+
+        md5_filename = ftpretr(url + ".md5", proxy_hostport=self.proxy_hostport)
+        with open(md5_filename) as f:
+            expected = parse_md5(f.read())
+        os.remove(md5_filename)
+
+        for i in range(self.max_download_attempts):
+            filename = ftpretr(url, proxy_hostport=self.proxy_hostport)
+            actual = file_md5(filename)
+            if actual == expected:
+                break
+            print(
+                "md5 mismatch on {}: expected {}, got {} ({} retries left)".format(
+                    url, expected, actual, self.max_download_attempts - (i + 1)
+                ),
+                file=sys.stderr,
+            )
+            os.remove(filename)
+        else:
+            raise ValueError("md5 mismatch on {}, giving up".format(url))
+
+        if cached:
+            shutil.move(filename, cached)
+            with open(cached + ".md5", "w") as f:
+                f.write(expected + "\n")
+            return cached
+        return filename
+
     def run(self, continuous: bool = False) -> None:
         while True:
             self.date_file_map = generate_date_file_map(host=self.host)
@@ -269,6 +345,26 @@ def generate_date_file_map(host: str = "ftp.ncbi.nlm.nih.gov") -> Dict[str, Any]
     return mapping
 
 
+def parse_md5(sidecar: str) -> str:
+    """
+    Extracts the checksum from the contents of an .md5 sidecar file, like:
+
+        MD5(pubmed20n1016.xml.gz)= 6a9d2b4e3c1a2f0e8d7c6b5a49382716
+    """
+    match = re.search(r"\b([0-9a-fA-F]{32})\b", sidecar)
+    if match is None:
+        raise ValueError("no MD5 checksum found in: {}".format(sidecar[:200]))
+    return match.group(1).lower()
+
+
+def file_md5(filename: str) -> str:
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
 def ftpretr(
     url: str, max_retries: int = 10, retry_delay: int = 1, proxy_hostport: Optional[str] = None
 ) -> str:
@@ -352,18 +448,31 @@ def ftpretr_via_http_proxy(
     assert False, "Unreachable code branch"
 
 
-def xmlstream(filename: str, tag: str, encoding: str = "utf-8") -> Generator[Any, Any, Any]:
+def xmlstream(
+    source: Union[str, IO[bytes]], tag: str, encoding: str = "utf-8"
+) -> Generator[Any, Any, Any]:
     """
     Note: This might move into a generic place in the future.
 
-    Given a path to an XML file and a tag name (without namespace), stream
-    through the XML and yield elements denoted by tag as string.
+    Given a path to an XML file (or a binary file object) and a tag name
+    (without namespace), stream through the XML and yield elements denoted by
+    tag as string.
 
     for snippet in xmlstream("sample.xml", "sometag"):
         print(len(snippet))
 
     Known vulnerabilities: https://docs.python.org/3/library/xml.html#xml-vulnerabilities
     """
+    for elem in xmlelements(source, tag):
+        yield ET.tostring(elem, encoding=encoding)
+
+
+def xmlelements(source: Union[str, IO[bytes]], tag: str) -> Generator[ET.Element, None, None]:
+    """
+    Like xmlstream(), but yields the parsed elements themselves. Each element
+    (and everything parsed so far) is cleared once the caller moves on to the
+    next one, so only one element is in memory at a time.
+    """
 
     def strip_ns(tag: str) -> str:
         if "}" not in tag:
@@ -373,7 +482,7 @@ def xmlstream(filename: str, tag: str, encoding: str = "utf-8") -> Generator[Any
     # https://stackoverflow.com/a/13261805, http://effbot.org/elementtree/iterparse.htm
     context = iter(
         ET.iterparse(
-            filename,
+            source,
             events=(
                 "start",
                 "end",
@@ -389,5 +498,5 @@ def xmlstream(filename: str, tag: str, encoding: str = "utf-8") -> Generator[Any
         if not strip_ns(elem.tag) == tag or event == "start":
             continue
 
-        yield ET.tostring(elem, encoding=encoding)
+        yield elem
         root.clear()
@@ -0,0 +1,494 @@
+"""
+Local stand-ins for harvest upstreams and for Kafka, so that harvesters can be
+exercised (and benchmarked) offline.
+
+ReplayServer is an HTTP server which replays records from recorded API
+responses (the fixtures in `tests/files/`), in whatever volume is configured,
+with a fixed latency per request:
+
+- Crossref works API (`/works`, cursor paging)
+- Datacite DOIs API (`/dois`, cursor paging)
+- OAI-PMH `ListRecords` (`/oai2`, resumption tokens), using arXiv records
+- Pubmed update files (`/pubmed/updatefiles/*.xml.gz` and `.md5`); the Pubmed
+  harvester fetches these over HTTP (as from its FTP-to-HTTP proxy)
+
+Every distinct query (eg, date) returns `records` records, with unique keys.
+
+FileSink stands in for a Kafka producer, counting produced messages and
+optionally writing them to a file.
+
+Run as a script to serve, or to benchmark harvesters against the server:
+
+    python -m fatcat_tools.harvest.replay serve --port 8089
+    python -m fatcat_tools.harvest.replay --records 20000 bench crossref datacite
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+REPLAY_KEY = "__REPLAY_KEY__"
+PUBMED_RECORDS_PER_FILE = 176
+
+
+class FileSink:
+    """
+    Stand-in for a confluent_kafka Producer, which counts messages and
+    (optionally) appends message values, newline separated, to a file.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.count = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.output = open(path, "wb") if path else None
+
+    def produce(
+        self,
+        topic: str,
+        value: bytes,
+        key: Any = None,
+        on_delivery: Optional[Callable] = None,
+    ) -> None:
+        with self.lock:
+            self.count += 1
+            self.bytes += len(value)
+            if self.output:
+                self.output.write(value + b"\n")
+
+    def poll(self, timeout: Optional[float] = None) -> int:
+        return 0
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        if self.output:
+            with self.lock:
+                self.output.flush()
+        return 0
+
+    def close(self) -> None:
+        if self.output:
+            self.output.close()
+
+
+def _query_id(*parts: Any) -> str:
+    return hashlib.md5(repr(parts).encode("utf-8")).hexdigest()[:8]
+
+
+class ReplayServer:
+    """
+    Serves replayed harvest responses on `host:port` (port 0 picks a free
+    port; see `url` once started), from a background thread or process.
+    """
+
+    def __init__(
+        self,
+        fixtures_dir: str = "tests/files",
+        records: int = 1000,
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.records = records
+        self.latency = latency
+
+        with open(os.path.join(fixtures_dir, "crossref_api_works.json")) as f:
+            items = json.loads(f.readline())["message"]["items"]
+        self.crossref_items = [json.dumps(dict(item, DOI=REPLAY_KEY)) for item in items]
+
+        with open(os.path.join(fixtures_dir, "datacite_api.json")) as f:
+            items = json.loads(f.readline())["data"]
+        self.datacite_items = []
+        for item in items:
+            item = dict(item, id=REPLAY_KEY)
+            item["attributes"] = dict(item["attributes"], doi=REPLAY_KEY)
+            self.datacite_items.append(json.dumps(item))
+
+        with open(os.path.join(fixtures_dir, "arxivraw_1810.09584.xml")) as f:
+            record = re.search(r"<record>.*</record>", f.read(), re.DOTALL)
+        assert record
+        self.oai_record = record.group(0).replace("oai:arXiv.org:1810.09584", REPLAY_KEY)
+
+        with open(os.path.join(fixtures_dir, "pubmedsample_2019.xml.gz"), "rb") as f:
+            self.pubmed_file = f.read()
+        self.pubmed_md5 = hashlib.md5(self.pubmed_file).hexdigest()
+
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.process: Optional[multiprocessing.Process] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    @property
+    def hostport(self) -> str:
+        return self.url[len("http://") :]
+
+    def start(self, background: str = "thread") -> "ReplayServer":
+        """
+        `background` is "thread", or "process" to keep the cost of generating
+        responses out of the process being measured (requires fork).
+        """
+        if background == "process":
+            ctx = multiprocessing.get_context("fork")
+            self.process = ctx.Process(target=self.httpd.serve_forever, daemon=True)
+            self.process.start()
+        else:
+            thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self.process:
+            self.process.terminate()
+            self.process.join()
+        else:
+            self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def crossref_page(self, params: Dict[str, str]) -> Tuple[str, bytes]:
+        qid = _query_id(params.get("filter"))
+        cursor = params.get("cursor", "*")
+        offset = 0 if cursor == "*" else int(cursor)
+        rows = int(params.get("rows", 20))
+        end = min(offset + rows, self.records)
+        items = ",".join(
+            self.crossref_items[i % len(self.crossref_items)].replace(
+                REPLAY_KEY, "10.5555/replay-{}-{}".format(qid, i)
+            )
+            for i in range(offset, end)
+        )
+        body = (
+            '{{"status":"ok","message-type":"work-list","message-version":"1.0.0",'
+            '"message":{{"facets":{{}},"total-results":{},"items":[{}],'
+            '"items-per-page":{},"next-cursor":"{}"}}}}'
+        ).format(self.records, items, rows, end)
+        return "application/json", body.encode("utf-8")
+
+    def datacite_page(self, params: Dict[str, str]) -> Tuple[str, bytes]:
+        qid = _query_id(params.get("query"))
+        cursor = params.get("page[cursor]", "1")
+        offset = int(cursor[1:]) if cursor.startswith("r") else 0
+        size = int(params.get("page[size]", 25))
+        end = min(offset + size, self.records)
+        items = ",".join(
+            self.datacite_items[i % len(self.datacite_items)].replace(
+                REPLAY_KEY, "10.5555/replay-{}-{}".format(qid, i)
+            )
+            for i in range(offset, end)
+        )
+        next_url = "{}/dois?{}".format(
+            self.url, urlencode(dict(params, **{"page[cursor]": "r{}".format(end)}))
+        )
+        body = '{{"data":[{}],"meta":{{"total":{}}},"links":{{"next":{}}}}}'.format(
+            items, self.records, json.dumps(next_url)
+        )
+        return "application/json", body.encode("utf-8")
+
+    def oai_page(self, params: Dict[str, str]) -> Tuple[str, bytes]:
+        if "resumptionToken" in params:
+            query, _, offset_str = params["resumptionToken"].rpartition("|")
+            offset = int(offset_str)
+        else:
+            query = "|".join(params.get(k, "") for k in ("from", "until", "set"))
+            offset = 0
+        qid = _query_id(query)
+        end = min(offset + 100, self.records)
+        records = "".join(
+            self.oai_record.replace(REPLAY_KEY, "oai:replay:{}-{}".format(qid, i))
+            for i in range(offset, end)
+        )
+        token = "<resumptionToken/>"
+        if end < self.records:
+            token = "<resumptionToken>{}|{}</resumptionToken>".format(query, end)
+        if not records:
+            body = '<error code="noRecordsMatch">no records</error>'
+        else:
+            body = "<ListRecords>{}{}</ListRecords>".format(records, token)
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            "<responseDate>2019-01-01T00:00:00Z</responseDate>"
+            '<request verb="ListRecords">{}/oai2</request>{}</OAI-PMH>'
+        ).format(self.url, body)
+        return "text/xml", body.encode("utf-8")
+
+    def pubmed_file_for(self, path: str) -> Optional[Tuple[str, bytes]]:
+        name = os.path.basename(path)
+        if name.endswith(".xml.gz.md5"):
+            sidecar = "MD5({})= {}\n".format(name[:-4], self.pubmed_md5)
+            return "text/plain", sidecar.encode("utf-8")
+        if name.endswith(".xml.gz"):
+            return "application/gzip", self.pubmed_file
+        return None
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class ReplayHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                if server.latency:
+                    time.sleep(server.latency)
+                result: Optional[Tuple[str, bytes]] = None
+                if parsed.path == "/works":
+                    result = server.crossref_page(params)
+                elif parsed.path == "/dois":
+                    result = server.datacite_page(params)
+                elif parsed.path == "/oai2":
+                    result = server.oai_page(params)
+                elif parsed.path.startswith("/pubmed/updatefiles/"):
+                    result = server.pubmed_file_for(parsed.path)
+                if result is None:
+                    self.send_error(404)
+                    return
+                content_type, body = result
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return ReplayHandler
+
+
+def replay_harvester(
+    kind: str,
+    server: ReplayServer,
+    dates: List[datetime.date],
+    sink: FileSink,
+    **kwargs: Any,
+) -> Callable[[], None]:
+    """
+    Constructs a harvester of the given kind ("crossref", "datacite", "arxiv",
+    or "pubmed") pointed at the replay server and producing to the sink, with
+    no Kafka state topic. Returns a function which runs the harvest of all the
+    dates. Extra keyword arguments are passed to the harvester.
+    """
+    from .doi_registrars import HarvestCrossrefWorker, HarvestDataciteWorker
+    from .oaipmh import HarvestArxivWorker
+    from .pubmed import PubmedFTPWorker
+
+    common: Dict[str, Any] = dict(
+        kafka_hosts="",
+        produce_topic="replay",
+        state_topic="",
+        start_date=dates[0],
+        end_date=dates[-1],
+    )
+    common.update(kwargs)
+    harvester: Any
+    if kind == "crossref":
+        harvester = HarvestCrossrefWorker(
+            api_host_url=server.url + "/works", contact_email="replay@localhost", **common
+        )
+    elif kind == "datacite":
+        harvester = HarvestDataciteWorker(
+            api_host_url=server.url + "/dois", contact_email="replay@localhost", **common
+        )
+    elif kind == "arxiv":
+        harvester = HarvestArxivWorker(**common)
+        harvester.endpoint_url = server.url + "/oai2"
+    elif kind == "pubmed":
+        if "concurrency" in common:
+            common["prefetch"] = common.pop("concurrency")
+        harvester = PubmedFTPWorker(**common)
+        harvester.proxy_hostport = server.hostport
+        files = max(1, -(-server.records // PUBMED_RECORDS_PER_FILE))
+        harvester.date_file_map = {
+            date.isoformat(): set(
+                "/pubmed/updatefiles/replay{}n{:04d}.xml.gz".format(date.strftime("%Y%m%d"), i)
+                for i in range(files)
+            )
+            for date in dates
+        }
+    else:
+        raise ValueError("unknown harvester: {}".format(kind))
+    harvester.producer = sink
+
+    def run() -> None:
+        if kind == "pubmed":
+            # run() would fetch the date/file mapping from the real FTP server
+            for date in dates:
+                harvester.fetch_date(date)
+                harvester.state.complete(date)
+        else:
+            harvester.run()
+
+    return run
+
+
+def _bench_child(
+    kind: str,
+    server: ReplayServer,
+    dates: List[datetime.date],
+    output: Optional[str],
+    trace_memory: bool,
+    harvester_kwargs: Dict[str, Any],
+    results: Any,
+) -> None:
+    sink = FileSink(output)
+    run = replay_harvester(kind, server, dates, sink, **harvester_kwargs)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if trace_memory:
+        tracemalloc.start()
+    start = time.monotonic()
+    run()
+    seconds = time.monotonic() - start
+    result = dict(
+        harvester=kind,
+        records=sink.count,
+        megabytes=round(sink.bytes / 1024 / 1024, 2),
+        seconds=round(seconds, 3),
+        records_per_sec=round(sink.count / seconds, 1),
+        # ru_maxrss is in KiB on Linux
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        start_rss_mb=round(rss_start / 1024, 1),
+    )
+    if trace_memory:
+        result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    sink.close()
+    results.put(result)
+
+
+def run_benchmark(
+    kinds: List[str],
+    records: int = 1000,
+    days: int = 1,
+    latency: float = 0.0,
+    fixtures_dir: str = "tests/files",
+    output_dir: Optional[str] = None,
+    trace_memory: bool = False,
+    harvester_kwargs: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Runs each kind of harvester against a replay server (in its own process),
+    for `days` dates of `records` records each. Each harvester runs in a
+    separate (forked) process, so that peak memory is measured per harvester.
+
+    Returns a result dict (records, records/sec, peak memory, etc) for each.
+    """
+    server = ReplayServer(fixtures_dir=fixtures_dir, records=records, latency=latency)
+    server.start(background="process")
+    ctx = multiprocessing.get_context("fork")
+    dates = [datetime.date(2019, 1, 1) + datetime.timedelta(days=i) for i in range(days)]
+    all_results = []
+    try:
+        for kind in kinds:
+            output = os.path.join(output_dir, "{}.out".format(kind)) if output_dir else None
+            results = ctx.Queue()
+            child = ctx.Process(
+                target=_bench_child,
+                args=(
+                    kind,
+                    server,
+                    dates,
+                    output,
+                    trace_memory,
+                    harvester_kwargs or {},
+                    results,
+                ),
+            )
+            child.start()
+            child.join()
+            if child.exitcode != 0:
+                raise RuntimeError("{} benchmark failed (exit {})".format(kind, child.exitcode))
+            all_results.append(results.get())
+    finally:
+        server.stop()
+    return all_results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--fixtures-dir", default="tests/files", help="directory of recorded responses"
+    )
+    parser.add_argument(
+        "--records", default=1000, type=int, help="records per query (eg, per date)"
+    )
+    parser.add_argument(
+        "--latency", default=0.0, type=float, help="seconds of delay per HTTP request"
+    )
+    subparsers = parser.add_subparsers()
+
+    sub_serve = subparsers.add_parser("serve", help="run the replay server in the foreground")
+    sub_serve.set_defaults(cmd="serve")
+    sub_serve.add_argument("--host", default="127.0.0.1")
+    sub_serve.add_argument("--port", default=8089, type=int)
+
+    sub_bench = subparsers.add_parser(
+        "bench", help="measure harvester throughput and memory against the replay server"
+    )
+    sub_bench.set_defaults(cmd="bench")
+    sub_bench.add_argument(
+        "harvesters",
+        nargs="+",
+        choices=["crossref", "datacite", "arxiv", "pubmed"],
+    )
+    sub_bench.add_argument("--days", default=1, type=int, help="number of dates to harvest")
+    sub_bench.add_argument(
+        "--output-dir", default=None, help="write produced messages to files here"
+    )
+    sub_bench.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="also report peak python heap (tracemalloc; slows harvest)",
+    )
+    sub_bench.add_argument(
+        "--concurrency", default=None, type=int, help="harvester concurrency, if supported"
+    )
+
+    args = parser.parse_args()
+    if not args.__dict__.get("cmd"):
+        print("tell me what to do!")
+        sys.exit(-1)
+
+    if args.cmd == "serve":
+        server = ReplayServer(
+            fixtures_dir=args.fixtures_dir,
+            records=args.records,
+            latency=args.latency,
+            host=args.host,
+            port=args.port,
+        )
+        print("Replaying harvest responses on {}".format(server.url), file=sys.stderr)
+        server.httpd.serve_forever()
+        return
+
+    harvester_kwargs = dict()
+    if args.concurrency:
+        harvester_kwargs["concurrency"] = args.concurrency
+    for result in run_benchmark(
+        args.harvesters,
+        records=args.records,
+        days=args.days,
+        latency=args.latency,
+        fixtures_dir=args.fixtures_dir,
+        output_dir=args.output_dir,
+        trace_memory=args.trace_memory,
+        harvester_kwargs=harvester_kwargs,
+    ):
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
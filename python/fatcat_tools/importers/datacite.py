@@ -18,11 +18,10 @@ from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
 import dateparser
 import fatcat_openapi_client
 import langdetect
-import pycountry
 from fatcat_openapi_client import ApiClient, ReleaseContrib, ReleaseEntity
 
 from fatcat_tools.biblio_lookup_tables import DATACITE_TYPE_MAP
-from fatcat_tools.normal import clean_doi, clean_str, lookup_license_slug
+from fatcat_tools.normal import clean_doi, clean_str, lookup_license_slug, parse_lang_name
 from fatcat_tools.transforms import entity_to_dict
 
 from .common import MAX_ABSTRACT_LENGTH, EntityImporter
@@ -365,19 +364,12 @@ class DataciteImporter(EntityImporter):
         release_type = self.datacite_release_type(doi, attributes)
 
         # Language values are varied ("ger", "es", "English", "ENG", "en-us",
-        # "other", ...). Try to crush it with langcodes: "It may sound to you
-        # like langcodes solves a pretty boring problem. At one level, that's
-        # right. Sometimes you have a boring problem, and it's great when a
-        # library solves it for you." -- TODO(martin): We need more of these.
+        # "other", ...). Try to crush it with the precomputed pycountry
+        # lookup table in fatcat_tools.normal.
         language = None
-
         value = attributes.get("language", "") or ""
-        try:
-            language = pycountry.languages.lookup(value).alpha_2
-        except (LookupError, AttributeError) as err:  # noqa: F841
-            pass
-            # TODO(martin): Print this on debug level, only.
-            # print('[{}] language lookup miss for {}: {}'.format(doi, value, err), file=sys.stderr)
+        if isinstance(value, str):
+            language = parse_lang_name(value)
 
         # Abstracts appear in "attributes.descriptions[].descriptionType", some
         # of the observed values: "Methods", "TechnicalInfo",
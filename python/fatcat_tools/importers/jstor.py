@@ -8,8 +8,7 @@ import fatcat_openapi_client
 from bs4 import BeautifulSoup
 from fatcat_openapi_client import ApiClient, ReleaseEntity
 
-from fatcat_tools.biblio_lookup_tables import LANG_MAP_MARC
-from fatcat_tools.normal import clean_doi, clean_str
+from fatcat_tools.normal import clean_doi, clean_str, parse_marc_lang
 
 from .common import EntityImporter
 from .crossref import CONTAINER_TYPE_MAP
@@ -229,7 +228,7 @@ class JstorImporter(EntityImporter):
         cm = article_meta.find("custom-meta")
         if cm.find("meta-name").string == "lang":
             language = cm.find("meta-value").string.split()[0]
-            language = LANG_MAP_MARC.get(language)
+            language = parse_marc_lang(language)
             if not language:
                 warnings.warn("MISSING MARC LANG: {}".format(cm.find("meta-value").string))
 
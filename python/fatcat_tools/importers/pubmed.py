@@ -14,7 +14,14 @@ from fatcat_tools.biblio_lookup_tables import (
     MONTH_ABBR_MAP,
     PUBMED_RELEASE_TYPE_MAP,
 )
-from fatcat_tools.normal import clean_doi, clean_issn, clean_pmcid, clean_pmid, clean_str
+from fatcat_tools.normal import (
+    clean_doi,
+    clean_issn,
+    clean_pmcid,
+    clean_pmid,
+    clean_str,
+    parse_marc_lang,
+)
 
 from .common import EntityImporter
 
@@ -144,7 +151,7 @@ class PubmedImporter(EntityImporter):
                 # "undetermined"
                 language = None
             else:
-                language = LANG_MAP_MARC.get(language)
+                language = parse_marc_lang(language)
                 if not language and not (medline.Article.Language.get_text() in LANG_MAP_MARC):
                     warnings.warn(
                         "MISSING MARC LANG: {}".format(medline.Article.Language.string)
@@ -285,7 +292,7 @@ class PubmedImporter(EntityImporter):
         for other in other_abstracts:
             lang: Optional[str] = "en"
             if other.get("Language"):
-                lang = LANG_MAP_MARC.get(other["Language"])
+                lang = parse_marc_lang(other["Language"])
             abst = fatcat_openapi_client.ReleaseAbstract(
                 content=other.AbstractText.get_text().strip(),
                 mimetype="text/plain",
@@ -6,13 +6,13 @@ free-form input, titles, etc.
 import base64
 import re
 import unicodedata
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 
 import ftfy
 import langdetect
 import pycountry
 
-from .biblio_lookup_tables import LICENSE_SLUG_MAP
+from .biblio_lookup_tables import LANG_MAP_MARC, LICENSE_SLUG_MAP
 
 DOI_REGEX = re.compile(r"^10.\d{3,6}/\S+$")
 
@@ -506,24 +506,49 @@ def test_detect_text_lang() -> None:
     assert detect_text_lang(ZH_SAMPLE) in ("zh", "ko")
 
 
+def _build_lang_name_map() -> Dict[str, str]:
+    """
+    Builds a lower-cased lookup table from every language name, alpha-2,
+    alpha-3, and bibliographic code in pycountry to the 2-char ISO 639-1
+    code.
+
+    Resolution order matches `pycountry.languages.lookup()`: exact code
+    matches take precedence, then the first language (in database order) with
+    a case-insensitively matching name. Languages which have no 2-char code
+    (or are "multiple"/"uncoded") map to nothing, same as a lookup miss.
+    """
+    table: Dict[str, Optional[str]] = dict()
+    for lang in pycountry.languages:
+        alpha_2 = getattr(lang, "alpha_2", None)
+        if lang.alpha_3 in ("mul", "mis"):
+            alpha_2 = None
+        for field in ("name", "common_name", "inverted_name"):
+            name = getattr(lang, field, None)
+            if name:
+                table.setdefault(name.lower(), alpha_2)
+    # codes are already lower-case, and checked before names by pycountry
+    for field in ("bibliographic", "alpha_2", "alpha_3"):
+        for lang in pycountry.languages:
+            code = getattr(lang, field, None)
+            if code:
+                alpha_2 = getattr(lang, "alpha_2", None)
+                if lang.alpha_3 in ("mul", "mis"):
+                    alpha_2 = None
+                table[code] = alpha_2
+    return {k: v.lower() for k, v in table.items() if v}
+
+
+# built once at import time; pycountry lookups do a linear scan on every miss
+LANG_NAME_MAP: Dict[str, str] = _build_lang_name_map()
+
+
 def parse_lang_name(raw: Optional[str]) -> Optional[str]:
     """
     Parses a language name and returns a 2-char ISO 631 language code.
     """
     if not raw:
         return None
-    try:
-        lang = pycountry.languages.lookup(raw)
-        if lang.alpha_3 in ("mul", "mis"):
-            return None
-        return lang.alpha_2.lower()
-    except LookupError:
-        # print(f"  unknown language: '{raw}', file=sys.stderr)
-        return None
-    except AttributeError:
-        # print(f"  partial language metadata: '{lang}', file=sys.stderr)
-        return None
-    return None
+    return LANG_NAME_MAP.get(raw.lower())
 
 
 def test_parse_lang_name() -> None:
@@ -539,6 +564,36 @@ def test_parse_lang_name() -> None:
     assert parse_lang_name("ENG") == "en"
     assert parse_lang_name("English") == "en"
     assert parse_lang_name("Portuguese") == "pt"
+    assert parse_lang_name("ger") == "de"
+    assert parse_lang_name("deu") == "de"
+    assert parse_lang_name("mul") is None
+    assert parse_lang_name("Multiple languages") is None
+
+
+def parse_marc_lang(raw: Optional[str]) -> Optional[str]:
+    """
+    Parses a MARC language code (as used by PubMed/MEDLINE and JSTOR) into a
+    2-char ISO 631 language code.
+
+    The explicit MARC table takes precedence (including intentional `None`
+    mappings); other codes fall back to the general language lookup table.
+    """
+    if not raw:
+        return None
+    if raw in LANG_MAP_MARC:
+        return LANG_MAP_MARC[raw]
+    return parse_lang_name(raw)
+
+
+def test_parse_marc_lang() -> None:
+    assert parse_marc_lang(None) is None
+    assert parse_marc_lang("") is None
+    assert parse_marc_lang("eng") == "en"
+    assert parse_marc_lang("chi") == "zh"
+    assert parse_marc_lang("und") is None
+    assert parse_marc_lang("mul") is None
+    assert parse_marc_lang("sme") == "se"
+    assert parse_marc_lang("xyzzy") is None
 
 
 def parse_country_name(s: Optional[str]) -> Optional[str]:
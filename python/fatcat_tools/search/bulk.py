@@ -0,0 +1,296 @@
+"""
+Helpers for pushing documents in to elasticsearch using the _bulk API.
+
+Bulk actions are passed around as pre-serialized NDJSON strings (an action
+line and a document line, without trailing newline), so that serialization
+can happen wherever the documents are transformed.
+"""
+
+import collections
+import concurrent.futures
+import json
+import random
+import sys
+import time
+from typing import Any, Counter, Deque, Dict, List, Optional, TextIO, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# HTTP status codes (for entire requests, or individual bulk items) which
+# indicate that elasticsearch is overloaded, and the request should be retried
+BULK_RETRY_STATUS = (429, 503)
+
+
+class ElasticsearchBulkError(Exception):
+    pass
+
+
+def es_bulk_index_action(key: str, doc_json: str) -> str:
+    """
+    Returns a bulk "index" action for a single (already JSON-encoded) document.
+    """
+    return json.dumps({"index": {"_id": key}}) + "\n" + doc_json
+
+
+def bulk_action_bytes(action: str) -> int:
+    """
+    Size of a bulk action in a request body, including trailing newline.
+    """
+    return len(action.encode("utf-8")) + 1
+
+
+def bulk_action_id(action: str) -> Optional[str]:
+    """
+    Document id from the action line of a bulk action (if any).
+    """
+    meta = json.loads(action.split("\n", 1)[0])
+    return list(meta.values())[0].get("_id")
+
+
+def split_bulk_actions(actions: List[str], max_bytes: int) -> List[List[str]]:
+    """
+    Splits a list of bulk actions in to groups of at most `max_bytes` of
+    NDJSON each (an action larger than that gets a group of its own).
+    """
+    groups: List[List[str]] = []
+    group: List[str] = []
+    group_bytes = 0
+    for action in actions:
+        action_bytes = bulk_action_bytes(action)
+        if group and group_bytes + action_bytes > max_bytes:
+            groups.append(group)
+            group = []
+            group_bytes = 0
+        group.append(action)
+        group_bytes += action_bytes
+    if group:
+        groups.append(group)
+    return groups
+
+
+def es_bulk_session(pool_size: int = 10) -> requests.Session:
+    """
+    Returns a requests session with a connection pool large enough for
+    `pool_size` concurrent bulk requests.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def bulk_backoff_sleep(
+    attempt: int, backoff_base: float = 1.0, max_backoff: float = 60.0
+) -> None:
+    """
+    Sleeps for an exponentially increasing (with jitter) period of time.
+    """
+    delay = min(max_backoff, backoff_base * (2**attempt))
+    time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+def post_es_bulk(
+    session: requests.Session,
+    endpoint: str,
+    actions: List[str],
+    max_retries: int = 8,
+    backoff_base: float = 1.0,
+    timeout: float = 120.0,
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    POSTs a list of bulk actions to an elasticsearch _bulk endpoint as a
+    single request.
+
+    Entire requests, or individual items, which fail with an "overloaded"
+    status code (429 or 503), and requests which fail to connect or time out
+    (after `timeout` seconds), are retried with jittered exponential backoff.
+
+    Returns a list of (action, item result) tuples for items which failed
+    with any other error, or were still overloaded (or unreachable) when
+    retries ran out (the latter with the last item result, or a synthetic
+    one if the whole request failed). Raises ElasticsearchBulkError if the
+    request fails entirely with any other status.
+    """
+    failed = []
+    attempt = 0
+    while actions:
+        retry: List[Tuple[str, Dict[str, Any]]] = []
+        try:
+            resp = session.post(
+                endpoint,
+                headers={"Content-Type": "application/x-ndjson"},
+                data=("\n".join(actions) + "\n").encode("utf-8"),
+                timeout=timeout,
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # index actions are idempotent, so it's fine to retry even if
+            # some were applied before a read timeout
+            result = {"status": None, "error": {"type": type(e).__name__, "reason": str(e)}}
+            retry = [(action, result) for action in actions]
+        else:
+            if resp.status_code in BULK_RETRY_STATUS:
+                result = {
+                    "status": resp.status_code,
+                    "error": {"type": "http_status", "reason": resp.text[:1000]},
+                }
+                retry = [(action, result) for action in actions]
+            elif resp.status_code != 200:
+                raise ElasticsearchBulkError(
+                    "Elasticsearch bulk error from post to {}: HTTP {} {}".format(
+                        endpoint, resp.status_code, resp.text[:1000]
+                    )
+                )
+            else:
+                body = resp.json()
+                if body["errors"]:
+                    for action, item in zip(actions, body["items"]):
+                        result = list(item.values())[0]
+                        if result.get("status") in BULK_RETRY_STATUS:
+                            retry.append((action, result))
+                        elif "error" in result:
+                            failed.append((action, result))
+        if not retry:
+            break
+        if attempt >= max_retries:
+            print(
+                "Elasticsearch still failing after {} retries, failing {} actions".format(
+                    max_retries, len(retry)
+                ),
+                file=sys.stderr,
+            )
+            for action, result in retry:
+                if "_id" not in result:
+                    result = dict(result, _id=bulk_action_id(action))
+                failed.append((action, result))
+            break
+        print(
+            "Elasticsearch overloaded or unreachable, retrying {} actions (attempt {})".format(
+                len(retry), attempt + 1
+            ),
+            file=sys.stderr,
+        )
+        bulk_backoff_sleep(attempt, backoff_base)
+        attempt += 1
+        actions = [action for action, _ in retry]
+    return failed
+
+
+def post_es_bulk_split(
+    session: requests.Session,
+    endpoint: str,
+    actions: List[str],
+    max_bytes: int,
+    max_retries: int = 8,
+    backoff_base: float = 1.0,
+    timeout: float = 120.0,
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Like post_es_bulk(), but splits the actions in to (sequential) requests of
+    at most `max_bytes` each.
+    """
+    failed = []
+    for group in split_bulk_actions(actions, max_bytes):
+        failed.extend(
+            post_es_bulk(session, endpoint, group, max_retries, backoff_base, timeout)
+        )
+    return failed
+
+
+class ElasticsearchBulkLoader:
+    """
+    Streams bulk actions in to an elasticsearch _bulk endpoint, with several
+    concurrent requests in flight.
+
+    Actions are grouped in to requests of (approximately) at most `max_bytes`
+    of NDJSON. Items which fail permanently are counted, and written as bulk
+    actions to `failed_output` (if provided) so they can be re-tried later.
+
+    Usage:
+
+        loader = ElasticsearchBulkLoader("http://localhost:9200/fatcat_release/_bulk")
+        for key, doc in docs:
+            loader.add(es_bulk_index_action(key, json.dumps(doc)))
+        counts = loader.finish()
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        concurrency: int = 4,
+        max_bytes: int = 10 * 1024 * 1024,
+        max_retries: int = 8,
+        backoff_base: float = 1.0,
+        timeout: float = 120.0,
+        failed_output: Optional[TextIO] = None,
+    ) -> None:
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.failed_output = failed_output
+        self.session = es_bulk_session(pool_size=concurrency)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.pending: Deque[concurrent.futures.Future] = collections.deque()
+        self.buf: List[str] = []
+        self.buf_bytes = 0
+        self.counts: Counter[str] = collections.Counter()
+
+    def add(self, action: str) -> None:
+        action_bytes = bulk_action_bytes(action)
+        if self.buf and self.buf_bytes + action_bytes > self.max_bytes:
+            self.flush()
+        self.buf.append(action)
+        self.buf_bytes += action_bytes
+
+    def flush(self) -> None:
+        """
+        Submits any buffered actions as a bulk request. Blocks if too many
+        requests are already in flight.
+        """
+        if not self.buf:
+            return
+        while len(self.pending) >= self.concurrency * 2:
+            self._collect(self.pending.popleft())
+        self.pending.append(
+            self.executor.submit(
+                post_es_bulk,
+                self.session,
+                self.endpoint,
+                self.buf,
+                self.max_retries,
+                self.backoff_base,
+                self.timeout,
+            )
+        )
+        self.counts["requests"] += 1
+        self.counts["total"] += len(self.buf)
+        self.buf = []
+        self.buf_bytes = 0
+
+    def _collect(self, future: concurrent.futures.Future) -> None:
+        failed = future.result()
+        for action, result in failed:
+            self.counts["failed"] += 1
+            print(
+                "Elasticsearch bulk item failed: {} {}".format(
+                    result.get("_id"), json.dumps(result.get("error"))
+                ),
+                file=sys.stderr,
+            )
+            if self.failed_output:
+                self.failed_output.write(action + "\n")
+
+    def finish(self) -> Counter[str]:
+        """
+        Flushes and waits for all outstanding requests. Returns counts.
+        """
+        self.flush()
+        while self.pending:
+            self._collect(self.pending.popleft())
+        self.executor.shutdown()
+        self.counts["indexed"] = self.counts["total"] - self.counts["failed"]
+        return self.counts
@@ -3,7 +3,8 @@ from typing import Any, Dict, List, Union
 
 import elasticsearch
 import elasticsearch_dsl.response
-from elasticsearch_dsl import Search
+from elasticsearch_dsl import MultiSearch, Search
+from elasticsearch_dsl.connections import get_connection
 
 
 class FatcatSearchError(Exception):
@@ -53,10 +54,10 @@ def results_to_dict(response: elasticsearch_dsl.response.Response) -> List[dict]
     return results
 
 
-def wrap_es_execution(search: Search) -> Any:
+def wrap_es_execution(search: Union[Search, MultiSearch]) -> Any:
     """
-    Executes a Search object, and converts various ES error types into
-    something we can pretty print to the user.
+    Executes a Search (or MultiSearch) object, and converts various ES error
+    types into something we can pretty print to the user.
     """
     try:
         resp = search.execute()
@@ -81,6 +82,37 @@ def wrap_es_execution(search: Search) -> Any:
     return resp
 
 
+class FatcatMultiSearch(MultiSearch):
+    """
+    MultiSearch which, if any of the individual searches fail, raises
+    FatcatSearchError with that search's own status code and error reason
+    (eg, a 400 for a query syntax error), instead of a generic TransportError
+    without either.
+    """
+
+    def execute(
+        self, ignore_cache: bool = False, raise_on_error: bool = True
+    ) -> List[elasticsearch_dsl.response.Response]:
+        if ignore_cache or not hasattr(self, "_response"):
+            es = get_connection(self._using)
+            responses = es.msearch(index=self._index, body=self.to_dict(), **self._params)
+            out = []
+            for search, resp in zip(self._searches, responses["responses"]):
+                if resp.get("error"):
+                    error = resp["error"]
+                    print("elasticsearch msearch error: {}".format(error), file=sys.stderr)
+                    if not raise_on_error:
+                        out.append(None)
+                        continue
+                    description = None
+                    if error.get("root_cause"):
+                        description = str(error["root_cause"][0].get("reason"))
+                    raise FatcatSearchError(resp.get("status", 503), error["type"], description)
+                out.append(elasticsearch_dsl.response.Response(search, resp))
+            self._response = out
+        return self._response
+
+
 def agg_to_dict(agg: Any) -> Dict[str, Any]:
     """
     Takes a simple term aggregation result (with buckets) and returns a simple
@@ -1,36 +1,22 @@
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, List, Optional
 
 import elasticsearch
 from elasticsearch_dsl import Search
 
-from fatcat_tools.search.common import _hits_total_int, agg_to_dict, wrap_es_execution
+from fatcat_tools.search.common import (
+    FatcatMultiSearch,
+    _hits_total_int,
+    agg_to_dict,
+    wrap_es_execution,
+)
 
 
-def query_es_container_stats(
-    ident: str,
-    es_client: elasticsearch.Elasticsearch,
-    es_index: str = "fatcat_release",
-    merge_shadows: bool = False,
-) -> Dict[str, Any]:
+def _container_stats_aggs(aggs: Any) -> None:
     """
-    Returns dict:
-        ident
-        total: count
-        in_web: count
-        in_kbart: count
-        is_preserved: count
-        preservation{}
-            "histogram" by preservation status
-        release_type{}
-            "histogram" by release type
+    Adds the per-container stats aggregations to a search (`search.aggs`), or
+    to a bucket aggregation (eg, composite) as sub-aggregations.
     """
-
-    search = Search(using=es_client, index=es_index)
-    search = search.query(
-        "term",
-        container_id=ident,
-    )
-    search.aggs.bucket(
+    aggs.bucket(
         "container_stats",
         "filters",
         filters={
@@ -45,43 +31,181 @@ def query_es_container_stats(
             },
         },
     )
-    search.aggs.bucket(
+    aggs.bucket(
         "preservation",
         "terms",
         field="preservation",
         missing="_unknown",
     )
-    search.aggs.bucket(
+    aggs.bucket(
         "release_type",
         "terms",
         field="release_type",
         missing="_unknown",
     )
 
+
+def container_stats_search(
+    ident: str, es_client: elasticsearch.Elasticsearch, es_index: str
+) -> Search:
+    """
+    Search (with no hits) for the stats aggregations of a single container.
+    """
+    search = Search(using=es_client, index=es_index)
+    search = search.query(
+        "term",
+        container_id=ident,
+    )
+    _container_stats_aggs(search.aggs)
     search = search[:0]
+    return search
 
-    search = search.params(request_cache=True)
-    search = search.params(track_total_hits=True)
-    resp = wrap_es_execution(search)
 
-    container_stats = resp.aggregations.container_stats.buckets
-    preservation_bucket = agg_to_dict(resp.aggregations.preservation)
-    preservation_bucket["total"] = _hits_total_int(resp.hits.total)
+def container_stats_from_aggs(
+    ident: str, total: int, aggs: Any, merge_shadows: bool = False
+) -> Dict[str, Any]:
+    """
+    Converts stats aggregation results (from a search response, or a
+    composite aggregation bucket) in to a container stats dict.
+    """
+    container_stats = aggs.container_stats.buckets
+    preservation_bucket = agg_to_dict(aggs.preservation)
+    preservation_bucket["total"] = total
     for k in ("bright", "dark", "shadows_only", "none"):
         if k not in preservation_bucket:
             preservation_bucket[k] = 0
     if merge_shadows:
         preservation_bucket["none"] += preservation_bucket["shadows_only"]
         preservation_bucket["shadows_only"] = 0
-    release_type_bucket = agg_to_dict(resp.aggregations.release_type)
+    release_type_bucket = agg_to_dict(aggs.release_type)
     stats = {
         "ident": ident,
-        "total": _hits_total_int(resp.hits.total),
+        "total": total,
         "in_web": container_stats["in_web"]["doc_count"],
         "in_kbart": container_stats["in_kbart"]["doc_count"],
         "is_preserved": container_stats["is_preserved"]["doc_count"],
         "preservation": preservation_bucket,
         "release_type": release_type_bucket,
     }
-
     return stats
+
+
+def empty_container_stats(ident: str) -> Dict[str, Any]:
+    """
+    Stats for a container with no releases in the index; same as what
+    query_es_container_stats() would return.
+    """
+    return {
+        "ident": ident,
+        "total": 0,
+        "in_web": 0,
+        "in_kbart": 0,
+        "is_preserved": 0,
+        "preservation": {
+            "total": 0,
+            "bright": 0,
+            "dark": 0,
+            "shadows_only": 0,
+            "none": 0,
+        },
+        "release_type": {},
+    }
+
+
+def query_es_container_stats(
+    ident: str,
+    es_client: elasticsearch.Elasticsearch,
+    es_index: str = "fatcat_release",
+    merge_shadows: bool = False,
+) -> Dict[str, Any]:
+    """
+    Returns dict:
+        ident
+        total: count
+        in_web: count
+        in_kbart: count
+        is_preserved: count
+        preservation{}
+            "histogram" by preservation status
+        release_type{}
+            "histogram" by release type
+    """
+
+    search = container_stats_search(ident, es_client, es_index)
+    search = search.params(request_cache=True)
+    search = search.params(track_total_hits=True)
+    resp = wrap_es_execution(search)
+
+    return container_stats_from_aggs(
+        ident, _hits_total_int(resp.hits.total), resp.aggregations, merge_shadows
+    )
+
+
+def query_es_container_stats_batch(
+    idents: List[str],
+    es_client: elasticsearch.Elasticsearch,
+    es_index: str = "fatcat_release",
+    merge_shadows: bool = False,
+    batch_size: int = 100,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Like query_es_container_stats(), but for a list of containers. Queries are
+    sent in groups of `batch_size` as single _msearch requests.
+
+    Returns a dict with container idents as keys and stats dicts as values.
+    Raises FatcatSearchError (with the status and reason of the failed query)
+    if any of the queries fail.
+    """
+    result = dict()
+    for i in range(0, len(idents), batch_size):
+        batch = idents[i : i + batch_size]
+        msearch = FatcatMultiSearch(using=es_client, index=es_index)
+        for ident in batch:
+            search = container_stats_search(ident, es_client, es_index)
+            # msearch header only allows some params; track_total_hits goes in body
+            search = search.params(request_cache=True)
+            search = search.extra(track_total_hits=True)
+            msearch = msearch.add(search)
+        responses = wrap_es_execution(msearch)
+        for ident, resp in zip(batch, responses):
+            result[ident] = container_stats_from_aggs(
+                ident, _hits_total_int(resp.hits.total), resp.aggregations, merge_shadows
+            )
+    return result
+
+
+def iter_es_all_container_stats(
+    es_client: elasticsearch.Elasticsearch,
+    es_index: str = "fatcat_release",
+    merge_shadows: bool = False,
+    page_size: int = 1000,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Scans the entire release index with a composite aggregation over
+    container_id, yielding stats dicts (same as query_es_container_stats())
+    for every container which has any releases in the index.
+
+    Containers with no releases are not included; see empty_container_stats().
+    """
+    after_key: Optional[Dict[str, Any]] = None
+    while True:
+        search = Search(using=es_client, index=es_index)
+        search = search[:0]
+        composite_kwargs: Dict[str, Any] = dict(
+            size=page_size,
+            sources=[{"container_id": {"terms": {"field": "container_id"}}}],
+        )
+        if after_key:
+            composite_kwargs["after"] = after_key
+        containers_agg = search.aggs.bucket("containers", "composite", **composite_kwargs)
+        _container_stats_aggs(containers_agg)
+        resp = wrap_es_execution(search)
+
+        buckets = resp.aggregations.containers.buckets
+        for bucket in buckets:
+            yield container_stats_from_aggs(
+                bucket.key.container_id, bucket.doc_count, bucket, merge_shadows
+            )
+        after_key = resp.aggregations.containers.to_dict().get("after_key")
+        if not buckets or not after_key:
+            break
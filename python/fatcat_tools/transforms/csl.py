@@ -1,5 +1,5 @@
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Set, Tuple
 
 from citeproc import (
     Citation,
@@ -209,6 +209,54 @@ def refs_to_csl(entity: ReleaseEntity) -> List[Dict[str, Any]]:
     return ret
 
 
+# Parsing a CSL style XML file is relatively expensive, so parsed styles are
+# kept around for the lifetime of the process. citeproc sets the output
+# formatter on the style object itself, so styles are cached per (style, html)
+# pair.
+_CSL_STYLE_CACHE: Dict[Tuple[str, bool], CitationStylesStyle] = dict()
+
+
+def get_csl_style(style: str, html: bool = False) -> CitationStylesStyle:
+    """
+    Returns a parsed (and cached) citeproc style object for the given style
+    name and output format.
+    """
+    key = (style, html)
+    bib_style = _CSL_STYLE_CACHE.get(key)
+    if bib_style is None:
+        bib_style = CitationStylesStyle(get_style_filepath(style), validate=False)
+        _CSL_STYLE_CACHE[key] = bib_style
+    return bib_style
+
+
+def csl_style_is_numeric(style: str) -> bool:
+    """
+    Whether bibliography entries in the style are numbered (eg, "[1]" in
+    ieee), in which case the number depends on position in the bibliography.
+    """
+    return bool(
+        get_csl_style(style).root.xpath(
+            ".//cs:bibliography//cs:text[@variable='citation-number']",
+            namespaces={"cs": "http://purl.org/net/xbiblio/csl"},
+        )
+    )
+
+
+def _format_csl_lines(lines: List[str], style: str) -> str:
+    if style == "bibtex":
+        out = ""
+        for line in lines:
+            if line.startswith(" @"):
+                out += "@"
+            elif line.startswith(" "):
+                out += "\n " + line
+            else:
+                out += line
+        return "".join(out)
+    else:
+        return "".join(lines)
+
+
 def citeproc_csl(csl_json: Dict[str, Any], style: str, html: bool = False) -> str:
     """
     Renders a release entity to a styled citation.
@@ -229,20 +277,52 @@ def citeproc_csl(csl_json: Dict[str, Any], style: str, html: bool = False) -> st
     form = formatter.plain
     if html:
         form = formatter.html
-    style_path = get_style_filepath(style)
-    bib_style = CitationStylesStyle(style_path, validate=False)
-    bib = CitationStylesBibliography(bib_style, bib_src, form)
+    bib = CitationStylesBibliography(get_csl_style(style, html), bib_src, form)
     bib.register(Citation([CitationItem(csl_json["id"])]))
     lines = bib.bibliography()[0]
-    if style == "bibtex":
-        out = ""
-        for line in lines:
-            if line.startswith(" @"):
-                out += "@"
-            elif line.startswith(" "):
-                out += "\n " + line
-            else:
-                out += line
-        return "".join(out)
-    else:
-        return "".join(lines)
+    return _format_csl_lines(lines, style)
+
+
+def citeproc_csl_batch(
+    csl_json_list: List[Dict[str, Any]], style: str, html: bool = False
+) -> List[str]:
+    """
+    Like citeproc_csl(), but renders a list of CSL-JSON objects, registering
+    all of them in a single bibliography. Returns a list of rendered citations
+    in the same order as the input.
+
+    CSL-JSON objects need distinct 'id' fields to be rendered together; any
+    repeated (or missing) ids are rendered in a separate bibliography. Styles
+    which number entries are rendered one entry per bibliography, so each is
+    numbered "1" as with citeproc_csl() (but still re-uses the parsed style).
+    """
+    if style == "csl-json" or csl_style_is_numeric(style):
+        # citeproc_csl() sets a missing id on the object itself
+        return [citeproc_csl(dict(csl_json), style, html) for csl_json in csl_json_list]
+    form = formatter.plain
+    if html:
+        form = formatter.html
+    bib_style = get_csl_style(style, html)
+
+    results: List[str] = []
+    batch: List[Dict[str, Any]] = []
+    batch_ids: Set[Any] = set()
+
+    def flush_batch() -> None:
+        bib = CitationStylesBibliography(bib_style, CiteProcJSON(batch), form)
+        bib.register(Citation([CitationItem(c["id"]) for c in batch]))
+        for lines in bib.bibliography():
+            results.append(_format_csl_lines(lines, style))
+        batch.clear()
+        batch_ids.clear()
+
+    for csl_json in csl_json_list:
+        if not csl_json.get("id"):
+            csl_json = dict(csl_json, id="unknown")
+        if csl_json["id"] in batch_ids:
+            flush_batch()
+        batch.append(csl_json)
+        batch_ids.add(csl_json["id"])
+    if batch:
+        flush_batch()
+    return results
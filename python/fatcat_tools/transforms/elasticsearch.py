@@ -1,5 +1,5 @@
 import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
 import tldextract
 from fatcat_openapi_client import (
@@ -112,11 +112,9 @@ def release_to_elasticsearch(entity: ReleaseEntity, force_bool: bool = True) ->
         t["release_year"] = release_year
 
     t["any_abstract"] = len(release.abstracts or []) > 0
-    t["ref_count"] = len(release.refs or [])
-    ref_release_ids = []
-    for r in release.refs or []:
-        if r.target_release_id:
-            ref_release_ids.append(r.target_release_id)
+    refs = release.refs or []
+    t["ref_count"] = len(refs)
+    ref_release_ids = [r.target_release_id for r in refs if r.target_release_id]
     t["ref_release_ids"] = ref_release_ids
     t["ref_linked_count"] = len(ref_release_ids)
     t["contrib_count"] = len(release.contribs or [])
@@ -143,7 +141,7 @@ def release_to_elasticsearch(entity: ReleaseEntity, force_bool: bool = True) ->
     t["affiliation_rors"] = None
 
     if release.container:
-        t.update(_rte_container_helper(release.container, release_year))
+        t.update(_rte_container_fields(release.container, release_year))
 
     # fall back to release-level container metadata if container not linked or
     # missing context
@@ -254,6 +252,38 @@ def release_to_elasticsearch(entity: ReleaseEntity, force_bool: bool = True) ->
     return t
 
 
+# The container-derived fields of a release doc only depend on the container
+# (revision) and the release year, and many releases share a container, so
+# they are memoized across calls. Bounded by simply clearing when full.
+_CONTAINER_FIELDS_CACHE: Dict[Tuple[Any, ...], Dict[str, Any]] = dict()
+_CONTAINER_FIELDS_CACHE_SIZE = 20000
+
+
+def _rte_container_fields(container: ContainerEntity, release_year: Optional[int]) -> dict:
+    """
+    Memoized wrapper around _rte_container_helper(). Containers without a
+    revision (eg, constructed locally) are not memoized.
+    """
+    if not container.revision:
+        return _rte_container_helper(container, release_year)
+    key = (
+        container.ident,
+        container.revision,
+        container.redirect,
+        release_year,
+        # KBART coverage checks depend on the current year
+        datetime.date.today().year,
+    )
+    fields = _CONTAINER_FIELDS_CACHE.get(key)
+    if fields is None:
+        if len(_CONTAINER_FIELDS_CACHE) >= _CONTAINER_FIELDS_CACHE_SIZE:
+            _CONTAINER_FIELDS_CACHE.clear()
+        fields = _rte_container_helper(container, release_year)
+        _CONTAINER_FIELDS_CACHE[key] = fields
+    # copy, so that callers can't modify the memoized fields (or ISSN list)
+    return dict(fields, container_issns=list(fields["container_issns"]))
+
+
 def _rte_container_helper(container: ContainerEntity, release_year: Optional[int]) -> dict:
     """
     Container metadata sub-section of release_to_elasticsearch()
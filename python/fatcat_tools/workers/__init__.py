@@ -3,6 +3,9 @@ from .elasticsearch import (
     ElasticsearchChangelogWorker,
     ElasticsearchContainerWorker,
     ElasticsearchFileWorker,
+    ElasticsearchMultiWorker,
     ElasticsearchReleaseWorker,
 )
-from .worker_common import FatcatWorker, most_recent_message
+from .entity_cache import EntityCache
+from .metrics import WorkerMetrics
+from .worker_common import FatcatWorker, coalesce_messages_by_key, most_recent_message
@@ -1,14 +1,52 @@
+import collections
+import concurrent.futures
+import copy
 import json
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 from confluent_kafka import Consumer, KafkaException, Producer
 from fatcat_openapi_client import ApiClient, ReleaseEntity
 
 from fatcat_tools.transforms import release_ingest_request, release_to_elasticsearch
 
+from .entity_cache import EntityCache, EntityRef
 from .worker_common import FatcatWorker, most_recent_message
 
+RELEASE_EXPAND = "files,filesets,webcaptures,container,creators"
+
+
+def release_dependencies(release: ReleaseEntity) -> List[EntityRef]:
+    """
+    Entities which are embedded in an expanded release entity.
+    """
+    deps: List[EntityRef] = []
+    deps.extend(("file", f.ident) for f in release.files or [])
+    deps.extend(("fileset", f.ident) for f in release.filesets or [])
+    deps.extend(("webcapture", w.ident) for w in release.webcaptures or [])
+    if release.container_id:
+        deps.append(("container", release.container_id))
+    deps.extend(("creator", c.creator_id) for c in release.contribs or [] if c.creator_id)
+    return deps
+
+
+def patch_attached_entities(
+    release: ReleaseEntity, attached: Optional[List[Any]], updated: Dict[str, Any]
+) -> Optional[List[Any]]:
+    """
+    Updates a list of entities attached to a release (files, filesets, or
+    webcaptures) with freshly fetched versions of some of those entities:
+    updated entities which no longer point to the release are removed, and
+    ones which now do are added.
+    """
+    if not updated:
+        return attached
+    patched = [e for e in attached or [] if e.ident not in updated]
+    patched.extend(e for e in updated.values() if release.ident in (e.release_ids or []))
+    if attached is None and not patched:
+        return None
+    return patched
+
 
 class ChangelogWorker(FatcatWorker):
     """
@@ -23,10 +61,54 @@ class ChangelogWorker(FatcatWorker):
         produce_topic: str,
         poll_interval: float = 10.0,
         offset: Optional[int] = None,
+        fetch_workers: int = 8,
     ) -> None:
         super().__init__(kafka_hosts=kafka_hosts, produce_topic=produce_topic, api=api)
         self.poll_interval = poll_interval
         self.offset = offset  # the fatcat changelog offset, not the kafka offset
+        self.fetch_workers = fetch_workers
+        # max number of entries being fetched (or fetched and waiting to be
+        # published) at any time, when catching up
+        self.fetch_window = fetch_workers * 4
+
+    def fetch_changelog_entry(self, index: int) -> bytes:
+        cle = self.api_call("get_changelog_entry", index)
+        obj = self.api.api_client.sanitize_for_serialization(cle)
+        return json.dumps(obj).encode("utf-8")
+
+    def publish_range(
+        self,
+        producer: Producer,
+        executor: concurrent.futures.Executor,
+        start: int,
+        end: int,
+        on_delivery: Callable,
+    ) -> None:
+        """
+        Fetches changelog entries from start through end (inclusive)
+        concurrently, and publishes them strictly in index order.
+        """
+        in_flight: Deque[Tuple[int, concurrent.futures.Future]] = collections.deque()
+        indexes = iter(range(start, end + 1))
+        while True:
+            for i in indexes:
+                in_flight.append((i, executor.submit(self.fetch_changelog_entry, i)))
+                if len(in_flight) >= self.fetch_window:
+                    break
+            if not in_flight:
+                break
+            i, future = in_flight.popleft()
+            producer.produce(
+                self.produce_topic,
+                future.result(),
+                key=str(i),
+                on_delivery=on_delivery,
+                # NOTE timestamp could be timestamp=cle.timestamp (?)
+            )
+            self.metrics.inc("messages_produced_total", labels=dict(topic=self.produce_topic))
+            # serve delivery callbacks
+            producer.poll(0)
+            self.offset = i
 
     def run(self) -> None:
 
@@ -54,29 +136,26 @@ class ChangelogWorker(FatcatWorker):
         producer_conf.update(
             {
                 "delivery.report.only.error": True,
+                # batch up messages when catching up on a large backlog
+                "linger.ms": 50,
+                "batch.num.messages": 1000,
+                # retries must not re-order entries
+                "enable.idempotence": True,
                 "default.topic.config": {
                     "request.required.acks": -1,  # all brokers must confirm
                 },
             }
         )
         producer = Producer(producer_conf)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.fetch_workers)
 
         while True:
             latest = int(self.api.get_changelog(limit=1)[0].index)
             if latest > self.offset:
                 print("Fetching changelogs from {} through {}".format(self.offset + 1, latest))
-            for i in range(self.offset + 1, latest + 1):
-                cle = self.api.get_changelog_entry(i)
-                obj = self.api.api_client.sanitize_for_serialization(cle)
-                producer.produce(
-                    self.produce_topic,
-                    json.dumps(obj).encode("utf-8"),
-                    key=str(i),
-                    on_delivery=fail_fast,
-                    # NOTE timestamp could be timestamp=cle.timestamp (?)
-                )
-                self.offset = i
+                self.publish_range(producer, executor, self.offset + 1, latest, fail_fast)
             producer.flush()
+            self.metrics.set("changelog_index", self.offset)
             print("Sleeping {} seconds...".format(self.poll_interval))
             time.sleep(self.poll_interval)
 
@@ -98,6 +177,10 @@ class EntityUpdatesWorker(FatcatWorker):
         ingest_file_request_topic: str,
         work_ident_topic: str,
         poll_interval: float = 5.0,
+        fetch_workers: int = 8,
+        batch_size: int = 1,
+        batch_timeout: float = 10.0,
+        entity_cache: Optional[EntityCache] = None,
     ):
         super().__init__(kafka_hosts=kafka_hosts, consume_topic=consume_topic, api=api)
         self.release_topic = release_topic
@@ -106,6 +189,13 @@ class EntityUpdatesWorker(FatcatWorker):
         self.ingest_file_request_topic = ingest_file_request_topic
         self.work_ident_topic = work_ident_topic
         self.poll_interval = poll_interval
+        self.fetch_workers = fetch_workers
+        # changelog entries are processed in groups of up to batch_size, or as
+        # many as arrive within batch_timeout seconds of the first
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        # optional cache of fetched entities; may be shared with other workers
+        self.entity_cache = entity_cache
         self.consumer_group = "entity-updates"
         self.ingest_oa_only = False
         self.ingest_pdf_doi_prefix_blocklist = [
@@ -271,6 +361,229 @@ class EntityUpdatesWorker(FatcatWorker):
 
         return True
 
+    def process_changelog_entries(
+        self,
+        cles: List[Dict[str, Any]],
+        producer: Producer,
+        executor: concurrent.futures.Executor,
+        on_delivery: Callable,
+    ) -> None:
+        """
+        Fetches all the entities touched by a group of changelog entries, and
+        publishes them to the entity update topics.
+
+        Idents are unioned across the entries, so an entity touched by several
+        entries is only fetched (at its latest state) and published once.
+
+        Fetches happen concurrently (using `executor`) in two phases: files,
+        filesets, and webcaptures first (which may add release idents), then
+        containers and releases. Messages are produced in the same order as if
+        the fetches were sequential.
+        """
+
+        def produce(topic: str, value: bytes, key: Optional[bytes] = None) -> None:
+            producer.produce(topic, value, key=key, on_delivery=on_delivery)
+            self.metrics.inc("messages_produced_total", labels=dict(topic=topic))
+
+        release_ids = []
+        new_release_ids = []
+        file_ids = []
+        fileset_ids = []
+        webcapture_ids = []
+        container_ids = []
+        work_ids = []
+        # (entity type, ident, new revision) of every edit, for the entity cache
+        cache_updates: List[Tuple[str, str, Optional[str]]] = []
+        for cle in cles:
+            for entity_type in (
+                "release",
+                "file",
+                "fileset",
+                "webcapture",
+                "container",
+                "creator",
+            ):
+                for e in cle["editgroup"]["edits"].get(entity_type + "s") or []:
+                    revision = None if e.get("redirect_ident") else e.get("revision")
+                    cache_updates.append((entity_type, e["ident"], revision))
+            release_edits = cle["editgroup"]["edits"]["releases"]
+            for re in release_edits:
+                release_ids.append(re["ident"])
+                # filter to direct release edits which are not updates
+                if not re.get("prev_revision") and not re.get("redirect_ident"):
+                    new_release_ids.append(re["ident"])
+            file_edits = cle["editgroup"]["edits"]["files"]
+            for e in file_edits:
+                file_ids.append(e["ident"])
+            fileset_edits = cle["editgroup"]["edits"]["filesets"]
+            for e in fileset_edits:
+                fileset_ids.append(e["ident"])
+            webcapture_edits = cle["editgroup"]["edits"]["webcaptures"]
+            for e in webcapture_edits:
+                webcapture_ids.append(e["ident"])
+            container_edits = cle["editgroup"]["edits"]["containers"]
+            for e in container_edits:
+                container_ids.append(e["ident"])
+            work_edits = cle["editgroup"]["edits"]["works"]
+            for e in work_edits:
+                work_ids.append(e["ident"])
+        # work updates are attributed to the most recent entry in the group
+        last_cle = max(cles, key=lambda c: c["index"])
+
+        if self.entity_cache is not None:
+            for entity_type, ident, revision in cache_updates:
+                if entity_type not in ("file", "fileset", "webcapture"):
+                    self.entity_cache.update_revision(entity_type, ident, revision)
+
+        # first phase: entities which might update releases
+        file_idents = list(set(file_ids))
+        file_futures = [
+            executor.submit(self.api_call, "get_file", ident, expand=None)
+            for ident in file_idents
+        ]
+        fileset_futures = [
+            executor.submit(self.api_call, "get_fileset", ident, expand=None)
+            for ident in set(fileset_ids)
+        ]
+        webcapture_futures = [
+            executor.submit(self.api_call, "get_webcapture", ident, expand=None)
+            for ident in set(webcapture_ids)
+        ]
+
+        files_by_ident = dict()
+        filesets_by_ident = dict()
+        webcaptures_by_ident = dict()
+
+        for ident, future in zip(file_idents, file_futures):
+            file_entity = future.result()
+            files_by_ident[ident] = file_entity
+            # update release when a file changes
+            # TODO: also fetch old version of file and update any *removed*
+            # release idents (and same for filesets, webcapture updates)
+            release_ids.extend(file_entity.release_ids or [])
+            file_dict = self.api.api_client.sanitize_for_serialization(file_entity)
+            produce(
+                self.file_topic,
+                json.dumps(file_dict).encode("utf-8"),
+                key=ident.encode("utf-8"),
+            )
+
+        # TODO: topic for fileset updates
+        for future in fileset_futures:
+            fileset_entity = future.result()
+            filesets_by_ident[fileset_entity.ident] = fileset_entity
+            # update release when a fileset changes
+            release_ids.extend(fileset_entity.release_ids or [])
+
+        # TODO: topic for webcapture updates
+        for future in webcapture_futures:
+            webcapture_entity = future.result()
+            webcaptures_by_ident[webcapture_entity.ident] = webcapture_entity
+            # update release when a webcapture changes
+            release_ids.extend(webcapture_entity.release_ids or [])
+
+        # second phase: containers and (all affected) releases
+        container_idents = list(set(container_ids))
+        container_futures = [
+            executor.submit(self.api_call, "get_container", ident) for ident in container_idents
+        ]
+        release_idents = list(set(release_ids))
+
+        # releases with a cached (expanded) copy at their current revision
+        # don't need to be re-fetched; only their attached files, filesets,
+        # and webcaptures may have changed, and the new versions of those were
+        # just fetched above
+        cached_releases = dict()
+        if self.entity_cache is not None:
+            for ident in release_idents:
+                release = self.entity_cache.get("release", ident, expand=RELEASE_EXPAND)
+                if release is not None:
+                    cached_releases[ident] = release
+            # invalidates any other cached releases these were attached to
+            for entity_type, ident, revision in cache_updates:
+                if entity_type in ("file", "fileset", "webcapture"):
+                    self.entity_cache.update_revision(entity_type, ident, revision)
+            for ident, release in cached_releases.items():
+                release = copy.copy(release)
+                release.files = patch_attached_entities(release, release.files, files_by_ident)
+                release.filesets = patch_attached_entities(
+                    release, release.filesets, filesets_by_ident
+                )
+                release.webcaptures = patch_attached_entities(
+                    release, release.webcaptures, webcaptures_by_ident
+                )
+                self.entity_cache.put(
+                    "release",
+                    release,
+                    expand=RELEASE_EXPAND,
+                    depends_on=release_dependencies(release),
+                )
+                cached_releases[ident] = release
+
+        release_futures = [
+            executor.submit(self.api_call, "get_release", ident, expand=RELEASE_EXPAND)
+            for ident in release_idents
+            if ident not in cached_releases
+        ]
+        fetched_releases = dict()
+
+        for ident, future in zip(container_idents, container_futures):
+            container = future.result()
+            container_dict = self.api.api_client.sanitize_for_serialization(container)
+            produce(
+                self.container_topic,
+                json.dumps(container_dict).encode("utf-8"),
+                key=ident.encode("utf-8"),
+            )
+
+        for future in release_futures:
+            release = future.result()
+            fetched_releases[release.ident] = release
+            if self.entity_cache is not None:
+                self.entity_cache.put(
+                    "release",
+                    release,
+                    expand=RELEASE_EXPAND,
+                    depends_on=release_dependencies(release),
+                )
+
+        for ident in release_idents:
+            release = cached_releases.get(ident) or fetched_releases[ident]
+            if release.work_id:
+                work_ids.append(release.work_id)
+            release_dict = self.api.api_client.sanitize_for_serialization(release)
+            produce(
+                self.release_topic,
+                json.dumps(release_dict).encode("utf-8"),
+                key=ident.encode("utf-8"),
+            )
+            # for ingest requests, filter to "new" active releases with no matched files
+            if release.ident in new_release_ids:
+                ir = release_ingest_request(release, ingest_request_source="fatcat-changelog")
+                if ir and not release.files and self.want_live_ingest(release, ir):
+                    produce(
+                        self.ingest_file_request_topic,
+                        json.dumps(ir).encode("utf-8"),
+                        # key=None,
+                    )
+
+        # send work updates (just ident and changelog metadata) to scholar for re-indexing
+        for ident in set(work_ids):
+            assert ident
+            key = f"work_{ident}"
+            work_ident_dict = dict(
+                key=key,
+                type="fatcat_work",
+                work_ident=ident,
+                updated=last_cle["timestamp"],
+                fatcat_changelog_index=last_cle["index"],
+            )
+            produce(
+                self.work_ident_topic,
+                json.dumps(work_ident_dict).encode("utf-8"),
+                key=key.encode("utf-8"),
+            )
+
     def run(self) -> None:
         def fail_fast(err: Any, _msg: Any) -> None:
             if err is not None:
@@ -319,6 +632,7 @@ class EntityUpdatesWorker(FatcatWorker):
                 },
             }
         )
+        consumer_conf.update(self.consumer_metrics_config())
         consumer = Consumer(consumer_conf)
 
         producer_conf = self.kafka_config.copy()
@@ -332,6 +646,9 @@ class EntityUpdatesWorker(FatcatWorker):
         )
         producer = Producer(producer_conf)
 
+        # bounded pool for concurrent entity fetches from the API
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.fetch_workers)
+
         consumer.subscribe(
             [self.consume_topic],
             on_assign=on_rebalance,
@@ -349,119 +666,46 @@ class EntityUpdatesWorker(FatcatWorker):
             if msg.error():
                 raise KafkaException(msg.error())
 
-            cle = json.loads(msg.value().decode("utf-8"))
-            # print(cle)
-            print("processing changelog index {}".format(cle["index"]))
-            release_ids = []
-            new_release_ids = []
-            file_ids = []
-            fileset_ids = []
-            webcapture_ids = []
-            container_ids = []
-            work_ids = []
-            release_edits = cle["editgroup"]["edits"]["releases"]
-            for re in release_edits:
-                release_ids.append(re["ident"])
-                # filter to direct release edits which are not updates
-                if not re.get("prev_revision") and not re.get("redirect_ident"):
-                    new_release_ids.append(re["ident"])
-            file_edits = cle["editgroup"]["edits"]["files"]
-            for e in file_edits:
-                file_ids.append(e["ident"])
-            fileset_edits = cle["editgroup"]["edits"]["filesets"]
-            for e in fileset_edits:
-                fileset_ids.append(e["ident"])
-            webcapture_edits = cle["editgroup"]["edits"]["webcaptures"]
-            for e in webcapture_edits:
-                webcapture_ids.append(e["ident"])
-            container_edits = cle["editgroup"]["edits"]["containers"]
-            for e in container_edits:
-                container_ids.append(e["ident"])
-            work_edits = cle["editgroup"]["edits"]["works"]
-            for e in work_edits:
-                work_ids.append(e["ident"])
-
-            # TODO: do these fetches in parallel using a thread pool?
-            for ident in set(file_ids):
-                file_entity = self.api.get_file(ident, expand=None)
-                # update release when a file changes
-                # TODO: also fetch old version of file and update any *removed*
-                # release idents (and same for filesets, webcapture updates)
-                release_ids.extend(file_entity.release_ids or [])
-                file_dict = self.api.api_client.sanitize_for_serialization(file_entity)
-                producer.produce(
-                    self.file_topic,
-                    json.dumps(file_dict).encode("utf-8"),
-                    key=ident.encode("utf-8"),
-                    on_delivery=fail_fast,
-                )
-
-            # TODO: topic for fileset updates
-            for ident in set(fileset_ids):
-                fileset_entity = self.api.get_fileset(ident, expand=None)
-                # update release when a fileset changes
-                release_ids.extend(fileset_entity.release_ids or [])
-
-            # TODO: topic for webcapture updates
-            for ident in set(webcapture_ids):
-                webcapture_entity = self.api.get_webcapture(ident, expand=None)
-                # update release when a webcapture changes
-                release_ids.extend(webcapture_entity.release_ids or [])
-
-            for ident in set(container_ids):
-                container = self.api.get_container(ident)
-                container_dict = self.api.api_client.sanitize_for_serialization(container)
-                producer.produce(
-                    self.container_topic,
-                    json.dumps(container_dict).encode("utf-8"),
-                    key=ident.encode("utf-8"),
-                    on_delivery=fail_fast,
-                )
-
-            for ident in set(release_ids):
-                release = self.api.get_release(
-                    ident, expand="files,filesets,webcaptures,container,creators"
+            batch = [msg]
+            deadline = time.time() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                more = consumer.consume(
+                    num_messages=self.batch_size - len(batch), timeout=remaining
                 )
-                if release.work_id:
-                    work_ids.append(release.work_id)
-                release_dict = self.api.api_client.sanitize_for_serialization(release)
-                producer.produce(
-                    self.release_topic,
-                    json.dumps(release_dict).encode("utf-8"),
-                    key=ident.encode("utf-8"),
-                    on_delivery=fail_fast,
-                )
-                # for ingest requests, filter to "new" active releases with no matched files
-                if release.ident in new_release_ids:
-                    ir = release_ingest_request(
-                        release, ingest_request_source="fatcat-changelog"
+                if not more:
+                    break
+                for m in more:
+                    if m.error():
+                        raise KafkaException(m.error())
+                batch.extend(more)
+
+            cles = [json.loads(m.value().decode("utf-8")) for m in batch]
+            if len(cles) == 1:
+                print("processing changelog index {}".format(cles[0]["index"]))
+            else:
+                print(
+                    "processing changelog indexes {} through {} ({} entries)".format(
+                        cles[0]["index"], cles[-1]["index"], len(cles)
                     )
-                    if ir and not release.files and self.want_live_ingest(release, ir):
-                        producer.produce(
-                            self.ingest_file_request_topic,
-                            json.dumps(ir).encode("utf-8"),
-                            # key=None,
-                            on_delivery=fail_fast,
-                        )
-
-            # send work updates (just ident and changelog metadata) to scholar for re-indexing
-            for ident in set(work_ids):
-                assert ident
-                key = f"work_{ident}"
-                work_ident_dict = dict(
-                    key=key,
-                    type="fatcat_work",
-                    work_ident=ident,
-                    updated=cle["timestamp"],
-                    fatcat_changelog_index=cle["index"],
                 )
-                producer.produce(
-                    self.work_ident_topic,
-                    json.dumps(work_ident_dict).encode("utf-8"),
-                    key=key.encode("utf-8"),
-                    on_delivery=fail_fast,
+            self.metrics.inc(
+                "messages_consumed_total", len(batch), labels=dict(topic=self.consume_topic)
+            )
+            with self.metrics.timer("batch_seconds"):
+                self.process_changelog_entries(cles, producer, executor, fail_fast)
+            if self.entity_cache is not None:
+                print(
+                    "entity cache: {} entries; {} hits, {} misses".format(
+                        len(self.entity_cache),
+                        self.entity_cache.counts["hit"],
+                        self.entity_cache.counts["miss"],
+                    )
                 )
 
             producer.flush()
             # TODO: publish updated 'work' entities to a topic
-            consumer.store_offsets(message=msg)
+            for m in batch:
+                consumer.store_offsets(message=m)
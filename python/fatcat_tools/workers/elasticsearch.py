@@ -1,20 +1,29 @@
+import collections
+import concurrent.futures
 import json
 import sys
-from typing import Any, Callable, List, Optional
+import time
+from typing import Any, Callable, Counter, Dict, List, Optional, Tuple
 
 import elasticsearch
-import requests
-from confluent_kafka import Consumer, KafkaException
+from confluent_kafka import Consumer, KafkaException, Message
 from fatcat_openapi_client import (
     ApiClient,
     ChangelogEntry,
     ContainerEntity,
+    DefaultApi,
     FileEntity,
     ReleaseEntity,
 )
 
 from fatcat_tools import entity_from_json, public_api
-from fatcat_tools.search.stats import query_es_container_stats
+from fatcat_tools.search.bulk import (
+    bulk_action_bytes,
+    es_bulk_index_action,
+    es_bulk_session,
+    post_es_bulk_split,
+)
+from fatcat_tools.search.stats import query_es_container_stats_batch
 from fatcat_tools.transforms import (
     changelog_to_elasticsearch,
     container_to_elasticsearch,
@@ -22,7 +31,7 @@ from fatcat_tools.transforms import (
     release_to_elasticsearch,
 )
 
-from .worker_common import FatcatWorker
+from .worker_common import FatcatWorker, coalesce_messages_by_key
 
 
 class ElasticsearchReleaseWorker(FatcatWorker):
@@ -31,6 +40,11 @@ class ElasticsearchReleaseWorker(FatcatWorker):
     elasticsearch.
 
     Uses a consumer group to manage offset.
+
+    Multiple updates to the same entity (Kafka message key) within a batch are
+    coalesced, and only the newest is transformed and indexed. With
+    `coalesce_window` (seconds), the worker keeps consuming for that long after
+    the first message of a batch, to coalesce over a longer period.
     """
 
     def __init__(
@@ -45,6 +59,9 @@ class ElasticsearchReleaseWorker(FatcatWorker):
         batch_size: int = 200,
         api_host: str = "https://api.fatcat.wiki/v0",
         query_stats: bool = False,
+        coalesce_window: float = 0.0,
+        max_bulk_bytes: int = 10 * 1024 * 1024,
+        max_linger: float = 2.0,
     ) -> None:
         super().__init__(kafka_hosts=kafka_hosts, consume_topic=consume_topic)
         self.consumer_group = "elasticsearch-updates3"
@@ -57,6 +74,10 @@ class ElasticsearchReleaseWorker(FatcatWorker):
         self.transform_func: Callable = release_to_elasticsearch
         self.api_host = api_host
         self.query_stats = query_stats
+        self.coalesce_window = coalesce_window
+        self.max_bulk_bytes = max_bulk_bytes
+        self.max_linger = max_linger
+        self.counts: Counter[str] = collections.Counter()
 
     def run(self) -> None:
         ac = ApiClient()
@@ -81,6 +102,38 @@ class ElasticsearchReleaseWorker(FatcatWorker):
             # print("Kafka consumer commit successful")
             pass
 
+        elasticsearch_endpoint = self.bulk_endpoint()
+        # persistent connection pool for bulk requests, which are posted from a
+        # background thread while the next batch is being transformed
+        session = es_bulk_session(pool_size=2)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # (future, messages) for the bulk request currently in flight, if any
+        in_flight: List[Tuple[concurrent.futures.Future, List[Message]]] = []
+
+        def finish_in_flight() -> None:
+            """
+            Waits for any in-flight bulk request, and marks its messages as
+            processed. Offsets are only stored after a successful request.
+            """
+            while in_flight:
+                future, msgs = in_flight.pop(0)
+                failed = future.result()
+                if failed:
+                    self.metrics.inc(
+                        "errors_total", len(failed), labels=dict(source="elasticsearch_bulk")
+                    )
+                    desc = "Elasticsearch errors from post to {}:".format(
+                        elasticsearch_endpoint
+                    )
+                    print(desc, file=sys.stderr)
+                    for _action, result in failed:
+                        print(json.dumps(result), file=sys.stderr)
+                    raise Exception(desc)
+                for msg in msgs:
+                    # offsets are *committed* (to brokers) automatically, but need
+                    # to be marked as processed here
+                    consumer.store_offsets(message=msg)
+
         def on_rebalance(consumer: Consumer, partitions: List[Any]) -> None:
             for p in partitions:
                 if p.error:
@@ -90,6 +143,64 @@ class ElasticsearchReleaseWorker(FatcatWorker):
                 file=sys.stderr,
             )
 
+        # transformed (but not yet flushed) bulk actions, and the messages they
+        # came from
+        pending_actions: List[str] = []
+        pending_msgs: List[Message] = []
+        pending_bytes = 0
+        pending_since = 0.0
+
+        def post_flush(actions: List[str], flush_bytes: int) -> List[Tuple[str, Any]]:
+            start = time.monotonic()
+            with self.metrics.timer("elasticsearch_bulk_seconds"):
+                failed = post_es_bulk_split(
+                    session, elasticsearch_endpoint, actions, self.max_bulk_bytes
+                )
+            self.metrics.inc("documents_indexed_total", len(actions) - len(failed))
+            print(
+                "Flushed {} {} docs ({} bytes) to elasticsearch in {:.2f} sec".format(
+                    len(actions),
+                    self.entity_type.__name__,
+                    flush_bytes,
+                    time.monotonic() - start,
+                ),
+                file=sys.stderr,
+            )
+            return failed
+
+        def flush_pending() -> None:
+            """
+            Submits all pending actions as bulk request(s), in the background.
+            """
+            nonlocal pending_actions, pending_msgs, pending_bytes
+            # wait for previous flush before storing any offsets from this one
+            finish_in_flight()
+            if not pending_actions:
+                # if only WIP entities, then skip
+                for msg in pending_msgs:
+                    consumer.store_offsets(message=msg)
+            else:
+                print(
+                    "Upserting {} {} in elasticsearch (coalesced: {} total)".format(
+                        len(pending_actions),
+                        self.entity_type.__name__,
+                        self.counts["coalesced"],
+                    ),
+                    file=sys.stderr,
+                )
+                future = executor.submit(post_flush, pending_actions, pending_bytes)
+                in_flight.append((future, pending_msgs))
+            pending_actions = []
+            pending_msgs = []
+            pending_bytes = 0
+
+        def on_revoke(consumer: Consumer, partitions: List[Any]) -> None:
+            # store offsets for pending and in-flight messages while partitions
+            # are still ours
+            flush_pending()
+            finish_in_flight()
+            on_rebalance(consumer, partitions)
+
         consumer_conf = self.kafka_config.copy()
         consumer_conf.update(
             {
@@ -107,16 +218,35 @@ class ElasticsearchReleaseWorker(FatcatWorker):
                 },
             }
         )
+        consumer_conf.update(self.consumer_metrics_config())
         consumer = Consumer(consumer_conf)
         consumer.subscribe(
             [self.consume_topic],
             on_assign=on_rebalance,
-            on_revoke=on_rebalance,
+            on_revoke=on_revoke,
         )
 
         while True:
-            batch = consumer.consume(num_messages=self.batch_size, timeout=self.poll_interval)
-            if not batch:
+            if pending_msgs:
+                # don't wait for new messages longer than pending ones may linger
+                timeout = max(0.0, pending_since + self.max_linger - time.monotonic())
+            else:
+                timeout = self.poll_interval
+            batch = consumer.consume(num_messages=self.batch_size, timeout=timeout)
+            if batch and self.coalesce_window:
+                # keep consuming for a short window, so that repeated updates to
+                # the same entity can be coalesced
+                deadline = time.monotonic() + self.coalesce_window
+                while len(batch) < self.batch_size * 10:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.extend(
+                        consumer.consume(num_messages=self.batch_size, timeout=remaining)
+                    )
+            if not batch and not pending_msgs:
+                # nothing new; don't leave a bulk request hanging
+                finish_in_flight()
                 if not consumer.assignment():
                     print("... no Kafka consumer partitions assigned yet", file=sys.stderr)
                 print(
@@ -126,88 +256,100 @@ class ElasticsearchReleaseWorker(FatcatWorker):
                     file=sys.stderr,
                 )
                 continue
-            print("... got {} kafka messages".format(len(batch)), file=sys.stderr)
-            # first check errors on entire batch...
-            for msg in batch:
-                if msg.error():
-                    raise KafkaException(msg.error())
-            # ... then process
-            bulk_actions = []
-            for msg in batch:
-                json_str = msg.value().decode("utf-8")
-                entity = entity_from_json(json_str, self.entity_type, api_client=ac)
-                assert isinstance(entity, self.entity_type)
-                if self.entity_type == ChangelogEntry:
-                    key = entity.index
-                    # might need to fetch from API
-                    if not (
-                        entity.editgroup  # pylint: disable=no-member # (TODO)
-                        and entity.editgroup.editor  # pylint: disable=no-member # (TODO)
-                    ):
-                        entity = api.get_changelog_entry(entity.index)
-                else:
-                    key = entity.ident  # pylint: disable=no-member # (TODO)
-
-                if self.entity_type != ChangelogEntry and entity.state == "wip":
-                    print(
-                        f"WARNING: skipping state=wip entity: {self.entity_type.__name__} {entity.ident}",
-                        file=sys.stderr,
-                    )
-                    continue
-
-                if self.entity_type == ContainerEntity and self.query_stats:
-                    stats = query_es_container_stats(
-                        entity.ident,
-                        es_client=es_client,
-                        es_index=self.elasticsearch_release_index,
-                        merge_shadows=True,
-                    )
-                    doc_dict = container_to_elasticsearch(entity, stats=stats)
-                else:
-                    doc_dict = self.transform_func(entity)
-
-                # TODO: handle deletions from index
-                bulk_actions.append(
-                    json.dumps(
-                        {
-                            "index": {
-                                "_id": key,
-                            },
-                        }
-                    )
+            if batch:
+                print("... got {} kafka messages".format(len(batch)), file=sys.stderr)
+                # first check errors on entire batch...
+                for msg in batch:
+                    if msg.error():
+                        raise KafkaException(msg.error())
+                # ... then process (while any previous flush is being indexed).
+                # offsets are still stored for all messages, including coalesced.
+                self.metrics.inc(
+                    "messages_consumed_total", len(batch), labels=dict(topic=self.consume_topic)
                 )
-                bulk_actions.append(json.dumps(doc_dict))
+                newest = coalesce_messages_by_key(batch)
+                self.counts["coalesced"] += len(batch) - len(newest)
+                with self.metrics.timer("batch_seconds"):
+                    bulk_actions = self.transform_batch(newest, ac, api, es_client)
+                if not pending_msgs:
+                    pending_since = time.monotonic()
+                pending_msgs.extend(batch)
+                pending_actions.extend(bulk_actions)
+                pending_bytes += sum([bulk_action_bytes(a) for a in bulk_actions])
 
-            # if only WIP entities, then skip
-            if not bulk_actions:
-                for msg in batch:
-                    consumer.store_offsets(message=msg)
+            # flush when enough bytes or documents have accumulated, or the
+            # oldest pending message has waited long enough (including when the
+            # consume above timed out)
+            if (
+                not batch
+                or pending_bytes >= self.max_bulk_bytes
+                or len(pending_actions) >= self.batch_size
+                or time.monotonic() - pending_since >= self.max_linger
+            ):
+                flush_pending()
+                if not batch:
+                    # nothing new; don't leave a bulk request hanging
+                    finish_in_flight()
+
+    def bulk_endpoint(self) -> str:
+        return "{}/{}/_bulk".format(self.elasticsearch_backend, self.elasticsearch_index)
+
+    def transform_batch(
+        self,
+        batch: List[Message],
+        ac: ApiClient,
+        api: DefaultApi,
+        es_client: elasticsearch.Elasticsearch,
+    ) -> List[str]:
+        """
+        Transforms a batch of Kafka messages in to a list of elasticsearch bulk
+        actions (see fatcat_tools.search.bulk).
+        """
+        entities = []
+        for msg in batch:
+            json_str = msg.value().decode("utf-8")
+            entity = entity_from_json(json_str, self.entity_type, api_client=ac)
+            assert isinstance(entity, self.entity_type)
+            if self.entity_type == ChangelogEntry:
+                key = entity.index
+                # might need to fetch from API
+                if not (
+                    entity.editgroup  # pylint: disable=no-member # (TODO)
+                    and entity.editgroup.editor  # pylint: disable=no-member # (TODO)
+                ):
+                    entity = api.get_changelog_entry(entity.index)
+            else:
+                key = entity.ident  # pylint: disable=no-member # (TODO)
+
+            if self.entity_type != ChangelogEntry and entity.state == "wip":
+                print(
+                    f"WARNING: skipping state=wip entity: {self.entity_type.__name__} {entity.ident}",
+                    file=sys.stderr,
+                )
                 continue
+            entities.append((key, entity))
 
-            print(
-                "Upserting, eg, {} (of {} {} in elasticsearch)".format(
-                    key, len(batch), self.entity_type.__name__
-                ),
-                file=sys.stderr,
-            )
-            elasticsearch_endpoint = "{}/{}/_bulk".format(
-                self.elasticsearch_backend, self.elasticsearch_index
-            )
-            resp = requests.post(
-                elasticsearch_endpoint,
-                headers={"Content-Type": "application/x-ndjson"},
-                data="\n".join(bulk_actions) + "\n",
+        # container stats for the whole batch are fetched with a single
+        # multi-search request, instead of a query per container
+        batch_stats = dict()
+        if self.entity_type == ContainerEntity and self.query_stats and entities:
+            batch_stats = query_es_container_stats_batch(
+                [entity.ident for _, entity in entities],
+                es_client=es_client,
+                es_index=self.elasticsearch_release_index,
+                merge_shadows=True,
             )
-            resp.raise_for_status()
-            if resp.json()["errors"]:
-                desc = "Elasticsearch errors from post to {}:".format(elasticsearch_endpoint)
-                print(desc, file=sys.stderr)
-                print(resp.content, file=sys.stderr)
-                raise Exception(desc)
-            for msg in batch:
-                # offsets are *committed* (to brokers) automatically, but need
-                # to be marked as processed here
-                consumer.store_offsets(message=msg)
+
+        bulk_actions = []
+        for key, entity in entities:
+            if self.entity_type == ContainerEntity and self.query_stats:
+                doc_dict = container_to_elasticsearch(entity, stats=batch_stats[entity.ident])
+            else:
+                doc_dict = self.transform_func(entity)
+
+            # TODO: handle deletions from index
+            bulk_actions.append(es_bulk_index_action(str(key), json.dumps(doc_dict)))
+        return bulk_actions
 
 
 class ElasticsearchContainerWorker(ElasticsearchReleaseWorker):
@@ -222,6 +364,9 @@ class ElasticsearchContainerWorker(ElasticsearchReleaseWorker):
         elasticsearch_backend: str = "http://localhost:9200",
         elasticsearch_index: str = "fatcat_container",
         batch_size: int = 200,
+        coalesce_window: float = 0.0,
+        max_bulk_bytes: int = 10 * 1024 * 1024,
+        max_linger: float = 2.0,
     ):
         super().__init__(
             kafka_hosts=kafka_hosts,
@@ -233,6 +378,9 @@ class ElasticsearchContainerWorker(ElasticsearchReleaseWorker):
             elasticsearch_release_index=elasticsearch_release_index,
             query_stats=query_stats,
             batch_size=batch_size,
+            coalesce_window=coalesce_window,
+            max_bulk_bytes=max_bulk_bytes,
+            max_linger=max_linger,
         )
         # previous group got corrupted (by pykafka library?)
         self.consumer_group = "elasticsearch-updates3"
@@ -250,6 +398,9 @@ class ElasticsearchFileWorker(ElasticsearchReleaseWorker):
         elasticsearch_backend: str = "http://localhost:9200",
         elasticsearch_index: str = "fatcat_file",
         batch_size: int = 200,
+        coalesce_window: float = 0.0,
+        max_bulk_bytes: int = 10 * 1024 * 1024,
+        max_linger: float = 2.0,
     ):
         super().__init__(
             kafka_hosts=kafka_hosts,
@@ -259,6 +410,9 @@ class ElasticsearchFileWorker(ElasticsearchReleaseWorker):
             elasticsearch_backend=elasticsearch_backend,
             elasticsearch_index=elasticsearch_index,
             batch_size=batch_size,
+            coalesce_window=coalesce_window,
+            max_bulk_bytes=max_bulk_bytes,
+            max_linger=max_linger,
         )
         # previous group got corrupted (by pykafka library?)
         self.consumer_group = "elasticsearch-updates3"
@@ -292,3 +446,212 @@ class ElasticsearchChangelogWorker(ElasticsearchReleaseWorker):
         self.elasticsearch_index = elasticsearch_index
         self.entity_type = ChangelogEntry
         self.transform_func = changelog_to_elasticsearch
+
+
+class ElasticsearchMultiWorker(FatcatWorker):
+    """
+    Consumes from several entity update topics in a single process, and
+    pushes each in to its own elasticsearch index.
+
+    Each topic is handled by a (not running) single-topic worker instance,
+    which provides the transform, index, and batch size for that topic. All
+    topics share one Kafka consumer (in the same consumer group as the
+    single-topic workers), one elasticsearch HTTP connection pool, and one API
+    client (for deserialization).
+
+    Offsets are still managed per topic: each topic can have one bulk request
+    in flight, and offsets for a topic are only stored after its own requests
+    succeed.
+    """
+
+    def __init__(
+        self,
+        kafka_hosts: str,
+        workers: List[ElasticsearchReleaseWorker],
+        poll_interval: float = 10.0,
+        api_host: str = "https://api.fatcat.wiki/v0",
+        coalesce_window: float = 0.0,
+    ) -> None:
+        super().__init__(kafka_hosts=kafka_hosts)
+        self.consumer_group = "elasticsearch-updates3"
+        self.workers: Dict[str, ElasticsearchReleaseWorker] = dict()
+        for worker in workers:
+            assert worker.consume_topic
+            self.workers[worker.consume_topic] = worker
+        self.batch_size = sum([w.batch_size for w in workers])
+        self.poll_interval = poll_interval
+        self.api_host = api_host
+        self.coalesce_window = coalesce_window
+        self.counts: Counter[str] = collections.Counter()
+
+    def run(self) -> None:
+        ac = ApiClient()
+        api = public_api(self.api_host)
+
+        # only used by container indexing query_stats code path
+        es_clients = dict()
+        for worker in self.workers.values():
+            if worker.elasticsearch_backend not in es_clients:
+                es_clients[worker.elasticsearch_backend] = elasticsearch.Elasticsearch(
+                    worker.elasticsearch_backend
+                )
+
+        def fail_fast(err: Any, partitions: List[Any]) -> None:
+            if err is not None:
+                print("Kafka consumer commit error: {}".format(err), file=sys.stderr)
+                print("Bailing out...", file=sys.stderr)
+                raise KafkaException(err)
+            for p in partitions:
+                # check for partition-specific commit errors
+                if p.error:
+                    print("Kafka consumer commit error: {}".format(p.error), file=sys.stderr)
+                    print("Bailing out...", file=sys.stderr)
+                    raise KafkaException(p.error)
+
+        session = es_bulk_session(pool_size=2 * len(self.workers))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.workers))
+        # topic -> (future, messages, endpoint) for the bulk request currently
+        # in flight for that topic, if any
+        in_flight: Dict[str, Tuple[concurrent.futures.Future, List[Message], str]] = dict()
+
+        def post_bulk(
+            topic: str, endpoint: str, actions: List[str], max_bytes: int
+        ) -> List[Tuple[str, Any]]:
+            with self.metrics.timer("elasticsearch_bulk_seconds", labels=dict(topic=topic)):
+                failed = post_es_bulk_split(session, endpoint, actions, max_bytes)
+            self.metrics.inc(
+                "documents_indexed_total", len(actions) - len(failed), labels=dict(topic=topic)
+            )
+            return failed
+
+        def finish_in_flight(topic: str) -> None:
+            """
+            Waits for any in-flight bulk request for the topic, and marks its
+            messages as processed.
+            """
+            if topic not in in_flight:
+                return
+            future, msgs, endpoint = in_flight.pop(topic)
+            failed = future.result()
+            if failed:
+                self.metrics.inc(
+                    "errors_total",
+                    len(failed),
+                    labels=dict(source="elasticsearch_bulk", topic=topic),
+                )
+                desc = "Elasticsearch errors from post to {}:".format(endpoint)
+                print(desc, file=sys.stderr)
+                for _action, result in failed:
+                    print(json.dumps(result), file=sys.stderr)
+                raise Exception(desc)
+            for msg in msgs:
+                consumer.store_offsets(message=msg)
+
+        def finish_all_in_flight() -> None:
+            for topic in list(in_flight.keys()):
+                finish_in_flight(topic)
+
+        def on_rebalance(consumer: Consumer, partitions: List[Any]) -> None:
+            for p in partitions:
+                if p.error:
+                    raise KafkaException(p.error)
+            print(
+                "Kafka partitions rebalanced: {} / {}".format(consumer, partitions),
+                file=sys.stderr,
+            )
+
+        def on_revoke(consumer: Consumer, partitions: List[Any]) -> None:
+            # store offsets for in-flight messages while partitions are still ours
+            finish_all_in_flight()
+            on_rebalance(consumer, partitions)
+
+        consumer_conf = self.kafka_config.copy()
+        consumer_conf.update(
+            {
+                "group.id": self.consumer_group,
+                "on_commit": fail_fast,
+                # messages don't have offset marked as stored until pushed to
+                # elastic, but we do auto-commit stored offsets to broker
+                "enable.auto.commit": True,
+                "enable.auto.offset.store": False,
+                "max.poll.interval.ms": 60000,
+                "default.topic.config": {
+                    "auto.offset.reset": "latest",
+                },
+            }
+        )
+        consumer_conf.update(self.consumer_metrics_config())
+        consumer = Consumer(consumer_conf)
+        consumer.subscribe(
+            list(self.workers.keys()),
+            on_assign=on_rebalance,
+            on_revoke=on_revoke,
+        )
+        print("Kafka consuming {}".format(", ".join(self.workers.keys())), file=sys.stderr)
+
+        while True:
+            batch = consumer.consume(num_messages=self.batch_size, timeout=self.poll_interval)
+            if batch and self.coalesce_window:
+                deadline = time.monotonic() + self.coalesce_window
+                while len(batch) < self.batch_size * 10:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.extend(
+                        consumer.consume(num_messages=self.batch_size, timeout=remaining)
+                    )
+            if not batch:
+                finish_all_in_flight()
+                print(
+                    "... nothing new from kafka, try again (interval: {}".format(
+                        self.poll_interval
+                    ),
+                    file=sys.stderr,
+                )
+                continue
+            print("... got {} kafka messages".format(len(batch)), file=sys.stderr)
+            for msg in batch:
+                if msg.error():
+                    raise KafkaException(msg.error())
+
+            by_topic: Dict[str, List[Message]] = collections.OrderedDict()
+            for msg in batch:
+                by_topic.setdefault(msg.topic(), []).append(msg)
+
+            for topic, msgs in by_topic.items():
+                worker = self.workers[topic]
+                self.metrics.inc("messages_consumed_total", len(msgs), labels=dict(topic=topic))
+                newest = coalesce_messages_by_key(msgs)
+                self.counts["coalesced"] += len(msgs) - len(newest)
+                chunks = [
+                    newest[i : i + worker.batch_size]
+                    for i in range(0, len(newest), worker.batch_size)
+                ]
+                for i, chunk in enumerate(chunks):
+                    # offsets for all the topic's messages (including coalesced)
+                    # are stored along with the last chunk
+                    done = msgs if i == len(chunks) - 1 else []
+                    with self.metrics.timer("batch_seconds", labels=dict(topic=topic)):
+                        bulk_actions = worker.transform_batch(
+                            chunk, ac, api, es_clients[worker.elasticsearch_backend]
+                        )
+
+                    # wait for the previous request for this topic
+                    finish_in_flight(topic)
+
+                    if not bulk_actions:
+                        for msg in done:
+                            consumer.store_offsets(message=msg)
+                        continue
+
+                    print(
+                        "Upserting {} {} in elasticsearch".format(
+                            len(bulk_actions), worker.entity_type.__name__
+                        ),
+                        file=sys.stderr,
+                    )
+                    endpoint = worker.bulk_endpoint()
+                    future = executor.submit(
+                        post_bulk, topic, endpoint, bulk_actions, worker.max_bulk_bytes
+                    )
+                    in_flight[topic] = (future, done, endpoint)
@@ -0,0 +1,115 @@
+import collections
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+CacheKey = Tuple[str, str, str, str]
+EntityRef = Tuple[str, str]
+
+
+class EntityCache:
+    """
+    Size-bounded (LRU) cache of fetched entities, keyed by (entity type,
+    ident, revision, expand).
+
+    Entity revisions are immutable, so a cached entity stays valid for as long
+    as the ident still points to the same revision. Callers keep this up to
+    date by calling `update_revision()` for every edit they observe (eg, from
+    the changelog). Cached entities can also be registered as depending on
+    other entities (eg, the container or creators of an expanded release), in
+    which case an edit to any dependency evicts them.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self.entities: "collections.OrderedDict[CacheKey, Any]" = collections.OrderedDict()
+        # current revision of each cached (entity type, ident)
+        self.revisions: Dict[EntityRef, str] = dict()
+        self.keys_by_ref: Dict[EntityRef, Set[CacheKey]] = dict()
+        self.dependents: Dict[EntityRef, Set[CacheKey]] = dict()
+        self.depends_on: Dict[CacheKey, List[EntityRef]] = dict()
+        self.counts: "collections.Counter[str]" = collections.Counter()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def get(self, entity_type: str, ident: str, expand: Optional[str] = None) -> Optional[Any]:
+        with self.lock:
+            revision = self.revisions.get((entity_type, ident))
+            entity = None
+            if revision:
+                key = (entity_type, ident, revision, expand or "")
+                entity = self.entities.get(key)
+            if entity is None:
+                self.counts["miss"] += 1
+                return None
+            self.entities.move_to_end(key)
+            self.counts["hit"] += 1
+            return entity
+
+    def put(
+        self,
+        entity_type: str,
+        entity: Any,
+        expand: Optional[str] = None,
+        depends_on: Iterable[EntityRef] = (),
+    ) -> None:
+        """
+        Entities without a revision (eg, deleted) and redirects are not cached.
+        """
+        if not entity.revision or getattr(entity, "redirect", None):
+            return
+        with self.lock:
+            ref = (entity_type, entity.ident)
+            if self.revisions.get(ref) not in (None, entity.revision):
+                self._evict_ref(ref)
+            key = (entity_type, entity.ident, entity.revision, expand or "")
+            self._remove(key)
+            self.revisions[ref] = entity.revision
+            self.entities[key] = entity
+            self.keys_by_ref.setdefault(ref, set()).add(key)
+            self.depends_on[key] = list(depends_on)
+            for dep in self.depends_on[key]:
+                self.dependents.setdefault(dep, set()).add(key)
+            while len(self.entities) > self.max_size:
+                self._remove(next(iter(self.entities)))
+                self.counts["evicted"] += 1
+
+    def update_revision(self, entity_type: str, ident: str, revision: Optional[str]) -> None:
+        """
+        Records that an entity was edited, and now points to the given
+        revision (None for deletions and redirects).
+
+        Cached copies of the entity at any other revision are dropped, as are
+        all cached entities which depend on it.
+        """
+        with self.lock:
+            ref = (entity_type, ident)
+            if not revision or self.revisions.get(ref) not in (None, revision):
+                self._evict_ref(ref)
+            for key in list(self.dependents.get(ref, ())):
+                self._remove(key)
+                self.counts["invalidated"] += 1
+
+    def _evict_ref(self, ref: EntityRef) -> None:
+        for key in list(self.keys_by_ref.get(ref, ())):
+            self._remove(key)
+        self.revisions.pop(ref, None)
+
+    def _remove(self, key: CacheKey) -> None:
+        if self.entities.pop(key, None) is None:
+            return
+        for dep in self.depends_on.pop(key, []):
+            keys = self.dependents.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[dep]
+        ref = (key[0], key[1])
+        keys = self.keys_by_ref[ref]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_ref[ref]
+            self.revisions.pop(ref, None)
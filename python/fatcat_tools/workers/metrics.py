@@ -0,0 +1,190 @@
+"""
+Lightweight worker telemetry: counters, gauges, and latency histograms, which
+can be scraped in Prometheus text format from an embedded HTTP server, and/or
+pushed to a statsd daemon over UDP.
+
+Only uses the standard library, so is always available. When neither
+endpoint is configured, metrics are still recorded (cheaply) in memory.
+"""
+
+import contextlib
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+# histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_set(labels: Optional[Dict[str, Any]]) -> LabelSet:
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: LabelSet, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels)
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v.replace('"', '\\"')) for k, v in pairs) + "}"
+
+
+class WorkerMetrics:
+    """
+    Registry of worker metrics. Metric names are prefixed with `prefix`.
+
+    Counters and histograms are cumulative, as Prometheus expects; rates (eg,
+    messages/sec) are computed at query time. Thread-safe.
+    """
+
+    def __init__(self, prefix: str = "fatcat_worker", statsd_addr: Optional[str] = None):
+        self.prefix = prefix
+        self.counters: Dict[str, Dict[LabelSet, float]] = dict()
+        self.gauges: Dict[str, Dict[LabelSet, float]] = dict()
+        # name -> labels -> (bucket counts, sum, count)
+        self.histograms: Dict[str, Dict[LabelSet, Tuple[List[int], float, int]]] = dict()
+        self.buckets = DEFAULT_BUCKETS
+        self.lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.statsd_sock: Optional[socket.socket] = None
+        self.statsd_dest: Optional[Tuple[str, int]] = None
+        if statsd_addr:
+            host, _, port = statsd_addr.partition(":")
+            self.statsd_dest = (host, int(port or 8125))
+            self.statsd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def inc(self, name: str, value: float = 1, labels: Optional[Dict[str, Any]] = None) -> None:
+        key = _label_set(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+        self._statsd(name, key, value, "c")
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None) -> None:
+        key = _label_set(labels)
+        with self.lock:
+            self.gauges.setdefault(name, dict())[key] = value
+        self._statsd(name, key, value, "g")
+
+    def observe(
+        self, name: str, seconds: float, labels: Optional[Dict[str, Any]] = None
+    ) -> None:
+        key = _label_set(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, dict())
+            counts, total, count = series.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            series[key] = (counts, total + seconds, count + 1)
+        self._statsd(name, key, seconds * 1000.0, "ms")
+
+    @contextlib.contextmanager
+    def timer(self, name: str, labels: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+        """
+        Records the duration of the block in the named histogram. If the block
+        raises, an error is counted instead.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.inc("errors_total", labels=dict(labels or {}, source=name))
+            raise
+        self.observe(name, time.monotonic() - start, labels)
+
+    def _statsd(self, name: str, labels: LabelSet, value: float, kind: str) -> None:
+        if not self.statsd_sock or not self.statsd_dest:
+            return
+        # plain statsd has no labels; fold the values in to the metric name
+        parts = [self.prefix, name] + [v.replace(".", "_") for _, v in labels]
+        line = "{}:{}|{}".format(".".join(parts), value, kind)
+        try:
+            self.statsd_sock.sendto(line.encode("utf-8"), self.statsd_dest)
+        except OSError as e:
+            print("statsd send failed: {}".format(e), file=sys.stderr)
+
+    def kafka_stats(self, stats_json: str) -> None:
+        """
+        Callback for librdkafka statistics (`stats_cb` in consumer config);
+        records consumer lag per topic partition.
+        """
+        stats = json.loads(stats_json)
+        for topic, topic_stats in stats.get("topics", {}).items():
+            for partition, p in topic_stats.get("partitions", {}).items():
+                # -1 is the internal "unassigned" partition; lag is -1 if unknown
+                if partition == "-1" or p.get("consumer_lag", -1) < 0:
+                    continue
+                self.set(
+                    "kafka_consumer_lag",
+                    p["consumer_lag"],
+                    labels=dict(topic=topic, partition=partition),
+                )
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                full = "{}_{}".format(self.prefix, name)
+                lines.append("# TYPE {} counter".format(full))
+                for labels, value in sorted(series.items()):
+                    lines.append("{}{} {}".format(full, _format_labels(labels), value))
+            for name, series in sorted(self.gauges.items()):
+                full = "{}_{}".format(self.prefix, name)
+                lines.append("# TYPE {} gauge".format(full))
+                for labels, value in sorted(series.items()):
+                    lines.append("{}{} {}".format(full, _format_labels(labels), value))
+            for name, hseries in sorted(self.histograms.items()):
+                full = "{}_{}".format(self.prefix, name)
+                lines.append("# TYPE {} histogram".format(full))
+                for labels, (counts, total, count) in sorted(hseries.items()):
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(
+                            "{}_bucket{} {}".format(
+                                full, _format_labels(labels, ("le", str(bound))), bucket_count
+                            )
+                        )
+                    lines.append(
+                        "{}_bucket{} {}".format(
+                            full, _format_labels(labels, ("le", "+Inf")), count
+                        )
+                    )
+                    lines.append("{}_sum{} {}".format(full, _format_labels(labels), total))
+                    lines.append("{}_count{} {}".format(full, _format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> None:
+        """
+        Starts an HTTP server (in a background thread) which responds to
+        requests for `/metrics` with Prometheus text format.
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                # don't spam stderr with a line per scrape
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        print("Serving worker metrics on http://{}:{}/metrics".format(host, port))
@@ -1,8 +1,10 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 from confluent_kafka import Consumer, KafkaException, Message, TopicPartition
 from fatcat_openapi_client import ApiClient
 
+from .metrics import WorkerMetrics
+
 
 def most_recent_message(topic: str, kafka_config: Dict[str, Any]) -> Message:
     """
@@ -48,6 +50,26 @@ def most_recent_message(topic: str, kafka_config: Dict[str, Any]) -> Message:
     return msg.value()
 
 
+def coalesce_messages_by_key(msgs: List[Message]) -> List[Message]:
+    """
+    Last-write-wins de-duplication of a list of Kafka messages: for each
+    (topic, key), only the newest message is kept. Relative order is
+    preserved, and messages with no key are always kept.
+
+    Messages with the same key are on the same partition, so list order is
+    publish order.
+    """
+    newest: Dict[Any, int] = dict()
+    for i, msg in enumerate(msgs):
+        if msg.key() is not None:
+            newest[(msg.topic(), msg.key())] = i
+    return [
+        msg
+        for i, msg in enumerate(msgs)
+        if msg.key() is None or newest[(msg.topic(), msg.key())] == i
+    ]
+
+
 class FatcatWorker:
     """
     Common code for for Kafka producers and consumers.
@@ -68,3 +90,40 @@ class FatcatWorker:
         }
         self.produce_topic = produce_topic
         self.consume_topic = consume_topic
+        # always recorded; only exported if start_metrics() is called
+        self.metrics = WorkerMetrics()
+        self.metrics_enabled = False
+
+    def start_metrics(
+        self, port: Optional[int] = None, statsd_addr: Optional[str] = None
+    ) -> None:
+        """
+        Exports worker metrics: in Prometheus text format over HTTP (on the
+        given port), and/or to a statsd daemon ("host:port").
+        """
+        if not (port or statsd_addr):
+            return
+        if statsd_addr:
+            self.metrics = WorkerMetrics(statsd_addr=statsd_addr)
+        if port:
+            self.metrics.serve(port)
+        self.metrics_enabled = True
+
+    def consumer_metrics_config(self) -> Dict[str, Any]:
+        """
+        Extra Kafka consumer config, to report consumer lag when metrics are
+        enabled.
+        """
+        if not self.metrics_enabled:
+            return dict()
+        return {
+            "statistics.interval.ms": 15000,
+            "stats_cb": self.metrics.kafka_stats,
+        }
+
+    def api_call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """
+        Calls a fatcat API method (by name), recording latency.
+        """
+        with self.metrics.timer("api_request_seconds", labels=dict(method=method)):
+            return getattr(self.api, method)(*args, **kwargs)
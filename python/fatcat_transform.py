@@ -6,17 +6,32 @@ other formats
 """
 
 import argparse
+import collections
+import concurrent.futures
+import functools
 import json
 import sys
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, TextIO
 
 import elasticsearch
-from fatcat_openapi_client import ChangelogEntry, ContainerEntity, FileEntity, ReleaseEntity
+from fatcat_openapi_client import (
+    ApiClient,
+    ChangelogEntry,
+    ContainerEntity,
+    FileEntity,
+    ReleaseEntity,
+)
 
 from fatcat_tools import public_api
-from fatcat_tools.search.stats import query_es_container_stats
+from fatcat_tools.search.bulk import ElasticsearchBulkLoader, es_bulk_index_action
+from fatcat_tools.search.stats import (
+    empty_container_stats,
+    iter_es_all_container_stats,
+    query_es_container_stats_batch,
+)
 from fatcat_tools.transforms import (
     changelog_to_elasticsearch,
-    citeproc_csl,
+    citeproc_csl_batch,
     container_to_elasticsearch,
     entity_from_json,
     file_to_elasticsearch,
@@ -24,77 +39,222 @@ from fatcat_tools.transforms import (
     release_to_elasticsearch,
 )
 
+# per-process state for parallel (--workers) transforms. Each worker process
+# gets its own API client, which is only used for JSON deserialization.
+_worker_api_client: Optional[ApiClient] = None
 
-def run_elasticsearch_releases(args: argparse.Namespace) -> None:
-    for line in args.json_input:
+
+def _init_transform_worker(api_url: str) -> None:
+    global _worker_api_client
+    _worker_api_client = public_api(api_url).api_client
+
+
+def _transform_worker_chunk(
+    func: Callable[[List[str], ApiClient], List[str]], lines: List[str]
+) -> List[str]:
+    assert _worker_api_client is not None
+    return func(lines, _worker_api_client)
+
+
+def _iter_line_chunks(json_input: TextIO, chunk_size: int) -> Iterator[List[str]]:
+    chunk = []
+    for line in json_input:
         line = line.strip()
         if not line:
             continue
-        entity = entity_from_json(line, ReleaseEntity, api_client=args.api.api_client)
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_line_transform(
+    args: argparse.Namespace, func: Callable[[List[str], ApiClient], List[str]]
+) -> Iterator[str]:
+    """
+    Runs a transform function over chunks of JSON input lines, yielding output
+    records in input order.
+
+    With --workers greater than one, chunks are transformed in a pool of
+    processes. A bounded number of chunks are in flight at any time, so large
+    (or streamed) inputs are not read entirely in to memory.
+    """
+    chunks = _iter_line_chunks(args.json_input, args.chunk_size)
+    if args.workers <= 1:
+        for chunk in chunks:
+            yield from func(chunk, args.api.api_client)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_transform_worker,
+        initargs=(args.fatcat_api_url,),
+    ) as executor:
+        pending: Deque[concurrent.futures.Future] = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_transform_worker_chunk, func, chunk))
+            if len(pending) >= args.workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def run_line_transform(
+    args: argparse.Namespace, func: Callable[[List[str], ApiClient], List[str]]
+) -> None:
+    """
+    Writes transform output to json_output, or (with --es-bulk-endpoint)
+    streams it directly in to elasticsearch, in which case any failed bulk
+    actions are written to json_output instead.
+    """
+    if not args.__dict__.get("es_bulk_endpoint"):
+        for out in iter_line_transform(args, func):
+            args.json_output.write(out + "\n")
+        return
+
+    loader = ElasticsearchBulkLoader(
+        args.es_bulk_endpoint,
+        concurrency=args.es_bulk_concurrency,
+        max_bytes=args.es_bulk_max_bytes,
+        failed_output=args.json_output,
+    )
+    for action in iter_line_transform(args, functools.partial(func, es_bulk=True)):
+        loader.add(action)
+    counts = loader.finish()
+    print("Elasticsearch bulk load counts: {}".format(dict(counts)), file=sys.stderr)
+
+
+def _es_output(key: str, doc: Dict[str, Any], es_bulk: bool) -> str:
+    if es_bulk:
+        return es_bulk_index_action(key, json.dumps(doc))
+    return json.dumps(doc)
+
+
+def transform_release_lines(
+    lines: List[str], api_client: ApiClient, es_bulk: bool = False
+) -> List[str]:
+    out = []
+    for line in lines:
+        entity = entity_from_json(line, ReleaseEntity, api_client=api_client)
         if entity.state != "active":
             continue
-        args.json_output.write(json.dumps(release_to_elasticsearch(entity)) + "\n")
+        out.append(_es_output(entity.ident, release_to_elasticsearch(entity), es_bulk))
+    return out
 
 
-def run_elasticsearch_containers(args: argparse.Namespace) -> None:
-    es_client = elasticsearch.Elasticsearch(args.fatcat_elasticsearch_url)
-    es_release_index = "fatcat_release"
-    for line in args.json_input:
-        line = line.strip()
-        if not line:
+def transform_file_lines(
+    lines: List[str], api_client: ApiClient, es_bulk: bool = False
+) -> List[str]:
+    out = []
+    for line in lines:
+        entity = entity_from_json(line, FileEntity, api_client=api_client)
+        if entity.state != "active":
             continue
-        entity = entity_from_json(line, ContainerEntity, api_client=args.api.api_client)
+        out.append(_es_output(entity.ident, file_to_elasticsearch(entity), es_bulk))
+    return out
+
+
+def transform_changelog_lines(
+    lines: List[str], api_client: ApiClient, es_bulk: bool = False
+) -> List[str]:
+    out = []
+    for line in lines:
+        entity = entity_from_json(line, ChangelogEntry, api_client=api_client)
+        out.append(_es_output(str(entity.index), changelog_to_elasticsearch(entity), es_bulk))
+    return out
+
+
+def transform_citeproc_lines(
+    lines: List[str],
+    api_client: ApiClient,
+    style: str = "csl-json",
+    html: bool = False,
+    batch_size: int = 100,
+) -> List[str]:
+    out = []
+    batch = []
+    for line in lines:
+        entity = entity_from_json(line, ReleaseEntity, api_client=api_client)
         if entity.state != "active":
             continue
+        csl_json = release_to_csl(entity)
+        csl_json["id"] = "release:" + (entity.ident or "unknown")
+        batch.append(csl_json)
+        if len(batch) >= batch_size:
+            out.extend(citeproc_csl_batch(batch, style, html))
+            batch = []
+    if batch:
+        out.extend(citeproc_csl_batch(batch, style, html))
+    return out
 
-        if args.query_stats:
-            es_doc = container_to_elasticsearch(
-                entity,
-                stats=query_es_container_stats(
-                    entity.ident,
-                    es_client=es_client,
-                    es_index=es_release_index,
-                    merge_shadows=True,
-                ),
+
+def run_elasticsearch_releases(args: argparse.Namespace) -> None:
+    run_line_transform(args, transform_release_lines)
+
+
+def run_elasticsearch_containers(args: argparse.Namespace) -> None:
+    es_client = elasticsearch.Elasticsearch(args.fatcat_elasticsearch_url)
+    es_release_index = "fatcat_release"
+
+    all_stats: Optional[Dict[str, Dict[str, Any]]] = None
+    if args.query_stats and args.all_stats:
+        print("Scanning release index for all container stats...", file=sys.stderr)
+        all_stats = dict()
+        for stats in iter_es_all_container_stats(
+            es_client, es_index=es_release_index, merge_shadows=True
+        ):
+            all_stats[stats["ident"]] = stats
+        print("Got stats for {} containers".format(len(all_stats)), file=sys.stderr)
+
+    for chunk in _iter_line_chunks(args.json_input, args.stats_batch_size):
+        entities = [
+            entity_from_json(line, ContainerEntity, api_client=args.api.api_client)
+            for line in chunk
+        ]
+        entities = [e for e in entities if e.state == "active"]
+
+        batch_stats: Dict[str, Dict[str, Any]] = dict()
+        if args.query_stats and all_stats is not None:
+            batch_stats = {
+                e.ident: all_stats.get(e.ident) or empty_container_stats(e.ident)
+                for e in entities
+            }
+        elif args.query_stats:
+            batch_stats = query_es_container_stats_batch(
+                [e.ident for e in entities],
+                es_client=es_client,
+                es_index=es_release_index,
+                merge_shadows=True,
             )
-        else:
-            es_doc = container_to_elasticsearch(entity)
 
-        args.json_output.write(json.dumps(es_doc) + "\n")
+        for entity in entities:
+            if args.query_stats:
+                es_doc = container_to_elasticsearch(entity, stats=batch_stats[entity.ident])
+            else:
+                es_doc = container_to_elasticsearch(entity)
+            args.json_output.write(json.dumps(es_doc) + "\n")
 
 
 def run_elasticsearch_files(args: argparse.Namespace) -> None:
-    for line in args.json_input:
-        line = line.strip()
-        if not line:
-            continue
-        entity = entity_from_json(line, FileEntity, api_client=args.api.api_client)
-        if entity.state != "active":
-            continue
-        args.json_output.write(json.dumps(file_to_elasticsearch(entity)) + "\n")
+    run_line_transform(args, transform_file_lines)
 
 
 def run_elasticsearch_changelogs(args: argparse.Namespace) -> None:
-    for line in args.json_input:
-        line = line.strip()
-        if not line:
-            continue
-        entity = entity_from_json(line, ChangelogEntry, api_client=args.api.api_client)
-        args.json_output.write(json.dumps(changelog_to_elasticsearch(entity)) + "\n")
+    run_line_transform(args, transform_changelog_lines)
 
 
 def run_citeproc_releases(args: argparse.Namespace) -> None:
-    for line in args.json_input:
-        line = line.strip()
-        if not line:
-            continue
-        entity = entity_from_json(line, ReleaseEntity, api_client=args.api.api_client)
-        if entity.state != "active":
-            continue
-        csl_json = release_to_csl(entity)
-        csl_json["id"] = "release:" + (entity.ident or "unknown")
-        out = citeproc_csl(csl_json, args.style, args.html)
-        args.json_output.write(out + "\n")
+    run_line_transform(
+        args,
+        functools.partial(
+            transform_citeproc_lines,
+            style=args.style,
+            html=args.html,
+            batch_size=args.batch_size,
+        ),
+    )
 
 
 def main() -> None:
@@ -149,6 +309,17 @@ def main() -> None:
         action="store_true",
         help="whether to query release search index for container stats",
     )
+    sub_elasticsearch_containers.add_argument(
+        "--stats-batch-size",
+        help="number of containers to query stats for in a single multi-search request",
+        default=100,
+        type=int,
+    )
+    sub_elasticsearch_containers.add_argument(
+        "--all-stats",
+        action="store_true",
+        help="with --query-stats, fetch stats for all containers up front, in a single scan of the release index",
+    )
 
     sub_elasticsearch_files = subparsers.add_parser(
         "elasticsearch-files",
@@ -209,6 +380,55 @@ def main() -> None:
     sub_citeproc_releases.add_argument(
         "--html", action="store_true", help="output HTML, not plain text"
     )
+    sub_citeproc_releases.add_argument(
+        "--batch-size",
+        help="number of releases to render as a single bibliography",
+        default=100,
+        type=int,
+    )
+
+    for sub in (
+        sub_elasticsearch_releases,
+        sub_elasticsearch_files,
+        sub_elasticsearch_changelogs,
+        sub_citeproc_releases,
+    ):
+        sub.add_argument(
+            "--workers",
+            help="number of parallel transform processes (output order is preserved)",
+            default=1,
+            type=int,
+        )
+        sub.add_argument(
+            "--chunk-size",
+            help="number of input lines per transform chunk",
+            default=100,
+            type=int,
+        )
+
+    for sub in (
+        sub_elasticsearch_releases,
+        sub_elasticsearch_files,
+        sub_elasticsearch_changelogs,
+    ):
+        sub.add_argument(
+            "--es-bulk-endpoint",
+            help="push documents directly to this elasticsearch _bulk URL (eg, http://localhost:9200/fatcat_release/_bulk); failed bulk actions are written to json_output",
+            default=None,
+            type=str,
+        )
+        sub.add_argument(
+            "--es-bulk-concurrency",
+            help="number of concurrent elasticsearch _bulk requests",
+            default=4,
+            type=int,
+        )
+        sub.add_argument(
+            "--es-bulk-max-bytes",
+            help="maximum size of each elasticsearch _bulk request body",
+            default=10 * 1024 * 1024,
+            type=int,
+        )
 
     args = parser.parse_args()
     if not args.__dict__.get("func"):
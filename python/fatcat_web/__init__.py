@@ -16,6 +16,7 @@ from flask_wtf.csrf import CSRFProtect
 from loginpass import GitHub, Gitlab, ORCiD, create_flask_blueprint
 from sentry_sdk.integrations.flask import FlaskIntegration
 
+from fatcat_web.entity_cache import EntityResponseCache, RedisEntityStore
 from fatcat_web.types import AnyResponse
 from fatcat_web.web_config import Config  # type: ignore
 
@@ -88,6 +89,17 @@ app.register_blueprint(mwoauth.bp, url_prefix="/auth/wikipedia")
 
 app.es_client = elasticsearch.Elasticsearch(Config.ELASTICSEARCH_BACKEND, timeout=40.0)
 
+app.entity_cache = EntityResponseCache(
+    max_size=Config.ENTITY_CACHE_SIZE,
+    ttl=Config.ENTITY_CACHE_TTL,
+    changelog_interval=Config.ENTITY_CACHE_CHANGELOG_INTERVAL,
+    store=(
+        RedisEntityStore(Config.ENTITY_CACHE_REDIS_URL)
+        if Config.ENTITY_CACHE_REDIS_URL
+        else None
+    ),
+)
+
 from fatcat_web import auth, cors, editing_routes, forms, ref_routes, routes
 
 # TODO: blocking on ORCID support in loginpass
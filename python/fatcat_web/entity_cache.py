@@ -0,0 +1,326 @@
+"""
+Cache of fetched (and enriched) entities for the web interface, so that
+popular entity pages don't need a fresh API fetch (often with heavy expands)
+and enrichment transform on every view.
+
+Entities are cached in-process, and optionally also in a shared
+redis-compatible key/value store, so that several web processes (or hosts)
+can share fetches.
+
+Revisions are immutable, so entities fetched by revision are kept until they
+get pushed out (or a dependency is edited). Entities fetched by ident expire
+after a short TTL, and are evicted sooner if the changelog shows they (or
+entities they were expanded with) were edited.
+"""
+
+import collections
+import copy
+import pickle
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import urllib3
+from fatcat_openapi_client import Editgroup
+from fatcat_openapi_client.rest import ApiException
+
+# (entity_type, "ident" or "rev", ident or revision, enriched)
+CacheKey = Tuple[str, str, str, bool]
+EntityRef = Tuple[str, str]
+
+ENTITY_TYPES = ("container", "creator", "file", "fileset", "webcapture", "release", "work")
+
+
+class RedisEntityStore:
+    """
+    Shared second-level store, in any server speaking the redis protocol.
+    Values are pickled (entity, dependencies) tuples, so the server must be
+    trusted (eg, local).
+
+    The keys of stored entities are also added to a set per dependency, so
+    that an edit seen by any web process evicts dependent entities stored by
+    all of them. Entities fetched by revision (and the dependency sets) are
+    kept for `rev_ttl` seconds, so any that get missed are eventually dropped.
+
+    Store errors are logged and treated as cache misses, so an unavailable
+    store doesn't take down the web interface.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        prefix: str = "fatcat-web:entity:",
+        rev_ttl: float = 24 * 60 * 60,
+        client: Any = None,
+    ) -> None:
+        self.prefix = prefix
+        self.rev_ttl = rev_ttl
+        if client is not None:
+            self.client = client
+            self.errors: Any = ()
+            return
+        # only needed when configured
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.errors = redis.RedisError
+
+    def _key(self, key: CacheKey) -> str:
+        return self.prefix + ":".join(str(k) for k in key)
+
+    def _dep_key(self, ref: EntityRef) -> str:
+        return self.prefix + "dep:" + ":".join(ref)
+
+    def get(self, key: CacheKey) -> Optional[Tuple[Any, List[EntityRef]]]:
+        try:
+            blob = self.client.get(self._key(key))
+        except self.errors as e:
+            print("entity store get failed: {}".format(e), file=sys.stderr)
+            return None
+        if blob is None:
+            return None
+        return pickle.loads(blob)
+
+    def set(
+        self, key: CacheKey, value: Tuple[Any, List[EntityRef]], ttl: Optional[float]
+    ) -> None:
+        ttl = ttl or self.rev_ttl
+        try:
+            pipe = self.client.pipeline()
+            pipe.set(
+                self._key(key),
+                pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                px=int(ttl * 1000),
+            )
+            for ref in value[1]:
+                pipe.sadd(self._dep_key(ref), self._key(key))
+                pipe.expire(self._dep_key(ref), int(self.rev_ttl))
+            pipe.execute()
+        except self.errors as e:
+            print("entity store set failed: {}".format(e), file=sys.stderr)
+
+    def invalidate(self, keys: List[CacheKey], refs: List[EntityRef]) -> None:
+        """
+        Deletes the given keys, and the keys of all entities stored as
+        depending on any of `refs`.
+        """
+        try:
+            pipe = self.client.pipeline()
+            for ref in refs:
+                pipe.smembers(self._dep_key(ref))
+            dependents = pipe.execute() if refs else []
+            delete = [self._key(k) for k in keys] + [self._dep_key(ref) for ref in refs]
+            for members in dependents:
+                delete.extend(members)
+            if delete:
+                self.client.delete(*delete)
+        except self.errors as e:
+            print("entity store delete failed: {}".format(e), file=sys.stderr)
+
+
+class EntityResponseCache:
+    """
+    Size-bounded (LRU) cache of entities as returned to web views.
+
+    Callers always get their own copy of a cached entity (views attach extra
+    attributes to entities before rendering). A `max_size` of 0 disables
+    caching.
+
+    Cached entities can be registered as depending on other entities (eg, the
+    container and files of an expanded release), in which case an edit to any
+    dependency evicts them.
+
+    Safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 2000,
+        ttl: float = 60.0,
+        changelog_interval: float = 10.0,
+        max_changelog_catch_up: int = 100,
+        store: Optional[RedisEntityStore] = None,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.changelog_interval = changelog_interval
+        self.max_changelog_catch_up = max_changelog_catch_up
+        self.store = store
+        # key -> (entity, expiry time or None)
+        self.entities: "collections.OrderedDict[CacheKey, Tuple[Any, Optional[float]]]" = (
+            collections.OrderedDict()
+        )
+        self.dependents: Dict[EntityRef, Set[CacheKey]] = dict()
+        self.depends_on: Dict[CacheKey, List[EntityRef]] = dict()
+        self.counts: "collections.Counter[str]" = collections.Counter()
+        self.lock = threading.Lock()
+        self.changelog_lock = threading.Lock()
+        self.changelog_index: Optional[int] = None
+        self.next_changelog_sync = 0.0
+        self.changelog_thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def _expiry(self, key: CacheKey) -> Optional[float]:
+        if key[1] == "rev":
+            return None
+        return time.monotonic() + self.ttl
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        if not self.max_size:
+            return None
+        with self.lock:
+            entity, expires = self.entities.get(key, (None, None))
+            if entity is not None and expires is not None and expires < time.monotonic():
+                self._remove(key)
+                entity = None
+            if entity is not None:
+                self.entities.move_to_end(key)
+                self.counts["hit"] += 1
+                return copy.deepcopy(entity)
+        if self.store:
+            stored = self.store.get(key)
+            if stored is not None:
+                self.counts["store_hit"] += 1
+                entity, depends_on = stored
+                self._put(key, copy.deepcopy(entity), depends_on)
+                return entity
+        self.counts["miss"] += 1
+        return None
+
+    def put(self, key: CacheKey, entity: Any, depends_on: Iterable[EntityRef] = ()) -> None:
+        """
+        Stores a private copy of the entity; the caller may keep modifying
+        the one it passed in.
+        """
+        if not self.max_size:
+            return
+        entity = copy.deepcopy(entity)
+        depends_on = list(depends_on)
+        if self.store:
+            self.store.set(key, (entity, depends_on), None if key[1] == "rev" else self.ttl)
+        self._put(key, entity, depends_on)
+
+    def _put(self, key: CacheKey, entity: Any, depends_on: Iterable[EntityRef]) -> None:
+        with self.lock:
+            self._remove(key)
+            self.entities[key] = (entity, self._expiry(key))
+            self.depends_on[key] = list(depends_on)
+            for dep in self.depends_on[key]:
+                self.dependents.setdefault(dep, set()).add(key)
+            while len(self.entities) > self.max_size:
+                self._remove(next(iter(self.entities)))
+                self.counts["evicted"] += 1
+
+    def _remove(self, key: CacheKey) -> None:
+        if self.entities.pop(key, None) is None:
+            return
+        for dep in self.depends_on.pop(key, []):
+            keys = self.dependents.get(dep)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[dep]
+
+    def invalidate(self, entity_type: str, ident: str) -> None:
+        """
+        Drops the entity (as fetched by ident), and any cached entities which
+        depend on it.
+        """
+        ref = (entity_type, ident)
+        with self.lock:
+            keys = [(entity_type, "ident", ident, enrich) for enrich in (True, False)]
+            keys.extend(self.dependents.get(ref, ()))
+            for key in keys:
+                self._remove(key)
+        if self.store:
+            self.store.invalidate(keys, [ref])
+
+    def invalidate_editgroup(self, editgroup: Editgroup) -> None:
+        if not editgroup or not editgroup.edits:
+            return
+        for entity_type in ENTITY_TYPES:
+            for edit in getattr(editgroup.edits, entity_type + "s") or []:
+                self.invalidate(entity_type, edit.ident)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entities.clear()
+            self.dependents.clear()
+            self.depends_on.clear()
+
+    def _changelog_sync_due(self) -> bool:
+        if not self.max_size or not self.changelog_interval:
+            return False
+        return time.monotonic() >= self.next_changelog_sync
+
+    def sync_changelog(self, api: Any) -> None:
+        """
+        At most every `changelog_interval` seconds, fetches any changelog
+        entries accepted since the last sync, and evicts the entities they
+        edited. If too many entries were missed to catch up on, all entities
+        are dropped.
+
+        Only one thread syncs at a time; others carry on with what's cached.
+        API errors (including connection errors and timeouts) are logged, and
+        the sync is retried later.
+        """
+        if not self._changelog_sync_due():
+            return
+        if not self.changelog_lock.acquire(blocking=False):
+            return
+        self._sync_changelog_locked(api)
+
+    def sync_changelog_background(self, api: Any) -> None:
+        """
+        Like sync_changelog(), but if a sync is due it runs in a background
+        thread, so that requests never wait on changelog fetches.
+        """
+        if not self._changelog_sync_due():
+            return
+        if not self.changelog_lock.acquire(blocking=False):
+            return
+        try:
+            self.changelog_thread = threading.Thread(
+                target=self._sync_changelog_locked,
+                args=(api,),
+                name="entity-cache-changelog-sync",
+                daemon=True,
+            )
+            self.changelog_thread.start()
+        except Exception:
+            self.changelog_lock.release()
+            raise
+
+    def _sync_changelog_locked(self, api: Any) -> None:
+        # changelog_lock is held by the caller, and released here
+        try:
+            self.next_changelog_sync = time.monotonic() + self.changelog_interval
+            latest = api.get_changelog(limit=1)
+            if not latest:
+                return
+            index = latest[0].index
+            if self.changelog_index is None:
+                # nothing cached yet can be older than this
+                self.changelog_index = index
+                return
+            if index - self.changelog_index > self.max_changelog_catch_up:
+                self.clear()
+            else:
+                for i in range(self.changelog_index + 1, index + 1):
+                    try:
+                        entry = api.get_changelog_entry(i)
+                    except ApiException as ae:
+                        # changelog index numbers can (rarely) have gaps
+                        if ae.status != 404:
+                            raise
+                        continue
+                    self.invalidate_editgroup(entry.editgroup)
+                    self.changelog_index = i
+            self.changelog_index = index
+        except (ApiException, urllib3.exceptions.HTTPError, OSError) as e:
+            print("entity cache changelog sync failed: {}".format(e), file=sys.stderr)
+        finally:
+            self.changelog_lock.release()
@@ -22,7 +22,8 @@ from fatcat_tools.transforms import (
     file_to_elasticsearch,
     release_to_elasticsearch,
 )
-from fatcat_web import api
+from fatcat_web import api, app
+from fatcat_web.entity_cache import EntityRef
 from fatcat_web.hacks import strip_extlink_xml, wayback_suffix
 
 
@@ -141,7 +142,46 @@ def enrich_work_entity(entity: WorkEntity) -> WorkEntity:
     return entity
 
 
-def generic_get_entity(entity_type: str, ident: str, enrich: bool = True) -> Any:
+def entity_dependencies(entity_type: str, entity: Any) -> List[EntityRef]:
+    """
+    Other entities which were fetched along with (expanded in to) this one,
+    or listed by enrichment, such that an edit to any of them should evict
+    this entity from the cache.
+    """
+    deps: List[EntityRef] = []
+    if entity_type == "release":
+        if entity.container_id:
+            deps.append(("container", entity.container_id))
+        deps.extend(("file", f.ident) for f in entity.files or [])
+        deps.extend(("fileset", fs.ident) for fs in entity.filesets or [])
+        deps.extend(("webcapture", wc.ident) for wc in entity.webcaptures or [])
+        deps.extend(("creator", c.creator_id) for c in entity.contribs or [] if c.creator_id)
+    elif entity_type in ("file", "fileset", "webcapture"):
+        deps.extend(("release", ident) for ident in entity.release_ids or [])
+    elif entity_type in ("creator", "work"):
+        deps.extend(("release", r.ident) for r in getattr(entity, "_releases", None) or [])
+    return deps
+
+
+def generic_get_entity(
+    entity_type: str, ident: str, enrich: bool = True, cached: bool = False
+) -> Any:
+    """
+    With `cached`, the entity may come from (or is added to) the shared entity
+    cache; only for read-only views, as it may be a few seconds stale.
+    """
+    if not cached:
+        return _fetch_entity(entity_type, ident, enrich)
+    app.entity_cache.sync_changelog_background(api)
+    key = (entity_type, "ident", ident, enrich)
+    entity = app.entity_cache.get(key)
+    if entity is None:
+        entity = _fetch_entity(entity_type, ident, enrich)
+        app.entity_cache.put(key, entity, entity_dependencies(entity_type, entity))
+    return entity
+
+
+def _fetch_entity(entity_type: str, ident: str, enrich: bool) -> Any:
     try:
         if entity_type == "container" and enrich:
             return enrich_container_entity(api.get_container(ident))
@@ -181,7 +221,25 @@ def generic_get_entity(entity_type: str, ident: str, enrich: bool = True) -> Any
         abort(400)
 
 
-def generic_get_entity_revision(entity_type: str, revision_id: str, enrich: bool = True) -> Any:
+def generic_get_entity_revision(
+    entity_type: str, revision_id: str, enrich: bool = True, cached: bool = False
+) -> Any:
+    """
+    Revisions are immutable, so cached revisions don't expire; they are still
+    evicted if an expanded entity (eg, the container of a release) is edited.
+    """
+    if not cached:
+        return _fetch_entity_revision(entity_type, revision_id, enrich)
+    app.entity_cache.sync_changelog_background(api)
+    key = (entity_type, "rev", revision_id, enrich)
+    entity = app.entity_cache.get(key)
+    if entity is None:
+        entity = _fetch_entity_revision(entity_type, revision_id, enrich)
+        app.entity_cache.put(key, entity, entity_dependencies(entity_type, entity))
+    return entity
+
+
+def _fetch_entity_revision(entity_type: str, revision_id: str, enrich: bool) -> Any:
     try:
         if entity_type == "container" and enrich:
             return enrich_container_entity(api.get_container_revision(revision_id))
@@ -284,7 +342,9 @@ def generic_get_editgroup_entity(
         return generic_deleted_entity(entity_type, ident), edit
 
     try:
-        entity = generic_get_entity_revision(entity_type, revision_id, enrich=enrich)
+        entity = generic_get_entity_revision(
+            entity_type, revision_id, enrich=enrich, cached=True
+        )
     except ApiException as ae:
         abort(ae.status)
     except ApiValueError:
@@ -317,13 +377,15 @@ def _entity_edit_diff(entity_type: str, entity_edit: EntityEdit) -> List[str]:
             redirect_ident
     """
     pop_fields = ["ident", "revision", "state"]
-    new_rev = generic_get_entity_revision(entity_type, entity_edit.revision, enrich=False)
+    new_rev = generic_get_entity_revision(
+        entity_type, entity_edit.revision, enrich=False, cached=True
+    )
     new_toml = entity_to_toml(new_rev, pop_fields=pop_fields).strip().split("\n")
     if len(new_toml) == 1 and not new_toml[0].strip():
         new_toml = []
     if entity_edit.prev_revision:
         old_rev = generic_get_entity_revision(
-            entity_type, entity_edit.prev_revision, enrich=False
+            entity_type, entity_edit.prev_revision, enrich=False, cached=True
         )
         old_toml = entity_to_toml(old_rev, pop_fields=pop_fields).strip().split("\n")
         fromdesc = f"/{entity_type}/rev/{entity_edit.prev_revision}.toml"
@@ -82,7 +82,7 @@ def release_view_refs_inbound(ident: str) -> AnyResponse:
     if request.accept_mimetypes.best == "application/json":
         return release_view_refs_inbound_json(ident)
 
-    release = generic_get_entity("release", ident)
+    release = generic_get_entity("release", ident, cached=True)
     hits = _refs_web("in", release_ident=ident)
     return (
         render_template(
@@ -97,7 +97,7 @@ def release_view_refs_outbound(ident: str) -> AnyResponse:
     if request.accept_mimetypes.best == "application/json":
         return release_view_refs_outbound_json(ident)
 
-    release = generic_get_entity("release", ident)
+    release = generic_get_entity("release", ident, cached=True)
     hits = _refs_web("out", release_ident=ident)
     return (
         render_template(
@@ -58,18 +58,22 @@ from fatcat_web.kafka import kafka_pixy_produce
 from fatcat_web.search import (
     GenericQuery,
     ReleaseQuery,
+    SearchBatch,
     do_container_search,
     do_release_search,
     get_elastic_container_browse_year_volume_issue,
     get_elastic_container_histogram_legacy,
     get_elastic_container_preservation_by_volume,
-    get_elastic_container_random_releases,
     get_elastic_container_stats,
     get_elastic_entity_stats,
-    get_elastic_preservation_by_date,
     get_elastic_preservation_by_type,
     get_elastic_preservation_by_year,
-    get_elastic_search_coverage,
+    prepare_container_random_releases,
+    prepare_container_stats,
+    prepare_preservation_by_date,
+    prepare_preservation_by_type,
+    prepare_preservation_by_year,
+    prepare_search_coverage,
 )
 
 ### Generic Entity Views ####################################################
@@ -270,7 +274,7 @@ GENERIC_ENTITY_FIELDS = ["extra", "edit_extra", "revision", "redirect", "state",
 
 
 def generic_entity_view(entity_type: str, ident: str, view_template: str) -> AnyResponse:
-    entity = generic_get_entity(entity_type, ident)
+    entity = generic_get_entity(entity_type, ident, cached=True)
 
     if entity.state == "redirect":
         return redirect("/{}/{}".format(entity_type, entity.redirect))
@@ -283,13 +287,21 @@ def generic_entity_view(entity_type: str, ident: str, view_template: str) -> Any
     entity._metadata = metadata
 
     if view_template == "container_view.html":
-        entity._stats = get_elastic_container_stats(entity.ident, issnl=entity.issnl)
-        entity._random_releases = get_elastic_container_random_releases(entity.ident)
+        batch = SearchBatch()
+        stats = batch.add(prepare_container_stats(entity.ident, issnl=entity.issnl))
+        random_releases = batch.add(prepare_container_random_releases(entity.ident))
+        batch.execute()
+        entity._stats = stats.result()
+        entity._random_releases = random_releases.result()
     if view_template == "container_view_coverage.html":
-        entity._stats = get_elastic_container_stats(entity.ident, issnl=entity.issnl)
-        entity._type_preservation = get_elastic_preservation_by_type(
-            ReleaseQuery(container_id=ident),
+        batch = SearchBatch()
+        stats = batch.add(prepare_container_stats(entity.ident, issnl=entity.issnl))
+        type_preservation = batch.add(
+            prepare_preservation_by_type(ReleaseQuery(container_id=ident))
         )
+        batch.execute()
+        entity._stats = stats.result()
+        entity._type_preservation = type_preservation.result()
 
     return render_template(
         view_template, entity_type=entity_type, entity=entity, editgroup_id=None
@@ -299,7 +311,7 @@ def generic_entity_view(entity_type: str, ident: str, view_template: str) -> Any
 def generic_entity_revision_view(
     entity_type: str, revision_id: str, view_template: str
 ) -> AnyResponse:
-    entity = generic_get_entity_revision(entity_type, revision_id)
+    entity = generic_get_entity_revision(entity_type, revision_id, cached=True)
 
     metadata = entity.to_dict()
     for k in GENERIC_ENTITY_FIELDS:
@@ -354,7 +366,7 @@ def container_view_coverage(ident: str) -> AnyResponse:
 
 @app.route("/container/<string(length=26):ident>/browse", methods=["GET"])
 def container_view_browse(ident: str) -> AnyResponse:
-    entity = generic_get_entity("container", ident)
+    entity = generic_get_entity("container", ident, cached=True)
 
     if entity.state == "redirect":
         return redirect(f"/container/{entity.redirect}")
@@ -868,6 +880,7 @@ def editgroup_accept(ident: str) -> AnyResponse:
         if eg.changelog_index:
             abort(400, "Editgroup already accepted")
         user_api.accept_editgroup(str(ident))
+        app.entity_cache.invalidate_editgroup(eg)
     except ApiException as ae:
         app.log.info(ae)
         abort(ae.status)
@@ -1152,8 +1165,17 @@ def coverage_search() -> AnyResponse:
         )
 
     query = ReleaseQuery.from_args(request.args)
+    # the histograms are only shown if there are any hits, but it is quicker
+    # to run them along with the summary than to wait for it first
+    batch = SearchBatch()
+    coverage = batch.add(prepare_search_coverage(query))
+    type_preservation = batch.add(prepare_preservation_by_type(query))
+    if query.recent:
+        histogram = batch.add(prepare_preservation_by_date(query))
+    else:
+        histogram = batch.add(prepare_preservation_by_year(query))
     try:
-        coverage_stats = get_elastic_search_coverage(query)
+        batch.execute()
     except FatcatSearchError as fse:
         return (
             render_template(
@@ -1167,21 +1189,20 @@ def coverage_search() -> AnyResponse:
             ),
             fse.status_code,
         )
+    coverage_stats = coverage.result()
     year_histogram_svg = None
     date_histogram_svg = None
     coverage_type_preservation = None
     if coverage_stats["total"] > 1:
-        coverage_type_preservation = get_elastic_preservation_by_type(query)
+        coverage_type_preservation = type_preservation.result()
         if query.recent:
-            date_histogram = get_elastic_preservation_by_date(query)
             date_histogram_svg = preservation_by_date_histogram(
-                date_histogram,
+                histogram.result(),
                 merge_shadows=Config.FATCAT_MERGE_SHADOW_PRESERVATION,
             ).render_data_uri()
         else:
-            year_histogram = get_elastic_preservation_by_year(query)
             year_histogram_svg = preservation_by_year_histogram(
-                year_histogram,
+                histogram.result(),
                 merge_shadows=Config.FATCAT_MERGE_SHADOW_PRESERVATION,
             ).render_data_uri()
     return render_template(
@@ -1196,7 +1217,7 @@ def coverage_search() -> AnyResponse:
 
 @app.route("/container/<string(length=26):ident>/search", methods=["GET", "POST"])
 def container_view_search(ident: str) -> AnyResponse:
-    entity = generic_get_entity("container", ident)
+    entity = generic_get_entity("container", ident, cached=True)
 
     if entity.state == "redirect":
         return redirect(f"/container/{entity.redirect}")
@@ -5,20 +5,27 @@ the formal API)
 
 import datetime
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
 
 import elasticsearch
 from elasticsearch_dsl import Q, Search
 
 from fatcat_tools.search.common import (
+    FatcatMultiSearch,
     _hits_total_int,
     agg_to_dict,
     results_to_dict,
     wrap_es_execution,
 )
-from fatcat_tools.search.stats import query_es_container_stats
+from fatcat_tools.search.stats import (
+    container_stats_from_aggs,
+    container_stats_search,
+    query_es_container_stats,
+)
 from fatcat_web import app
 
+T = TypeVar("T")
+
 
 @dataclass
 class ReleaseQuery:
@@ -81,6 +88,81 @@ class SearchHits:
     results: List[Any]
 
 
+@dataclass
+class PreparedSearch(Generic[T]):
+    """
+    An elasticsearch query, along with the function which converts its
+    response in to a result. Can be run on its own, or as part of a
+    SearchBatch.
+
+    Note that only some request parameters (like `request_cache`) are allowed
+    in _msearch headers; others (like `track_total_hits`) need to go in the
+    query body, using `Search.extra()`.
+    """
+
+    search: Search
+    parse: Callable[[Any], T]
+
+    def execute(self) -> T:
+        return self.parse(wrap_es_execution(self.search))
+
+
+class BatchedSearch(Generic[T]):
+    """
+    Handle for the result of one query in a SearchBatch, available once the
+    batch has been executed.
+    """
+
+    def __init__(self, prepared: PreparedSearch[T]) -> None:
+        self.prepared = prepared
+        self.done = False
+        self.value: Optional[T] = None
+
+    def result(self) -> T:
+        if not self.done:
+            raise RuntimeError("search batch has not been executed")
+        return self.value  # type: ignore
+
+
+class SearchBatch:
+    """
+    Collects the elasticsearch queries needed to render a page, and runs them
+    as a single _msearch request, so the page waits for (about) the slowest
+    query instead of the sum of all of them.
+
+    Usage:
+
+        batch = SearchBatch()
+        stats = batch.add(prepare_container_stats(ident))
+        releases = batch.add(prepare_container_random_releases(ident))
+        batch.execute()
+        stats.result()
+
+    If any of the queries fail, execute() raises FatcatSearchError.
+    """
+
+    def __init__(self, es_client: Optional[elasticsearch.Elasticsearch] = None) -> None:
+        self.es_client = es_client or app.es_client
+        self.pending: List[BatchedSearch] = []
+
+    def add(self, prepared: PreparedSearch[T]) -> BatchedSearch[T]:
+        batched = BatchedSearch(prepared)
+        self.pending.append(batched)
+        return batched
+
+    def execute(self) -> None:
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        msearch = FatcatMultiSearch(using=self.es_client)
+        for batched in pending:
+            msearch = msearch.add(batched.prepared.search)
+        responses = wrap_es_execution(msearch)
+        for batched, resp in zip(pending, responses):
+            batched.value = batched.prepared.parse(resp)
+            batched.done = True
+
+
 def do_container_search(query: GenericQuery, deep_page_limit: int = 2000) -> SearchHits:
 
     search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_CONTAINER_INDEX"])
@@ -225,6 +307,12 @@ def get_elastic_container_random_releases(ident: str, limit: int = 5) -> List[Di
     """
     Returns a list of releases from the container.
     """
+    return prepare_container_random_releases(ident, limit).execute()
+
+
+def prepare_container_random_releases(
+    ident: str, limit: int = 5
+) -> PreparedSearch[List[Dict[str, Any]]]:
 
     assert limit > 0 and limit <= 100
 
@@ -241,10 +329,8 @@ def get_elastic_container_random_releases(ident: str, limit: int = 5) -> List[Di
 
     search = search.params(request_cache=True)
     # not needed: search = search.params(track_total_hits=True)
-    resp = wrap_es_execution(search)
-    results = results_to_dict(resp)
 
-    return results
+    return PreparedSearch(search, results_to_dict)
 
 
 def _sort_vol_key(val: Optional[Any]) -> Tuple[bool, bool, int, str]:
@@ -455,6 +541,10 @@ def get_elastic_entity_stats() -> dict:
 
 
 def get_elastic_search_coverage(query: ReleaseQuery) -> dict:
+    return prepare_search_coverage(query).execute()
+
+
+def prepare_search_coverage(query: ReleaseQuery) -> PreparedSearch[dict]:
 
     search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_RELEASE_INDEX"])
     search = search.query(
@@ -481,23 +571,24 @@ def get_elastic_search_coverage(query: ReleaseQuery) -> dict:
     search = search[:0]
 
     search = search.params(request_cache=True)
-    search = search.params(track_total_hits=True)
-    resp = wrap_es_execution(search)
-
-    preservation_bucket = agg_to_dict(resp.aggregations.preservation)
-    preservation_bucket["total"] = _hits_total_int(resp.hits.total)
-    for k in ("bright", "dark", "shadows_only", "none"):
-        if k not in preservation_bucket:
-            preservation_bucket[k] = 0
-    if app.config["FATCAT_MERGE_SHADOW_PRESERVATION"]:
-        preservation_bucket["none"] += preservation_bucket["shadows_only"]
-        preservation_bucket["shadows_only"] = 0
-    stats = {
-        "total": _hits_total_int(resp.hits.total),
-        "preservation": preservation_bucket,
-    }
-
-    return stats
+    search = search.extra(track_total_hits=True)
+
+    def parse(resp: Any) -> dict:
+        preservation_bucket = agg_to_dict(resp.aggregations.preservation)
+        preservation_bucket["total"] = _hits_total_int(resp.hits.total)
+        for k in ("bright", "dark", "shadows_only", "none"):
+            if k not in preservation_bucket:
+                preservation_bucket[k] = 0
+        if app.config["FATCAT_MERGE_SHADOW_PRESERVATION"]:
+            preservation_bucket["none"] += preservation_bucket["shadows_only"]
+            preservation_bucket["shadows_only"] = 0
+        stats = {
+            "total": _hits_total_int(resp.hits.total),
+            "preservation": preservation_bucket,
+        }
+        return stats
+
+    return PreparedSearch(search, parse)
 
 
 def get_elastic_container_stats(
@@ -541,6 +632,32 @@ def get_elastic_container_stats(
     return stats
 
 
+def prepare_container_stats(
+    ident: str, issnl: Optional[str] = None
+) -> PreparedSearch[Dict[str, Any]]:
+    """
+    Same query and result as get_elastic_container_stats(), using the web
+    interface's elasticsearch client and config.
+    """
+    search = container_stats_search(
+        ident, app.es_client, app.config["ELASTICSEARCH_RELEASE_INDEX"]
+    )
+    search = search.params(request_cache=True)
+    search = search.extra(track_total_hits=True)
+
+    def parse(resp: Any) -> Dict[str, Any]:
+        stats = container_stats_from_aggs(
+            ident,
+            _hits_total_int(resp.hits.total),
+            resp.aggregations,
+            app.config["FATCAT_MERGE_SHADOW_PRESERVATION"],
+        )
+        stats["issnl"] = issnl
+        return stats
+
+    return PreparedSearch(search, parse)
+
+
 def get_elastic_container_histogram_legacy(ident: str) -> List[Tuple[int, bool, int]]:
     """
     Fetches a stacked histogram of {year, in_ia}. This is for the older style
@@ -622,6 +739,10 @@ def get_elastic_preservation_by_year(query: ReleaseQuery) -> List[Dict[str, Any]
 
     Stubs can be excluded by setting the appropriate query flag
     """
+    return prepare_preservation_by_year(query).execute()
+
+
+def prepare_preservation_by_year(query: ReleaseQuery) -> PreparedSearch[List[Dict[str, Any]]]:
 
     search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_RELEASE_INDEX"])
     if query.q not in [None, "*"]:
@@ -682,24 +803,26 @@ def get_elastic_preservation_by_year(query: ReleaseQuery) -> List[Dict[str, Any]
     )
     search = search[:0]
     search = search.params(request_cache="true")
-    search = search.params(track_total_hits=True)
-    resp = wrap_es_execution(search)
+    search = search.extra(track_total_hits=True)
+
+    def parse(resp: Any) -> List[Dict[str, Any]]:
+        buckets = resp.aggregations.year_preservation.buckets
+        year_nums = set([int(h["key"]["year"]) for h in buckets])
+        year_dicts = dict()
+        if year_nums:
+            for num in range(min(year_nums), max(year_nums) + 1):
+                year_dicts[num] = dict(year=num, bright=0, dark=0, shadows_only=0, none=0)
+            for row in buckets:
+                year_dicts[int(row["key"]["year"])][row["key"]["preservation"]] = int(
+                    row["doc_count"]
+                )
+        if app.config["FATCAT_MERGE_SHADOW_PRESERVATION"]:
+            for k in year_dicts.keys():
+                year_dicts[k]["none"] += year_dicts[k]["shadows_only"]
+                year_dicts[k]["shadows_only"] = 0
+        return sorted(year_dicts.values(), key=lambda x: x["year"])
 
-    buckets = resp.aggregations.year_preservation.buckets
-    year_nums = set([int(h["key"]["year"]) for h in buckets])
-    year_dicts = dict()
-    if year_nums:
-        for num in range(min(year_nums), max(year_nums) + 1):
-            year_dicts[num] = dict(year=num, bright=0, dark=0, shadows_only=0, none=0)
-        for row in buckets:
-            year_dicts[int(row["key"]["year"])][row["key"]["preservation"]] = int(
-                row["doc_count"]
-            )
-    if app.config["FATCAT_MERGE_SHADOW_PRESERVATION"]:
-        for k in year_dicts.keys():
-            year_dicts[k]["none"] += year_dicts[k]["shadows_only"]
-            year_dicts[k]["shadows_only"] = 0
-    return sorted(year_dicts.values(), key=lambda x: x["year"])
+    return PreparedSearch(search, parse)
 
 
 def get_elastic_preservation_by_date(query: ReleaseQuery) -> List[dict]:
@@ -713,6 +836,10 @@ def get_elastic_preservation_by_date(query: ReleaseQuery) -> List[dict]:
 
         {date (str), bright (int), dark (int), shadows_only (int), none (int)}
     """
+    return prepare_preservation_by_date(query).execute()
+
+
+def prepare_preservation_by_date(query: ReleaseQuery) -> PreparedSearch[List[dict]]:
 
     search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_RELEASE_INDEX"])
     if query.q not in [None, "*"]:
@@ -767,24 +894,28 @@ def get_elastic_preservation_by_date(query: ReleaseQuery) -> List[dict]:
     )
     search = search[:0]
     search = search.params(request_cache="true")
-    search = search.params(track_total_hits=True)
-    resp = wrap_es_execution(search)
+    search = search.extra(track_total_hits=True)
+
+    def parse(resp: Any) -> List[dict]:
+        buckets = resp.aggregations.date_preservation.buckets
+        date_dicts: Dict[str, Dict[str, Any]] = dict()
+        this_date = start_date
+        while this_date <= end_date:
+            date_dicts[str(this_date)] = dict(
+                date=str(this_date), bright=0, dark=0, shadows_only=0, none=0
+            )
+            this_date = this_date + datetime.timedelta(days=1)
+        for row in buckets:
+            date_dicts[row["key"]["date"][0:10]][row["key"]["preservation"]] = int(
+                row["doc_count"]
+            )
+        if app.config["FATCAT_MERGE_SHADOW_PRESERVATION"]:
+            for k in date_dicts.keys():
+                date_dicts[k]["none"] += date_dicts[k]["shadows_only"]
+                date_dicts[k]["shadows_only"] = 0
+        return sorted(date_dicts.values(), key=lambda x: x["date"])
 
-    buckets = resp.aggregations.date_preservation.buckets
-    date_dicts: Dict[str, Dict[str, Any]] = dict()
-    this_date = start_date
-    while this_date <= end_date:
-        date_dicts[str(this_date)] = dict(
-            date=str(this_date), bright=0, dark=0, shadows_only=0, none=0
-        )
-        this_date = this_date + datetime.timedelta(days=1)
-    for row in buckets:
-        date_dicts[row["key"]["date"][0:10]][row["key"]["preservation"]] = int(row["doc_count"])
-    if app.config["FATCAT_MERGE_SHADOW_PRESERVATION"]:
-        for k in date_dicts.keys():
-            date_dicts[k]["none"] += date_dicts[k]["shadows_only"]
-            date_dicts[k]["shadows_only"] = 0
-    return sorted(date_dicts.values(), key=lambda x: x["date"])
+    return PreparedSearch(search, parse)
 
 
 def get_elastic_container_preservation_by_volume(query: ReleaseQuery) -> List[dict]:
@@ -884,6 +1015,10 @@ def get_elastic_preservation_by_type(query: ReleaseQuery) -> List[dict]:
 
         {year (int), bright (int), dark (int), shadows_only (int), none (int)}
     """
+    return prepare_preservation_by_type(query).execute()
+
+
+def prepare_preservation_by_type(query: ReleaseQuery) -> PreparedSearch[List[dict]]:
 
     search = Search(using=app.es_client, index=app.config["ELASTICSEARCH_RELEASE_INDEX"])
     if query.q not in [None, "*"]:
@@ -928,23 +1063,27 @@ def get_elastic_preservation_by_type(query: ReleaseQuery) -> List[dict]:
     )
     search = search[:0]
     search = search.params(request_cache="true")
-    search = search.params(track_total_hits=True)
-    resp = wrap_es_execution(search)
+    search = search.extra(track_total_hits=True)
 
-    buckets = resp.aggregations.type_preservation.buckets
-    type_set = set([h["key"]["release_type"] for h in buckets])
-    type_dicts = dict()
-    for k in type_set:
-        type_dicts[k] = dict(release_type=k, bright=0, dark=0, shadows_only=0, none=0, total=0)
-    for row in buckets:
-        type_dicts[row["key"]["release_type"]][row["key"]["preservation"]] = int(
-            row["doc_count"]
-        )
-    for k in type_set:
-        for p in ("bright", "dark", "shadows_only", "none"):
-            type_dicts[k]["total"] += type_dicts[k][p]
-    if app.config["FATCAT_MERGE_SHADOW_PRESERVATION"]:
+    def parse(resp: Any) -> List[dict]:
+        buckets = resp.aggregations.type_preservation.buckets
+        type_set = set([h["key"]["release_type"] for h in buckets])
+        type_dicts = dict()
+        for k in type_set:
+            type_dicts[k] = dict(
+                release_type=k, bright=0, dark=0, shadows_only=0, none=0, total=0
+            )
+        for row in buckets:
+            type_dicts[row["key"]["release_type"]][row["key"]["preservation"]] = int(
+                row["doc_count"]
+            )
         for k in type_set:
-            type_dicts[k]["none"] += type_dicts[k]["shadows_only"]
-            type_dicts[k]["shadows_only"] = 0
-    return sorted(type_dicts.values(), key=lambda x: x["total"], reverse=True)
+            for p in ("bright", "dark", "shadows_only", "none"):
+                type_dicts[k]["total"] += type_dicts[k][p]
+        if app.config["FATCAT_MERGE_SHADOW_PRESERVATION"]:
+            for k in type_set:
+                type_dicts[k]["none"] += type_dicts[k]["shadows_only"]
+                type_dicts[k]["shadows_only"] = 0
+        return sorted(type_dicts.values(), key=lambda x: x["total"], reverse=True)
+
+    return PreparedSearch(search, parse)
@@ -89,6 +89,20 @@ class Config(object):
         "ELASTICSEARCH_CONTAINER_INDEX", default="fatcat_container"
     )
 
+    # in-process cache of entities for read-only entity views; a size of 0
+    # disables. Entities viewed by ident are cached for up to TTL seconds, but
+    # are evicted sooner if the changelog (checked every CHANGELOG_INTERVAL
+    # seconds) shows they were edited
+    ENTITY_CACHE_SIZE = int(os.environ.get("ENTITY_CACHE_SIZE", default=2000))
+    ENTITY_CACHE_TTL = float(os.environ.get("ENTITY_CACHE_TTL", default=60))
+    ENTITY_CACHE_CHANGELOG_INTERVAL = float(
+        os.environ.get("ENTITY_CACHE_CHANGELOG_INTERVAL", default=10)
+    )
+    # optional cache shared between web processes, in a (trusted) redis
+    # compatible server, like "redis://localhost:6379/0". Requires the redis
+    # python library
+    ENTITY_CACHE_REDIS_URL = os.environ.get("ENTITY_CACHE_REDIS_URL", default=None) or None
+
     # for save-paper-now. set to None if not configured, so we don't display forms/links
     KAFKA_PIXY_ENDPOINT = os.environ.get("KAFKA_PIXY_ENDPOINT", default=None) or None
     KAFKA_SAVEPAPERNOW_TOPIC = os.environ.get(
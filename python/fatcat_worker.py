@@ -2,6 +2,7 @@
 
 import argparse
 import sys
+from typing import List
 
 import sentry_sdk
 
@@ -11,17 +12,29 @@ from fatcat_tools.workers import (
     ElasticsearchChangelogWorker,
     ElasticsearchContainerWorker,
     ElasticsearchFileWorker,
+    ElasticsearchMultiWorker,
     ElasticsearchReleaseWorker,
+    EntityCache,
     EntityUpdatesWorker,
+    FatcatWorker,
 )
 
 
+def start_worker(worker: FatcatWorker, args: argparse.Namespace) -> None:
+    worker.start_metrics(port=args.metrics_port, statsd_addr=args.statsd_addr)
+    worker.run()
+
+
 def run_changelog(args: argparse.Namespace) -> None:
     topic = "fatcat-{}.changelog".format(args.env)
     worker = ChangelogWorker(
-        args.api, args.kafka_hosts, topic, poll_interval=args.poll_interval
+        args.api,
+        args.kafka_hosts,
+        topic,
+        poll_interval=args.poll_interval,
+        fetch_workers=args.fetch_workers,
     )
-    worker.run()
+    start_worker(worker, args)
 
 
 def run_entity_updates(args: argparse.Namespace) -> None:
@@ -31,6 +44,9 @@ def run_entity_updates(args: argparse.Namespace) -> None:
     container_topic = "fatcat-{}.container-updates".format(args.env)
     work_ident_topic = "fatcat-{}.work-ident-updates".format(args.env)
     ingest_file_request_topic = "sandcrawler-{}.ingest-file-requests-daily".format(args.env)
+    entity_cache = None
+    if args.entity_cache_size > 0:
+        entity_cache = EntityCache(max_size=args.entity_cache_size)
     worker = EntityUpdatesWorker(
         args.api,
         args.kafka_hosts,
@@ -40,8 +56,12 @@ def run_entity_updates(args: argparse.Namespace) -> None:
         container_topic=container_topic,
         work_ident_topic=work_ident_topic,
         ingest_file_request_topic=ingest_file_request_topic,
+        fetch_workers=args.fetch_workers,
+        batch_size=args.batch_size,
+        batch_timeout=args.batch_timeout,
+        entity_cache=entity_cache,
     )
-    worker.run()
+    start_worker(worker, args)
 
 
 def run_elasticsearch_release(args: argparse.Namespace) -> None:
@@ -51,8 +71,11 @@ def run_elasticsearch_release(args: argparse.Namespace) -> None:
         consume_topic,
         elasticsearch_backend=args.elasticsearch_backend,
         elasticsearch_index=args.elasticsearch_index,
+        coalesce_window=args.coalesce_window,
+        max_bulk_bytes=args.max_bulk_bytes,
+        max_linger=args.max_linger,
     )
-    worker.run()
+    start_worker(worker, args)
 
 
 def run_elasticsearch_container(args: argparse.Namespace) -> None:
@@ -64,8 +87,11 @@ def run_elasticsearch_container(args: argparse.Namespace) -> None:
         elasticsearch_release_index="fatcat_release",
         elasticsearch_backend=args.elasticsearch_backend,
         elasticsearch_index=args.elasticsearch_index,
+        coalesce_window=args.coalesce_window,
+        max_bulk_bytes=args.max_bulk_bytes,
+        max_linger=args.max_linger,
     )
-    worker.run()
+    start_worker(worker, args)
 
 
 def run_elasticsearch_file(args: argparse.Namespace) -> None:
@@ -75,8 +101,11 @@ def run_elasticsearch_file(args: argparse.Namespace) -> None:
         consume_topic,
         elasticsearch_backend=args.elasticsearch_backend,
         elasticsearch_index=args.elasticsearch_index,
+        coalesce_window=args.coalesce_window,
+        max_bulk_bytes=args.max_bulk_bytes,
+        max_linger=args.max_linger,
     )
-    worker.run()
+    start_worker(worker, args)
 
 
 def run_elasticsearch_changelog(args: argparse.Namespace) -> None:
@@ -87,7 +116,55 @@ def run_elasticsearch_changelog(args: argparse.Namespace) -> None:
         elasticsearch_backend=args.elasticsearch_backend,
         elasticsearch_index=args.elasticsearch_index,
     )
-    worker.run()
+    start_worker(worker, args)
+
+
+def run_elasticsearch_multi(args: argparse.Namespace) -> None:
+    workers: List[ElasticsearchReleaseWorker] = []
+    if "release" in args.topics:
+        workers.append(
+            ElasticsearchReleaseWorker(
+                args.kafka_hosts,
+                "fatcat-{}.release-updates-v03".format(args.env),
+                elasticsearch_backend=args.elasticsearch_backend,
+                elasticsearch_index=args.release_index,
+            )
+        )
+    if "container" in args.topics:
+        workers.append(
+            ElasticsearchContainerWorker(
+                args.kafka_hosts,
+                "fatcat-{}.container-updates".format(args.env),
+                query_stats=args.query_stats,
+                elasticsearch_release_index="fatcat_release",
+                elasticsearch_backend=args.elasticsearch_backend,
+                elasticsearch_index=args.container_index,
+            )
+        )
+    if "file" in args.topics:
+        workers.append(
+            ElasticsearchFileWorker(
+                args.kafka_hosts,
+                "fatcat-{}.file-updates".format(args.env),
+                elasticsearch_backend=args.elasticsearch_backend,
+                elasticsearch_index=args.file_index,
+            )
+        )
+    if "changelog" in args.topics:
+        workers.append(
+            ElasticsearchChangelogWorker(
+                args.kafka_hosts,
+                "fatcat-{}.changelog".format(args.env),
+                elasticsearch_backend=args.elasticsearch_backend,
+                elasticsearch_index=args.changelog_index,
+            )
+        )
+    worker = ElasticsearchMultiWorker(
+        args.kafka_hosts,
+        workers,
+        coalesce_window=args.coalesce_window,
+    )
+    start_worker(worker, args)
 
 
 def main() -> None:
@@ -103,6 +180,15 @@ def main() -> None:
     parser.add_argument(
         "--env", default="dev", help="Kafka topic namespace to use (eg, prod, qa, dev)"
     )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve worker metrics (Prometheus text format) over HTTP on this port",
+    )
+    parser.add_argument(
+        "--statsd-addr",
+        help="send worker metrics to this statsd daemon (host:port)",
+    )
     subparsers = parser.add_subparsers()
 
     sub_changelog = subparsers.add_parser(
@@ -115,12 +201,42 @@ def main() -> None:
         default=5.0,
         type=float,
     )
+    sub_changelog.add_argument(
+        "--fetch-workers",
+        help="number of concurrent changelog entry fetches when catching up",
+        default=8,
+        type=int,
+    )
 
     sub_entity_updates = subparsers.add_parser(
         "entity-updates",
         help="poll kafka for changelog entries; push entity changes to various kafka topics",
     )
     sub_entity_updates.set_defaults(func=run_entity_updates)
+    sub_entity_updates.add_argument(
+        "--fetch-workers",
+        help="number of concurrent entity fetches from the API",
+        default=8,
+        type=int,
+    )
+    sub_entity_updates.add_argument(
+        "--batch-size",
+        help="max number of changelog entries to process (and de-duplicate entities across) at a time",
+        default=1,
+        type=int,
+    )
+    sub_entity_updates.add_argument(
+        "--batch-timeout",
+        help="max seconds to wait for a batch of changelog entries to fill",
+        default=10.0,
+        type=float,
+    )
+    sub_entity_updates.add_argument(
+        "--entity-cache-size",
+        help="number of expanded release entities to keep cached, by revision (0 to disable)",
+        default=2000,
+        type=int,
+    )
 
     sub_elasticsearch_release = subparsers.add_parser(
         "elasticsearch-release",
@@ -175,6 +291,30 @@ def main() -> None:
         default="fatcat_file",
     )
 
+    for sub in (
+        sub_elasticsearch_release,
+        sub_elasticsearch_container,
+        sub_elasticsearch_file,
+    ):
+        sub.add_argument(
+            "--coalesce-window",
+            help="keep consuming for this long (seconds) to coalesce repeated updates to the same entity",
+            default=0.0,
+            type=float,
+        )
+        sub.add_argument(
+            "--max-bulk-bytes",
+            help="flush bulk requests to elasticsearch once this many bytes of documents have accumulated",
+            default=10 * 1024 * 1024,
+            type=int,
+        )
+        sub.add_argument(
+            "--max-linger",
+            help="max time (seconds) a document may wait before being flushed to elasticsearch",
+            default=2.0,
+            type=float,
+        )
+
     sub_elasticsearch_changelog = subparsers.add_parser(
         "elasticsearch-changelog",
         help="consume changelog kafka feed, transform and push to search",
@@ -191,6 +331,55 @@ def main() -> None:
         default="fatcat_changelog",
     )
 
+    sub_elasticsearch_multi = subparsers.add_parser(
+        "elasticsearch-multi",
+        help="consume several entity kafka feeds in a single process, transform and push to search",
+    )
+    sub_elasticsearch_multi.set_defaults(func=run_elasticsearch_multi)
+    sub_elasticsearch_multi.add_argument(
+        "--topics",
+        help="which entity update feeds to consume",
+        nargs="+",
+        choices=["release", "container", "file", "changelog"],
+        default=["release", "container", "file", "changelog"],
+    )
+    sub_elasticsearch_multi.add_argument(
+        "--elasticsearch-backend",
+        help="elasticsearch backend to connect to",
+        default="http://localhost:9200",
+    )
+    sub_elasticsearch_multi.add_argument(
+        "--release-index",
+        help="elasticsearch index to push releases into",
+        default="fatcat_release_v03",
+    )
+    sub_elasticsearch_multi.add_argument(
+        "--container-index",
+        help="elasticsearch index to push containers into",
+        default="fatcat_container",
+    )
+    sub_elasticsearch_multi.add_argument(
+        "--file-index",
+        help="elasticsearch index to push files into",
+        default="fatcat_file",
+    )
+    sub_elasticsearch_multi.add_argument(
+        "--changelog-index",
+        help="elasticsearch index to push changelog entries into",
+        default="fatcat_changelog",
+    )
+    sub_elasticsearch_multi.add_argument(
+        "--query-stats",
+        action="store_true",
+        help="whether to query release search index for container stats",
+    )
+    sub_elasticsearch_multi.add_argument(
+        "--coalesce-window",
+        help="keep consuming for this long (seconds) to coalesce repeated updates to the same entity",
+        default=0.0,
+        type=float,
+    )
+
     args = parser.parse_args()
     if not args.__dict__.get("func"):
         print("tell me what to do!")
@@ -63,6 +63,9 @@ def full_app(mocker):
     # mock out ES client requests, so they at least fail fast
     fatcat_web.app.es_client = elasticsearch.Elasticsearch("mockbackend")
     mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+
+    # tests edit entities and then view them, so don't cache entity pages
+    fatcat_web.app.entity_cache = fatcat_web.entity_cache.EntityResponseCache(max_size=0)
     return fatcat_web.app
 
 
@@ -1,9 +1,11 @@
 import datetime
 import json
 
+import pytest
 import responses
 
 from fatcat_tools.harvest import *
+from fatcat_tools.harvest.harvest_common import ContentHashIndex, iter_json_items
 
 
 @responses.activate
@@ -42,5 +44,137 @@ def test_crossref_harvest_date(mocker):
     # check that we published the expected number of DOI objects were published
     # to the (mock) kafka topic
     assert harvester.producer.produce.call_count == 3
+    # original JSON of each item is passed through
+    first = harvester.producer.produce.call_args_list[0]
+    assert json.loads(first[0][1].decode("utf-8")) == crossref_resp["message"]["items"][0]
+    assert first[1]["key"] == crossref_resp["message"]["items"][0]["DOI"].encode("utf-8")
     assert harvester.producer.flush.call_count == 1
     assert harvester.producer.poll.called_once_with(0)
+
+
+@responses.activate
+def test_crossref_harvest_truncated(mocker):
+
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+
+    with open("tests/files/crossref_api_works.json", "r") as f:
+        body = f.readline()
+    # cut off part-way through the last item
+    responses.add(
+        responses.GET,
+        "https://api.crossref.org/works",
+        body=body[: body.rindex('"DOI"')],
+        status=200,
+    )
+
+    harvester = HarvestCrossrefWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        contact_email="test@fatcat.wiki",
+    )
+    harvester.producer = mocker.Mock()
+
+    with pytest.raises(json.JSONDecodeError):
+        harvester.fetch_date(datetime.date(2019, 2, 3))
+    # nothing from the page is produced
+    assert harvester.producer.produce.call_count == 0
+
+
+def test_iter_json_items():
+
+    doc = '{"status": "ok", "message": {"total-results": 12345, "items": [{"DOI": "10.123/abc", "title": ["Café \\"q\\" \\u00e9"]}, 1234567, [], {"reference": [{"DOI": "10.1/x"}]} ], "next-cursor": "Zm9v"}}'
+    doc_bytes = doc.encode("utf-8")
+    for chunk_size in (1, 2, 7, 4096):
+        chunks = [doc_bytes[i : i + chunk_size] for i in range(0, len(doc_bytes), chunk_size)]
+        envelope: dict = dict()
+        items = list(iter_json_items(chunks, ("message", "items"), envelope))
+        assert [raw for (raw, _) in items] == [
+            '{"DOI": "10.123/abc", "title": ["Café \\"q\\" \\u00e9"]}',
+            "1234567",
+            "[]",
+            '{"reference": [{"DOI": "10.1/x"}]}',
+        ]
+        assert items[0][1]["title"] == ['Café "q" é']
+        assert envelope == {
+            "status": "ok",
+            "message": {"total-results": 12345, "items": [], "next-cursor": "Zm9v"},
+        }
+
+    # numbers split at a chunk boundary, including just after "." or "e"
+    doc_bytes = b'{"message": {"items": [12.5, -3.25e+10, 7e2, 0]}}'
+    for i in range(1, len(doc_bytes)):
+        chunks = [doc_bytes[:i], doc_bytes[i:]]
+        items = list(iter_json_items(chunks, ("message", "items"), dict()))
+        assert items == [("12.5", 12.5), ("-3.25e+10", -3.25e10), ("7e2", 700.0), ("0", 0)]
+
+    with pytest.raises(json.JSONDecodeError):
+        list(
+            iter_json_items(
+                [b'{"message": {"items": [{"DOI": "10.1/x"}'], ("message", "items"), dict()
+            )
+        )
+
+
+@responses.activate
+def test_crossref_harvest_unchanged(mocker, tmp_path):
+
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+
+    with open("tests/files/crossref_api_works.json", "r") as f:
+        crossref_resp = json.loads(f.readline())
+    responses.add(
+        responses.GET, "https://api.crossref.org/works", json=crossref_resp, status=200
+    )
+
+    harvester = HarvestCrossrefWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        contact_email="test@fatcat.wiki",
+        content_hash_db=str(tmp_path / "content_hash.sqlite"),
+    )
+    harvester.producer = mocker.Mock()
+
+    harvester.fetch_date(datetime.date(2019, 2, 3))
+    assert harvester.producer.produce.call_count == 3
+    # hashes only recorded once delivered
+    assert harvester.content_hashes.pending == dict()
+
+    # same records again, with only volatile fields changed, are skipped...
+    items = crossref_resp["message"]["items"]
+    items[0]["is-referenced-by-count"] += 10
+    items[0]["indexed"]["timestamp"] += 1000
+    # ... but an actual metadata change is not
+    items[1]["title"] = ["A Different Title"]
+    responses.replace(
+        responses.GET, "https://api.crossref.org/works", json=crossref_resp, status=200
+    )
+    harvester.fetch_date(datetime.date(2019, 2, 4))
+    assert harvester.producer.produce.call_count == 4
+    assert harvester.producer.produce.call_args[1]["key"] == items[1]["DOI"].encode("utf-8")
+
+
+def test_content_hash_index_commit(tmp_path):
+
+    index = ContentHashIndex(str(tmp_path / "content_hash.sqlite"))
+    assert not index.unchanged(b"a", b"hash-a")
+    index.record(b"a", b"hash-a")
+    assert index.unchanged(b"a", b"hash-a")
+
+    def flush():
+        # hashes being committed are still seen while the flush is going on
+        assert index.unchanged(b"a", b"hash-a")
+        # a record produced during the flush may not be delivered by it, so
+        # its hash waits for the next commit
+        index.record(b"b", b"hash-b")
+
+    index.commit(flush=flush)
+    assert index.pending == {b"b": b"hash-b"}
+    assert index.db.execute("SELECT key FROM content_hash").fetchall() == [(b"a",)]
+
+    index.commit()
+    assert index.unchanged(b"b", b"hash-b")
+    assert index.pending == dict()
+    assert index.db.execute("SELECT COUNT(*) FROM content_hash").fetchone()[0] == 2
+    index.close()
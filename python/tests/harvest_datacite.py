@@ -45,3 +45,89 @@ def test_datacite_harvest_date(mocker):
     assert harvester.producer.produce.call_count == 1
     assert harvester.producer.flush.call_count == 1
     assert harvester.producer.poll.called_once_with(0)
+
+
+@responses.activate
+def test_datacite_harvest_concurrent(mocker):
+
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+
+    with open("tests/files/datacite_api.json", "r") as f:
+        resp = json.loads(f.readline())
+    responses.add(responses.GET, "https://api.datacite.org/dois", json=resp, status=200)
+
+    harvester = HarvestDataciteWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        contact_email="test@fatcat.wiki",
+        start_date=datetime.date(2019, 2, 3),
+        end_date=datetime.date(2019, 2, 4),
+        concurrency=4,
+        max_rate=1000.0,
+        slices_per_day=4,
+    )
+    harvester.producer = mocker.Mock()
+    # don't publish state to kafka
+    harvester.state_topic = None
+
+    harvester.run()
+
+    # each of the two dates fetched in four (non-overlapping) time windows
+    assert len(responses.calls) == 8
+    urls = [call.request.url for call in responses.calls]
+    assert (
+        sum(
+            "query=updated%3A%5B2019-02-03T06%3A00%3A00.000Z+TO+2019-02-03T11%3A59%3A59.999Z%5D"
+            in url
+            for url in urls
+        )
+        == 1
+    )
+    assert harvester.producer.produce.call_count == 8
+    assert harvester.state.completed == {datetime.date(2019, 2, 3), datetime.date(2019, 2, 4)}
+    assert harvester.state.next_span() is None
+
+
+@responses.activate
+def test_datacite_harvest_checkpoint(mocker):
+
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+
+    with open("tests/files/datacite_api.json", "r") as f:
+        resp = json.loads(f.readline())
+    resp["links"]["next"] = "https://api.datacite.org/dois?page%5Bcursor%5D=abc123"
+    responses.add(responses.GET, "https://api.datacite.org/dois", json=resp, status=200)
+    responses.add(
+        responses.GET,
+        "https://api.datacite.org/dois",
+        json=dict(data=[], meta=dict(total=1), links=dict()),
+        status=200,
+    )
+
+    harvester = HarvestDataciteWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        contact_email="test@fatcat.wiki",
+    )
+    harvester.producer = mocker.Mock()
+    harvester.state_topic = None
+    harvester.api_batch_size = 1
+    harvester.checkpoint_interval = 0.0
+
+    date = datetime.date(2019, 2, 3)
+    harvester.fetch_date(date)
+
+    assert len(responses.calls) == 2
+    assert "page%5Bcursor%5D=abc123" in responses.calls[1].request.url
+    # producer was flushed before progress was recorded
+    assert harvester.producer.flush.call_count == 2
+    assert harvester.state.resume_point(date) == dict(cursor="abc123", count=1, done=False)
+
+    # a restarted harvest continues from the checkpoint
+    responses.calls.reset()
+    harvester.state.checkpoint(date, "xyz789", 1000)
+    harvester.fetch_date(date)
+    assert len(responses.calls) == 1
+    assert "page%5Bcursor%5D=xyz789" in responses.calls[0].request.url
@@ -0,0 +1,119 @@
+import datetime
+from urllib.parse import parse_qs, urlparse
+
+import responses
+
+from fatcat_tools.harvest import *
+
+OAI_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+<responseDate>2019-02-04T00:00:00Z</responseDate>
+<request verb="ListRecords">https://export.arxiv.org/oai2</request>
+<ListRecords>
+{records}
+{token}
+</ListRecords>
+</OAI-PMH>
+"""
+
+OAI_RECORD = """<record><header><identifier>oai:arXiv.org:{ident}</identifier>
+<datestamp>2019-02-03</datestamp><setSpec>{set_spec}</setSpec></header>
+<metadata><arXivRaw xmlns="http://arxiv.org/OAI/arXivRaw/"><id>{ident}</id></arXivRaw></metadata>
+</record>"""
+
+
+def oai_callback(request):
+    """
+    Two pages of two records for each set; the second page is fetched with a
+    resumption token.
+    """
+    params = {k: v[0] for k, v in parse_qs(urlparse(request.url).query).items()}
+    if "resumptionToken" in params:
+        set_spec, page = params["resumptionToken"], 2
+    else:
+        assert params["from"] == params["until"] == "2019-02-03"
+        set_spec, page = params["set"], 1
+    records = "".join(
+        OAI_RECORD.format(ident="{}.{}{}".format(set_spec, page, i), set_spec=set_spec)
+        for i in range(2)
+    )
+    token = "<resumptionToken/>"
+    if page == 1:
+        token = "<resumptionToken>{}</resumptionToken>".format(set_spec)
+    return (200, {}, OAI_RESPONSE.format(records=records, token=token))
+
+
+@responses.activate
+def test_arxiv_harvest_sets_concurrent(mocker):
+
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+    responses.add_callback(
+        responses.GET,
+        "https://export.arxiv.org/oai2",
+        callback=oai_callback,
+        content_type="text/xml",
+    )
+
+    harvester = HarvestArxivWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        start_date=datetime.date(2019, 2, 3),
+        end_date=datetime.date(2019, 2, 3),
+        sets=["cs", "math"],
+        concurrency=2,
+        max_rate=1000.0,
+    )
+    harvester.producer = mocker.Mock()
+    harvester.state_topic = None
+    harvester.checkpoint_interval = 0.0
+
+    harvester.run()
+
+    assert len(responses.calls) == 4
+    keys = sorted(call[1]["key"] for call in harvester.producer.produce.call_args_list)
+    assert keys == [
+        "oai:arXiv.org:{}.{}{}".format(set_spec, page, i).encode("utf-8")
+        for set_spec in ("cs", "math")
+        for page in (1, 2)
+        for i in range(2)
+    ]
+    assert harvester.state.completed == {datetime.date(2019, 2, 3)}
+    assert harvester.state.next_span() is None
+
+
+@responses.activate
+def test_arxiv_harvest_resume(mocker):
+
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+    responses.add_callback(
+        responses.GET,
+        "https://export.arxiv.org/oai2",
+        callback=oai_callback,
+        content_type="text/xml",
+    )
+
+    harvester = HarvestArxivWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        sets=["cs"],
+    )
+    harvester.producer = mocker.Mock()
+    harvester.state_topic = None
+    harvester.checkpoint_interval = 0.0
+    date = datetime.date(2019, 2, 3)
+
+    assert harvester.fetch_partition(date, ("cs", None)) == 4
+    # checkpointed with the token for the second page, after the first page
+    # was produced
+    assert harvester.producer.flush.call_count == 1
+    assert harvester.state.resume_point(date, "cs@") == dict(cursor="cs", count=2, done=False)
+
+    # a restarted harvest only fetches the second page
+    responses.calls.reset()
+    harvester.producer = mocker.Mock()
+    assert harvester.fetch_partition(date, ("cs", None)) == 4
+    assert len(responses.calls) == 1
+    assert "resumptionToken=cs" in responses.calls[0].request.url
+    assert harvester.producer.produce.call_count == 2
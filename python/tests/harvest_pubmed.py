@@ -3,14 +3,40 @@ Test pubmed FTP harvest.
 """
 
 import datetime
+import hashlib
 import os
+import shutil
 
 import pytest
 
 from fatcat_tools.harvest import *
 
 
-def test_pubmed_harvest_date(mocker):
+def ftp_stand_in(tmp_path, files):
+    """
+    Returns a replacement for ftpretr(), which serves the given local files
+    (by basename), along with .md5 sidecar files for each. Like ftpretr(),
+    each retrieval is copied to a new temporary file.
+    """
+    counter = [0]
+
+    def retr(url, proxy_hostport=None):
+        name = os.path.basename(url)
+        counter[0] += 1
+        dest = str(tmp_path / "retr-{}-{}".format(counter[0], name))
+        if name.endswith(".md5"):
+            with open(files[name[:-4]], "rb") as f:
+                digest = hashlib.md5(f.read()).hexdigest()
+            with open(dest, "w") as f:
+                f.write("MD5({})= {}\n".format(name[:-4], digest))
+        else:
+            shutil.copyfile(files[name], dest)
+        return dest
+
+    return retr
+
+
+def test_pubmed_harvest_date(mocker, tmp_path):
 
     # mock out the harvest state object so it doesn't try to actually connect
     # to Kafka
@@ -20,14 +46,18 @@ def test_pubmed_harvest_date(mocker):
     # $ zcat tests/files/pubmedsample_2019.xml.gz | grep -c '<PubmedArticle>'
     # 176
     file_to_retrieve = os.path.join(os.path.dirname(__file__), "files/pubmedsample_2019.xml.gz")
-    ftpretr = mocker.patch("fatcat_tools.harvest.pubmed.ftpretr")
-    ftpretr.return_value = file_to_retrieve
+    mocker.patch(
+        "fatcat_tools.harvest.pubmed.ftpretr",
+        side_effect=ftp_stand_in(tmp_path, {"pubmed20n1016.xml.gz": file_to_retrieve}),
+    )
 
     test_date = "2020-02-20"
 
     # We'll need one entry in the date_file_map.
     generate_date_file_map = mocker.patch("fatcat_tools.harvest.pubmed.generate_date_file_map")
-    generate_date_file_map.return_value = {test_date: set(["dummy"])}
+    generate_date_file_map.return_value = {
+        test_date: set(["/pubmed/updatefiles/pubmed20n1016.xml.gz"])
+    }
 
     # For cleanup.
     os.remove = mocker.Mock()
@@ -47,10 +77,11 @@ def test_pubmed_harvest_date(mocker):
     # to the (mock) kafka topic
     assert harvester.producer.produce.call_count == 176
     assert harvester.producer.flush.call_count == 1
+    # the .md5 sidecar and the downloaded file; nothing is decompressed to disk
     assert os.remove.call_count == 2
 
 
-def test_pubmed_harvest_date_no_pmid(mocker):
+def test_pubmed_harvest_date_no_pmid(mocker, tmp_path):
     # mock out the harvest state object so it doesn't try to actually connect
     # to Kafka
     mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
@@ -58,14 +89,18 @@ def test_pubmed_harvest_date_no_pmid(mocker):
     file_to_retrieve = os.path.join(
         os.path.dirname(__file__), "files/pubmedsample_no_pmid_2019.xml.gz"
     )
-    ftpretr = mocker.patch("fatcat_tools.harvest.pubmed.ftpretr")
-    ftpretr.return_value = file_to_retrieve
+    mocker.patch(
+        "fatcat_tools.harvest.pubmed.ftpretr",
+        side_effect=ftp_stand_in(tmp_path, {"pubmed20n1016.xml.gz": file_to_retrieve}),
+    )
 
     test_date = "2020-02-20"
 
     # We'll need one entry in the date_file_map.
     generate_date_file_map = mocker.patch("fatcat_tools.harvest.pubmed.generate_date_file_map")
-    generate_date_file_map.return_value = {test_date: set(["dummy"])}
+    generate_date_file_map.return_value = {
+        test_date: set(["/pubmed/updatefiles/pubmed20n1016.xml.gz"])
+    }
 
     harvester = PubmedFTPWorker(
         kafka_hosts="dummy",
@@ -78,3 +113,77 @@ def test_pubmed_harvest_date_no_pmid(mocker):
     # The file has not PMID, not importable.
     with pytest.raises(ValueError):
         harvester.fetch_date(datetime.datetime.strptime(test_date, "%Y-%m-%d"))
+
+
+def test_pubmed_harvest_verified_cached_downloads(mocker, tmp_path):
+
+    mocker.patch("fatcat_tools.harvest.harvest_common.HarvestState.initialize_from_kafka")
+
+    sample = os.path.join(os.path.dirname(__file__), "files/pubmedsample_2019.xml.gz")
+    corrupt = str(tmp_path / "corrupt.xml.gz")
+    with open(corrupt, "wb") as f:
+        f.write(b"not what was expected")
+    retr = ftp_stand_in(
+        tmp_path,
+        {
+            "pubmed20n1016.xml.gz": sample,
+            "pubmed20n1017.xml.gz": sample,
+            "pubmed20n1018.xml.gz": sample,
+        },
+    )
+    calls = []
+
+    def flaky_retr(url, proxy_hostport=None):
+        calls.append(os.path.basename(url))
+        # first retrieval of one file is corrupted in transit
+        if calls.count("pubmed20n1017.xml.gz") == 1 and calls[-1] == "pubmed20n1017.xml.gz":
+            dest = str(tmp_path / "retr-corrupt")
+            shutil.copyfile(corrupt, dest)
+            return dest
+        return retr(url)
+
+    mocker.patch("fatcat_tools.harvest.pubmed.ftpretr", side_effect=flaky_retr)
+
+    download_dir = tmp_path / "cache"
+    download_dir.mkdir()
+    harvester = PubmedFTPWorker(
+        kafka_hosts="dummy",
+        produce_topic="dummy-produce-topic",
+        state_topic="dummy-state-topic",
+        start_date=datetime.date(2020, 2, 20),
+        end_date=datetime.date(2020, 2, 21),
+        prefetch=2,
+        download_dir=str(download_dir),
+    )
+    harvester.producer = mocker.Mock()
+    harvester.date_file_map = {
+        "2020-02-20": set(
+            [
+                "/pubmed/updatefiles/pubmed20n1016.xml.gz",
+                "/pubmed/updatefiles/pubmed20n1017.xml.gz",
+            ]
+        ),
+        "2020-02-21": set(["/pubmed/updatefiles/pubmed20n1018.xml.gz"]),
+    }
+
+    assert harvester.fetch_date(datetime.date(2020, 2, 20))
+    assert harvester.producer.produce.call_count == 2 * 176
+    # corrupted file was retried; file for the following date was prefetched
+    assert calls.count("pubmed20n1017.xml.gz") == 2
+    assert "pubmed20n1018.xml.gz" in calls
+    assert "/pubmed/updatefiles/pubmed20n1018.xml.gz" in harvester.downloads
+    assert sorted(os.listdir(str(download_dir))) == [
+        "pubmed20n1016.xml.gz",
+        "pubmed20n1016.xml.gz.md5",
+        "pubmed20n1017.xml.gz",
+        "pubmed20n1017.xml.gz.md5",
+        "pubmed20n1018.xml.gz",
+        "pubmed20n1018.xml.gz.md5",
+    ]
+
+    # a re-run uses the verified local copies
+    calls.clear()
+    harvester.downloads.clear()
+    harvester.fetch_date(datetime.date(2020, 2, 20))
+    assert harvester.producer.produce.call_count == 4 * 176
+    assert calls == []
@@ -0,0 +1,45 @@
+import datetime
+import shutil
+
+import pytest
+
+from fatcat_tools.harvest.replay import FileSink, ReplayServer, replay_harvester, run_benchmark
+
+
+@pytest.fixture
+def replay_server():
+    server = ReplayServer(records=120).start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize("kind", ["crossref", "datacite", "arxiv"])
+def test_replay_harvest(replay_server, kind):
+
+    dates = [datetime.date(2019, 1, 1), datetime.date(2019, 1, 2)]
+    sink = FileSink()
+    run = replay_harvester(kind, replay_server, dates, sink, concurrency=2)
+    run()
+    assert sink.count == 2 * 120
+
+
+@pytest.mark.skipif(shutil.which("wget") is None, reason="pubmed harvester fetches with wget")
+def test_replay_harvest_pubmed(replay_server, tmp_path):
+
+    sink = FileSink(str(tmp_path / "pubmed.out"))
+    run = replay_harvester("pubmed", replay_server, [datetime.date(2019, 1, 1)], sink)
+    run()
+    sink.close()
+    assert sink.count == 176
+    with open(str(tmp_path / "pubmed.out"), "rb") as f:
+        assert f.read().count(b"</PubmedArticle>") == 176
+
+
+def test_replay_benchmark():
+
+    results = run_benchmark(["crossref"], records=120, days=2)
+    assert len(results) == 1
+    assert results[0]["harvester"] == "crossref"
+    assert results[0]["records"] == 240
+    assert results[0]["records_per_sec"] > 0
+    assert results[0]["peak_rss_mb"] > 0
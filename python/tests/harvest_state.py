@@ -36,3 +36,33 @@ def test_harvest_state():
     assert len(hs.to_process) == 3
     hs.update('{"completed-date": "2000-01-02"}')
     assert len(hs.to_process) == 2
+
+
+def test_harvest_state_checkpoint():
+
+    hs = HarvestState(
+        start_date=datetime.date(2000, 1, 1),
+        end_date=datetime.date(2000, 1, 3),
+    )
+    state_json = hs.checkpoint(datetime.date(2000, 1, 2), "abc", 1000)
+    assert hs.resume_point(datetime.date(2000, 1, 2)) == dict(
+        cursor="abc", count=1000, done=False
+    )
+    assert hs.resume_point(datetime.date(2000, 1, 2), window="2000-01-02T12:00:00") is None
+
+    # checkpoints are restored from serialized state, unless the date was
+    # completed since
+    hs2 = HarvestState(catchup_days=0)
+    hs2.update(state_json.decode("utf-8"))
+    hs2.update(
+        '{"checkpoint-date": "2000-01-03", "window": "2000-01-03T12:00:00", "cursor": null, "count": 5, "done": true}'
+    )
+    assert hs2.resume_point(datetime.date(2000, 1, 2)) == dict(
+        cursor="abc", count=1000, done=False
+    )
+    assert hs2.resume_point(datetime.date(2000, 1, 3), window="2000-01-03T12:00:00") == dict(
+        cursor=None, count=5, done=True
+    )
+    hs2.update('{"completed-date": "2000-01-02"}')
+    hs2.update(state_json.decode("utf-8"))
+    assert hs2.resume_point(datetime.date(2000, 1, 2)) is None
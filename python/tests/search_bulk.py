@@ -0,0 +1,143 @@
+import io
+import json
+
+import pytest
+import requests
+import responses
+
+from fatcat_tools.search.bulk import (
+    ElasticsearchBulkError,
+    ElasticsearchBulkLoader,
+    bulk_action_bytes,
+    es_bulk_index_action,
+    es_bulk_session,
+    post_es_bulk,
+    split_bulk_actions,
+)
+
+BULK_URL = "http://localhost:9200/fatcat_release/_bulk"
+
+
+def bulk_items_resp(statuses):
+    items = []
+    for i, status in enumerate(statuses):
+        result = {"_id": str(i), "status": status}
+        if status >= 300:
+            result["error"] = {"type": "dummy_error", "status": status}
+        items.append({"index": result})
+    errors = any([s >= 300 for s in statuses])
+    return (200, {}, json.dumps({"took": 1, "errors": errors, "items": items}))
+
+
+def test_es_bulk_index_action():
+    action = es_bulk_index_action("abc", json.dumps({"title": "blah"}))
+    lines = action.split("\n")
+    assert len(lines) == 2
+    assert json.loads(lines[0]) == {"index": {"_id": "abc"}}
+    assert json.loads(lines[1]) == {"title": "blah"}
+
+
+def test_split_bulk_actions():
+    actions = [es_bulk_index_action(str(i), json.dumps({"i": i})) for i in range(5)]
+    size = bulk_action_bytes(actions[0])
+    assert split_bulk_actions(actions, 1000 * size) == [actions]
+    assert split_bulk_actions(actions, 2 * size) == [actions[0:2], actions[2:4], actions[4:]]
+    # oversized actions still get sent, one per group
+    assert split_bulk_actions(actions, 1) == [[a] for a in actions]
+    assert split_bulk_actions([], 1) == []
+
+
+@responses.activate
+def test_post_es_bulk_retries():
+
+    actions = [es_bulk_index_action(str(i), json.dumps({"i": i})) for i in range(3)]
+    resp_queue = [
+        (429, {}, "overloaded"),
+        bulk_items_resp([201, 429, 400]),
+        bulk_items_resp([201]),
+    ]
+
+    def callback(request):
+        return resp_queue.pop(0)
+
+    responses.add_callback(responses.POST, BULK_URL, callback=callback)
+
+    failed = post_es_bulk(es_bulk_session(), BULK_URL, actions, backoff_base=0.0)
+    assert len(responses.calls) == 3
+    # only the item-level 429 is re-tried
+    assert responses.calls[2].request.body.decode("utf-8") == actions[1] + "\n"
+    assert len(failed) == 1
+    assert failed[0][0] == actions[2]
+
+    # once retries run out, overloaded items are returned as failed
+    responses.replace(responses.POST, BULK_URL, status=429)
+    failed = post_es_bulk(es_bulk_session(), BULK_URL, actions, max_retries=2, backoff_base=0.0)
+    assert len(responses.calls) == 6
+    assert [action for action, _ in failed] == actions
+    assert [result["_id"] for _, result in failed] == ["0", "1", "2"]
+    assert all(result["status"] == 429 for _, result in failed)
+
+    # connection errors and timeouts are retried too, then returned as failed
+    resp_queue = [
+        requests.ConnectionError("connection refused"),
+        requests.ReadTimeout("read timed out"),
+        bulk_items_resp([201, 201, 201]),
+    ]
+
+    def error_callback(request):
+        resp = resp_queue.pop(0)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+    responses.remove(responses.POST, BULK_URL)
+    responses.add_callback(responses.POST, BULK_URL, callback=error_callback)
+    assert post_es_bulk(es_bulk_session(), BULK_URL, actions, backoff_base=0.0) == []
+    assert resp_queue == []
+
+    resp_queue = [requests.ConnectionError("connection refused")] * 2
+    failed = post_es_bulk(es_bulk_session(), BULK_URL, actions, max_retries=1, backoff_base=0.0)
+    assert [action for action, _ in failed] == actions
+    assert failed[0][1]["error"]["type"] == "ConnectionError"
+    assert failed[0][1]["_id"] == "0"
+
+    responses.remove(responses.POST, BULK_URL)
+    responses.add(responses.POST, BULK_URL, status=400)
+    with pytest.raises(ElasticsearchBulkError):
+        post_es_bulk(es_bulk_session(), BULK_URL, actions)
+
+
+@responses.activate
+def test_bulk_loader():
+    def callback(request):
+        lines = request.body.decode("utf-8").strip().split("\n")
+        statuses = []
+        for action_line in lines[::2]:
+            if json.loads(action_line)["index"]["_id"] == "7":
+                statuses.append(400)
+            else:
+                statuses.append(201)
+        return bulk_items_resp(statuses)
+
+    responses.add_callback(responses.POST, BULK_URL, callback=callback)
+
+    failed_output = io.StringIO()
+    loader = ElasticsearchBulkLoader(
+        BULK_URL,
+        concurrency=2,
+        max_bytes=200,
+        backoff_base=0.0,
+        failed_output=failed_output,
+    )
+    for i in range(20):
+        loader.add(es_bulk_index_action(str(i), json.dumps({"i": i})))
+    counts = loader.finish()
+
+    assert counts["total"] == 20
+    assert counts["failed"] == 1
+    assert counts["indexed"] == 19
+    assert counts["requests"] == len(responses.calls)
+    assert counts["requests"] > 1
+    for call in responses.calls:
+        assert len(call.request.body) <= 200
+    assert failed_output.getvalue().startswith('{"index": {"_id": "7"}}\n')
@@ -0,0 +1,140 @@
+import json
+
+import elasticsearch
+import pytest
+
+from fatcat_tools.search.common import FatcatSearchError
+from fatcat_tools.search.stats import (
+    empty_container_stats,
+    iter_es_all_container_stats,
+    query_es_container_stats,
+    query_es_container_stats_batch,
+)
+
+
+def stats_aggs(total, in_web):
+    return {
+        "container_stats": {
+            "buckets": {
+                "in_web": {"doc_count": in_web},
+                "in_kbart": {"doc_count": 0},
+                "is_preserved": {"doc_count": in_web},
+            },
+        },
+        "preservation": {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": 0,
+            "buckets": [
+                {"key": "bright", "doc_count": in_web},
+                {"key": "shadows_only", "doc_count": total - in_web},
+            ],
+        },
+        "release_type": {
+            "doc_count_error_upper_bound": 0,
+            "sum_other_doc_count": 0,
+            "buckets": [{"key": "article-journal", "doc_count": total}],
+        },
+    }
+
+
+def search_resp(total, in_web):
+    return {
+        "took": 1,
+        "timed_out": False,
+        "hits": {"total": {"value": total, "relation": "eq"}, "max_score": None, "hits": []},
+        "aggregations": stats_aggs(total, in_web),
+    }
+
+
+def test_container_stats_batch(mocker):
+
+    es_client = elasticsearch.Elasticsearch("mockbackend")
+    es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+    es_raw.side_effect = [
+        (200, {}, json.dumps(search_resp(10, 3))),
+        (
+            200,
+            {},
+            json.dumps({"responses": [search_resp(10, 3), search_resp(0, 0)]}),
+        ),
+    ]
+
+    single = query_es_container_stats(
+        "aaaaaaaaaaaaarceaaaaaaaaai", es_client, merge_shadows=True
+    )
+    assert single["total"] == 10
+    assert single["in_web"] == 3
+    assert single["preservation"]["none"] == 7
+    assert single["preservation"]["shadows_only"] == 0
+
+    batch = query_es_container_stats_batch(
+        ["aaaaaaaaaaaaarceaaaaaaaaai", "aaaaaaaaaaaaarceaaaaaaaaam"],
+        es_client,
+        merge_shadows=True,
+    )
+    assert es_raw.call_count == 2
+    assert "_msearch" in es_raw.call_args[0][1]
+    assert batch["aaaaaaaaaaaaarceaaaaaaaaai"] == single
+    assert batch["aaaaaaaaaaaaarceaaaaaaaaam"]["total"] == 0
+
+    # a failed query is reported with its own status and reason
+    shard_error = {
+        "error": {
+            "root_cause": [{"type": "es_rejected_execution_exception", "reason": "queue full"}],
+            "type": "search_phase_execution_exception",
+            "reason": "all shards failed",
+        },
+        "status": 429,
+    }
+    es_raw.side_effect = [
+        (200, {}, json.dumps({"responses": [search_resp(10, 3), shard_error]})),
+    ]
+    with pytest.raises(FatcatSearchError) as exc_info:
+        query_es_container_stats_batch(
+            ["aaaaaaaaaaaaarceaaaaaaaaai", "aaaaaaaaaaaaarceaaaaaaaaam"], es_client
+        )
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.description == "queue full"
+
+
+def test_container_stats_composite(mocker):
+
+    es_client = elasticsearch.Elasticsearch("mockbackend")
+    es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+
+    def composite_resp(idents, after_key):
+        buckets = []
+        for ident in idents:
+            bucket = stats_aggs(10, 3)
+            bucket["key"] = {"container_id": ident}
+            bucket["doc_count"] = 10
+            buckets.append(bucket)
+        containers = {"buckets": buckets}
+        if after_key:
+            containers["after_key"] = {"container_id": after_key}
+        resp = search_resp(20, 6)
+        resp["aggregations"] = {"containers": containers}
+        return (200, {}, json.dumps(resp))
+
+    es_raw.side_effect = [
+        composite_resp(["aaaaaaaaaaaaarceaaaaaaaaai"], "aaaaaaaaaaaaarceaaaaaaaaai"),
+        composite_resp(["aaaaaaaaaaaaarceaaaaaaaaam"], "aaaaaaaaaaaaarceaaaaaaaaam"),
+        composite_resp([], None),
+    ]
+
+    all_stats = list(iter_es_all_container_stats(es_client, merge_shadows=True, page_size=1))
+    assert es_raw.call_count == 3
+    assert [s["ident"] for s in all_stats] == [
+        "aaaaaaaaaaaaarceaaaaaaaaai",
+        "aaaaaaaaaaaaarceaaaaaaaaam",
+    ]
+    assert all_stats[0]["total"] == 10
+    assert all_stats[0]["in_web"] == 3
+    assert all_stats[0]["preservation"]["none"] == 7
+    # second page query should start after the first page's key
+    body = json.loads(es_raw.call_args_list[1][0][3])
+    assert body["aggs"]["containers"]["composite"]["after"] == {
+        "container_id": "aaaaaaaaaaaaarceaaaaaaaaai"
+    }
+
+    assert empty_container_stats("aaaaaaaaaaaaarceaaaaaaaaai")["preservation"]["total"] == 0
@@ -33,8 +33,11 @@ def test_relation_states(api, app, mocker):
     # these are basic ES stats for the container view pages
     es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
     es_raw.side_effect = [
-        (200, {}, json.dumps(ES_CONTAINER_STATS_RESP)),
-        (200, {}, json.dumps(ES_CONTAINER_RANDOM_RESP)),
+        (
+            200,
+            {},
+            json.dumps({"responses": [ES_CONTAINER_STATS_RESP, ES_CONTAINER_RANDOM_RESP]}),
+        ),
     ]
     eg = quick_eg(api)
     j2 = api.get_container(api.create_container(eg.editgroup_id, j2).ident)
@@ -144,8 +147,11 @@ def test_app_entity_states(api, app, mocker):
     # these are basic ES stats for the container view pages
     es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
     es_raw.side_effect = [
-        (200, {}, json.dumps(ES_CONTAINER_STATS_RESP)),
-        (200, {}, json.dumps(ES_CONTAINER_RANDOM_RESP)),
+        (
+            200,
+            {},
+            json.dumps({"responses": [ES_CONTAINER_STATS_RESP, ES_CONTAINER_RANDOM_RESP]}),
+        ),
     ]
 
     j1 = ContainerEntity(name="test journal")
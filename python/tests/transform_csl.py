@@ -6,7 +6,13 @@ from fatcat_openapi_client import ReleaseEntity
 from fixtures import api
 from import_crossref import crossref_importer
 
-from fatcat_tools.transforms import citeproc_csl, entity_from_json, release_to_csl
+from fatcat_tools.transforms import (
+    citeproc_csl,
+    citeproc_csl_batch,
+    entity_from_json,
+    release_to_csl,
+)
+from fatcat_tools.transforms.csl import csl_style_is_numeric, get_csl_style
 
 
 def test_csl_crossref(crossref_importer: Any) -> None:
@@ -71,3 +77,42 @@ def test_csl_pubmed_bibtex(crossref_importer: Any) -> None:
     Mędrela-Kuder and Szymura (2018) ‘Selected anti-health behaviours among women with osteoporosis’, <i>Roczniki Panstwowego Zakladu Higieny</i>, 69`(4). doi: 10.32394/rpzh.2018.0046.
     """.strip()
     )
+
+
+def test_csl_batch() -> None:
+    with open("tests/files/example_releases_pubmed19n0972.json", "r") as f:
+        releases = [entity_from_json(line, ReleaseEntity) for line in f]
+    csl_list = []
+    for i, r in enumerate(releases):
+        csl = release_to_csl(r)
+        csl["id"] = "release:{}".format(i)
+        csl_list.append(csl)
+    # repeated ids get rendered in a separate bibliography
+    csl_list.append(csl_list[0])
+
+    for style in ("csl-json", "bibtex", "harvard1"):
+        batch = citeproc_csl_batch(csl_list, style)
+        assert len(batch) == len(csl_list)
+        assert batch == [citeproc_csl(csl, style) for csl in csl_list]
+    assert citeproc_csl_batch(csl_list, "harvard1", html=True) == [
+        citeproc_csl(csl, "harvard1", html=True) for csl in csl_list
+    ]
+    assert citeproc_csl_batch([], "bibtex") == []
+
+    # numbered styles are numbered per entry, same as citeproc_csl()
+    assert csl_style_is_numeric("ieee")
+    assert not csl_style_is_numeric("harvard1")
+    batch = citeproc_csl_batch(csl_list, "ieee")
+    assert batch == [citeproc_csl(csl, "ieee") for csl in csl_list]
+    assert all(line.startswith("[1]") for line in batch)
+
+    # input objects aren't modified
+    csl_list = [release_to_csl(r) for r in releases[:3]]
+    for csl in csl_list:
+        csl.pop("id", None)
+    for style in ("csl-json", "harvard1", "ieee"):
+        assert len(citeproc_csl_batch(csl_list, style)) == 3
+        assert all("id" not in csl for csl in csl_list)
+
+    assert get_csl_style("bibtex") is get_csl_style("bibtex")
+    assert get_csl_style("bibtex") is not get_csl_style("bibtex", html=True)
@@ -327,3 +327,28 @@ def test_elasticsearch_release_kbart_year():
     assert es["in_ia_sim"] is False
     assert es["in_kbart"] is True
     assert es["in_jstor"] is False
+
+
+def test_elasticsearch_release_container_memoized():
+    """
+    Container fields are memoized by container revision; output should be
+    identical to the non-memoized transform.
+    """
+    from fatcat_tools.transforms import elasticsearch as es_transforms
+
+    with open("./tests/files/release_etodop5banbndg3faecnfm6ozi.json", "r") as f:
+        r = entity_from_json(f.read(), ReleaseEntity)
+    assert r.container.revision
+
+    es_transforms._CONTAINER_FIELDS_CACHE.clear()
+    first = release_to_elasticsearch(r)
+    assert len(es_transforms._CONTAINER_FIELDS_CACHE) == 1
+    first["container_issns"].append("9999-9999")
+    second = release_to_elasticsearch(r)
+    assert "9999-9999" not in second["container_issns"]
+
+    r.container.revision = None
+    unmemoized = release_to_elasticsearch(r)
+    for doc in (second, unmemoized):
+        doc.pop("doc_index_ts")
+    assert list(second.items()) == list(unmemoized.items())
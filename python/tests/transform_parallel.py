@@ -0,0 +1,75 @@
+import argparse
+import io
+import json
+
+from fatcat_tools import public_api
+from fatcat_transform import (
+    run_line_transform,
+    transform_citeproc_lines,
+    transform_release_lines,
+)
+
+API_URL = "http://localhost:9411/v0"
+
+
+def release_lines(count):
+    lines = []
+    for i in range(count):
+        release = {
+            "ident": "aaaaaaaaaaaaarceaaaaaaaa"
+            + chr(ord("a") + i // 26)
+            + chr(ord("a") + i % 26),
+            "revision": "00000000-0000-0000-2222-{:012d}".format(i),
+            "state": "active" if i % 7 else "deleted",
+            "title": "release number {}".format(i),
+            "ext_ids": {"doi": "10.123/{}".format(i)},
+            "contribs": [{"raw_name": "Alice Author", "surname": "Author", "role": "author"}],
+        }
+        lines.append(json.dumps(release))
+        if i % 5 == 0:
+            lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def run_transform(input_text, workers, chunk_size):
+    output = io.StringIO()
+    args = argparse.Namespace(
+        json_input=io.StringIO(input_text),
+        json_output=output,
+        workers=workers,
+        chunk_size=chunk_size,
+        fatcat_api_url=API_URL,
+        api=public_api(API_URL),
+    )
+    run_line_transform(args, transform_release_lines)
+    docs = [json.loads(line) for line in output.getvalue().splitlines()]
+    for doc in docs:
+        doc.pop("doc_index_ts")
+    return docs
+
+
+def test_parallel_line_transform():
+
+    input_text = release_lines(53)
+    single = run_transform(input_text, workers=1, chunk_size=100)
+    assert len(single) == 53 - 8
+    assert [doc["title"] for doc in single][:3] == [
+        "release number 1",
+        "release number 2",
+        "release number 3",
+    ]
+
+    # more chunks than workers (and a short last chunk)
+    parallel = run_transform(input_text, workers=2, chunk_size=4)
+    assert len(parallel) == len(single)
+    assert [doc["ident"] for doc in parallel] == [doc["ident"] for doc in single]
+    assert parallel == single
+
+
+def test_citeproc_lines_batch_size():
+
+    lines = [line for line in release_lines(12).splitlines() if line]
+    api_client = public_api(API_URL).api_client
+    whole = transform_citeproc_lines(lines, api_client, style="harvard1")
+    assert len(whole) == 12 - 2
+    assert transform_citeproc_lines(lines, api_client, style="harvard1", batch_size=3) == whole
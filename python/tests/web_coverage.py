@@ -64,10 +64,8 @@ def test_container_coverage(app, mocker):
 
     es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
     es_raw.side_effect = [
-        # status
-        (200, {}, json.dumps(ES_CONTAINER_STATS_RESP)),
-        # type preservation histogram
-        (200, {}, json.dumps(elastic_resp1)),
+        # status and type preservation histogram, as one multi-search
+        (200, {}, json.dumps({"responses": [ES_CONTAINER_STATS_RESP, elastic_resp1]})),
     ]
 
     rv = app.get("/container/aaaaaaaaaaaaaeiraaaaaaaaam/coverage")
@@ -155,29 +153,54 @@ def test_coverage_search(app, mocker):
 
     es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
     es_raw.side_effect = [
-        # counts summary
-        (200, {}, json.dumps(ES_CONTAINER_STATS_RESP)),
-        # by type
-        (200, {}, json.dumps(elastic_resp2)),
-        # by year
-        (200, {}, json.dumps(elastic_resp1)),
+        # counts summary, by type, and by year, as one multi-search
+        (
+            200,
+            {},
+            json.dumps({"responses": [ES_CONTAINER_STATS_RESP, elastic_resp2, elastic_resp1]}),
+        ),
     ]
 
     rv = app.get("/coverage/search?q=*")
     assert rv.status_code == 200
+    assert es_raw.call_count == 1
+    assert es_raw.call_args[0][1].endswith("/_msearch")
 
     es_raw.side_effect = [
-        # counts summary
-        (200, {}, json.dumps(ES_CONTAINER_STATS_RESP)),
-        # by type
-        (200, {}, json.dumps(elastic_resp2)),
-        # by date
-        (200, {}, json.dumps(elastic_resp3)),
+        # counts summary, by type, and by date, as one multi-search
+        (
+            200,
+            {},
+            json.dumps({"responses": [ES_CONTAINER_STATS_RESP, elastic_resp2, elastic_resp3]}),
+        ),
     ]
 
     rv = app.get("/coverage/search?recent=1&q=*")
     assert rv.status_code == 200
 
+    # a bad query fails each search in the multi-search; shown as a query error
+    query_error = {
+        "error": {
+            "root_cause": [
+                {
+                    "type": "query_shard_exception",
+                    "reason": "Failed to parse query [title:(]",
+                }
+            ],
+            "type": "search_phase_execution_exception",
+            "reason": "all shards failed",
+        },
+        "status": 400,
+    }
+    es_raw.side_effect = [
+        (200, {}, json.dumps({"responses": [query_error, query_error, query_error]})),
+    ]
+
+    rv = app.get("/coverage/search?q=title:(")
+    assert rv.status_code == 400
+    assert b"Query Error" in rv.data
+    assert b"Failed to parse query [title:(]" in rv.data
+
 
 def test_legacy_container_coverage(app, mocker):
 
@@ -0,0 +1,285 @@
+import urllib3
+from fatcat_openapi_client import (
+    ChangelogEntry,
+    ContainerEntity,
+    Editgroup,
+    EditgroupEdits,
+    EntityEdit,
+    FileEntity,
+    ReleaseEntity,
+    ReleaseExtIds,
+)
+from fatcat_openapi_client.rest import ApiException
+from fixtures import full_app
+
+import fatcat_web
+from fatcat_web.entity_cache import EntityResponseCache, RedisEntityStore
+from fatcat_web.entity_helpers import generic_get_entity, generic_get_entity_revision
+
+CONTAINER_IDENT = "aaaaaaaaaaaaaeiraaaaaaaaai"
+RELEASE_IDENT = "aaaaaaaaaaaaarceaaaaaaaaai"
+FILE_IDENT = "aaaaaaaaaaaaamztaaaaaaaaai"
+REV1 = "00000000-0000-0000-4444-fff000000001"
+
+
+def release():
+    return ReleaseEntity(
+        ident=RELEASE_IDENT,
+        revision=REV1,
+        state="active",
+        title="some title",
+        ext_ids=ReleaseExtIds(),
+        container_id=CONTAINER_IDENT,
+        files=[FileEntity(ident=FILE_IDENT, release_ids=[RELEASE_IDENT])],
+        contribs=[],
+        refs=[],
+        abstracts=[],
+    )
+
+
+def editgroup(**edits):
+    all_edits = dict(
+        containers=[],
+        creators=[],
+        files=[],
+        filesets=[],
+        webcaptures=[],
+        releases=[],
+        works=[],
+    )
+    for entity_type, idents in edits.items():
+        all_edits[entity_type] = [
+            EntityEdit(
+                ident=ident,
+                edit_id="00000000-0000-0000-1111-fff000000001",
+                editgroup_id="aaaaaaaaaaaabo53aaaaaaaaae",
+            )
+            for ident in idents
+        ]
+    return Editgroup(edits=EditgroupEdits(**all_edits))
+
+
+def test_entity_response_cache(mocker):
+
+    cache = EntityResponseCache(max_size=3, ttl=60.0)
+    key = ("release", "ident", RELEASE_IDENT, True)
+    rev_key = ("release", "rev", REV1, True)
+    entity = release()
+    cache.put(key, entity, depends_on=[("container", CONTAINER_IDENT)])
+    cache.put(rev_key, entity, depends_on=[("container", CONTAINER_IDENT)])
+
+    # callers get their own copies
+    entity.title = "changed"
+    hit = cache.get(key)
+    assert hit.title == "some title"
+    hit._metadata = {}
+    assert not hasattr(cache.get(key), "_metadata")
+
+    # entities fetched by ident expire; revisions don't
+    now = fatcat_web.entity_cache.time.monotonic()
+    mocker.patch("fatcat_web.entity_cache.time.monotonic", return_value=now + 120)
+    assert cache.get(key) is None
+    assert cache.get(rev_key) is not None
+
+    # an edit to a dependency evicts
+    cache.invalidate("container", CONTAINER_IDENT)
+    assert cache.get(rev_key) is None
+    assert len(cache) == 0
+    assert cache.dependents == {}
+
+    # LRU eviction
+    for i in range(4):
+        cache.put(("container", "ident", str(i), True), ContainerEntity(name=str(i)))
+    assert len(cache) == 3
+    assert cache.get(("container", "ident", "0", True)) is None
+    assert cache.get(("container", "ident", "3", True)).name == "3"
+
+    disabled = EntityResponseCache(max_size=0)
+    disabled.put(key, entity)
+    assert disabled.get(key) is None
+
+
+class FakeRedis:
+    """
+    Just enough of a redis client (shared by several "processes") to test
+    RedisEntityStore.
+    """
+
+    def __init__(self):
+        self.data = dict()
+        self.ttls = dict()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, px=None):
+        self.data[key] = value
+        self.ttls[key] = px
+
+    def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(member.encode("utf-8"))
+
+    def smembers(self, key):
+        return self.data.get(key, set())
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds * 1000
+
+    def delete(self, *keys):
+        for key in keys:
+            if isinstance(key, bytes):
+                key = key.decode("utf-8")
+            self.data.pop(key, None)
+
+    def pipeline(self):
+        return FakeRedisPipeline(self)
+
+
+class FakeRedisPipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [
+            getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls
+        ]
+
+
+def test_entity_response_cache_store():
+
+    client = FakeRedis()
+    # two web processes sharing a store
+    cache_a = EntityResponseCache(store=RedisEntityStore("", client=client))
+    cache_b = EntityResponseCache(store=RedisEntityStore("", client=client))
+    key = ("release", "ident", RELEASE_IDENT, True)
+    rev_key = ("release", "rev", REV1, True)
+    cache_a.put(key, release(), depends_on=[("container", CONTAINER_IDENT)])
+    cache_a.put(rev_key, release(), depends_on=[("container", CONTAINER_IDENT)])
+
+    assert cache_b.get(key).title == "some title"
+    assert cache_b.get(rev_key).title == "some title"
+    assert cache_b.counts["store_hit"] == 2
+    # revisions don't expire as quickly as idents, but do expire in the store
+    assert client.ttls[cache_a.store._key(key)] == 60 * 1000
+    assert client.ttls[cache_a.store._key(rev_key)] == 24 * 60 * 60 * 1000
+
+    # an edit to a dependency, seen by one process, evicts from the store too
+    cache_b.invalidate("container", CONTAINER_IDENT)
+    assert cache_b.get(key) is None
+    assert cache_b.get(rev_key) is None
+    cache_a.clear()
+    assert cache_a.get(key) is None
+    assert cache_a.get(rev_key) is None
+    assert client.data == dict()
+
+
+class FakeChangelogApi:
+    def __init__(self, latest, entries):
+        self.latest = latest
+        self.entries = entries
+        self.error = None
+
+    def get_changelog(self, limit=None):
+        if self.error:
+            raise self.error
+        return [ChangelogEntry(index=self.latest, editgroup_id="x", timestamp="2020-01-01")]
+
+    def get_changelog_entry(self, index):
+        if index not in self.entries:
+            raise ApiException(status=404)
+        return ChangelogEntry(
+            index=index,
+            editgroup_id="aaaaaaaaaaaabo53aaaaaaaaae",
+            timestamp="2020-01-01T00:00:00Z",
+            editgroup=self.entries[index],
+        )
+
+
+def test_entity_response_cache_changelog():
+
+    cache = EntityResponseCache(changelog_interval=10.0, max_changelog_catch_up=5)
+    api = FakeChangelogApi(100, {})
+    cache.sync_changelog(api)
+    assert cache.changelog_index == 100
+
+    release_key = ("release", "ident", RELEASE_IDENT, True)
+    container_key = ("container", "ident", CONTAINER_IDENT, True)
+    cache.put(release_key, release(), depends_on=[("file", FILE_IDENT)])
+    cache.put(container_key, ContainerEntity(ident=CONTAINER_IDENT, name="some journal"))
+
+    # only syncs once per interval
+    api.latest = 103
+    api.entries = {101: editgroup(files=[FILE_IDENT])}
+    cache.sync_changelog(api)
+    assert cache.changelog_index == 100
+    assert cache.get(release_key) is not None
+
+    # editing a file evicts the release it was expanded in to; gaps in the
+    # changelog are skipped
+    cache.next_changelog_sync = 0.0
+    cache.sync_changelog(api)
+    assert cache.changelog_index == 103
+    assert cache.get(release_key) is None
+    assert cache.get(container_key) is not None
+
+    # too far behind to catch up
+    api.latest = 110
+    cache.next_changelog_sync = 0.0
+    cache.sync_changelog(api)
+    assert cache.changelog_index == 110
+    assert len(cache) == 0
+
+    # connection errors are logged, and the sync retried later
+    cache.put(container_key, ContainerEntity(ident=CONTAINER_IDENT, name="some journal"))
+    api.latest = 111
+    api.error = urllib3.exceptions.MaxRetryError(None, "/v0/changelog")
+    cache.next_changelog_sync = 0.0
+    cache.sync_changelog(api)
+    assert cache.changelog_index == 110
+    assert not cache.changelog_lock.locked()
+
+    # requests leave the sync to a background thread
+    api.error = None
+    api.entries = {111: editgroup(containers=[CONTAINER_IDENT])}
+    cache.next_changelog_sync = 0.0
+    cache.sync_changelog_background(api)
+    cache.changelog_thread.join()
+    assert cache.changelog_index == 111
+    assert cache.get(container_key) is None
+    assert not cache.changelog_lock.locked()
+
+
+def test_generic_get_entity_cached(full_app, mocker):
+
+    api = mocker.patch("fatcat_web.entity_helpers.api")
+    api.get_changelog.return_value = []
+    api.get_release.side_effect = lambda ident, expand=None: release()
+    api.get_release_revision.side_effect = lambda rev, expand=None: release()
+    full_app.entity_cache = EntityResponseCache()
+
+    with full_app.test_request_context():
+        for _ in range(3):
+            entity = generic_get_entity("release", RELEASE_IDENT, cached=True)
+            assert entity.title == "some title"
+            # enrichment is cached along with the entity
+            assert entity._es["ident"] == RELEASE_IDENT
+        assert api.get_release.call_count == 1
+
+        # uncached fetches (eg, for editing) always go to the API
+        generic_get_entity("release", RELEASE_IDENT)
+        assert api.get_release.call_count == 2
+
+        generic_get_entity_revision("release", REV1, cached=True)
+        generic_get_entity_revision("release", REV1, cached=True)
+        assert api.get_release_revision.call_count == 1
+
+        # the release depends on its file and container
+        full_app.entity_cache.invalidate_editgroup(editgroup(containers=[CONTAINER_IDENT]))
+        generic_get_entity("release", RELEASE_IDENT, cached=True)
+        generic_get_entity_revision("release", REV1, cached=True)
+        assert api.get_release.call_count == 3
+        assert api.get_release_revision.call_count == 2
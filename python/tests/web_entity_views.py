@@ -31,8 +31,11 @@ def test_entity_basics(app, mocker):
     es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
     # these are basic ES stats for the container view pages
     es_raw.side_effect = [
-        (200, {}, json.dumps(ES_CONTAINER_STATS_RESP)),
-        (200, {}, json.dumps(ES_CONTAINER_RANDOM_RESP)),
+        (
+            200,
+            {},
+            json.dumps({"responses": [ES_CONTAINER_STATS_RESP, ES_CONTAINER_RANDOM_RESP]}),
+        ),
     ]
 
     for entity_type, (ident, revision) in DUMMY_DEMO_ENTITIES.items():
@@ -150,8 +153,11 @@ def test_web_container(app, mocker):
     es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
     # these are basic ES stats for the container view pages
     es_raw.side_effect = [
-        (200, {}, json.dumps(ES_CONTAINER_STATS_RESP)),
-        (200, {}, json.dumps(ES_CONTAINER_RANDOM_RESP)),
+        (
+            200,
+            {},
+            json.dumps({"responses": [ES_CONTAINER_STATS_RESP, ES_CONTAINER_RANDOM_RESP]}),
+        ),
     ]
 
     rv = app.get("/container/aaaaaaaaaaaaaeiraaaaaaaaai")
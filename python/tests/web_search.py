@@ -4,7 +4,13 @@ import pytest
 from fatcat_openapi_client.rest import ApiException
 from fixtures import *
 
-from fatcat_web.search import get_elastic_container_random_releases
+from fatcat_tools.search.common import FatcatSearchError
+from fatcat_web.search import (
+    SearchBatch,
+    get_elastic_container_random_releases,
+    prepare_container_random_releases,
+    prepare_container_stats,
+)
 
 
 def test_generic_search(app):
@@ -200,3 +206,59 @@ def test_container_stats(app, mocker):
     stats = rv.json
     assert isinstance(stats["total"], int)
     assert stats["ident"] == "aaaaaaaaaaaaaeiraaaaaaaaam"
+
+
+def test_search_batch(app, mocker):
+
+    es_raw = mocker.patch("elasticsearch.connection.Urllib3HttpConnection.perform_request")
+    es_raw.side_effect = [
+        (
+            200,
+            {},
+            json.dumps({"responses": [ES_CONTAINER_STATS_RESP, ES_CONTAINER_RANDOM_RESP]}),
+        ),
+    ]
+
+    batch = SearchBatch()
+    stats = batch.add(prepare_container_stats("aaaaaaaaaaaaaeiraaaaaaaaam", issnl="1234-5678"))
+    releases = batch.add(prepare_container_random_releases("aaaaaaaaaaaaaeiraaaaaaaaam"))
+    with pytest.raises(RuntimeError):
+        stats.result()
+    batch.execute()
+
+    # a single _msearch request, with track_total_hits in the query bodies
+    assert es_raw.call_count == 1
+    assert es_raw.call_args[0][1].endswith("/_msearch")
+    lines = [
+        json.loads(line) for line in es_raw.call_args[0][3].decode("utf-8").split("\n") if line
+    ]
+    assert len(lines) == 4
+    assert lines[0]["index"] == ["fatcat_release"]
+    assert lines[0]["request_cache"] is True
+    assert lines[1]["track_total_hits"] is True
+
+    assert stats.result()["ident"] == "aaaaaaaaaaaaaeiraaaaaaaaam"
+    assert stats.result()["issnl"] == "1234-5678"
+    assert stats.result()["total"] == 461939
+    assert stats.result()["preservation"]["bright"] == 444
+    assert releases.result() == []
+
+    # a failure of any one query fails the batch
+    es_raw.side_effect = [
+        (
+            200,
+            {},
+            json.dumps(
+                {
+                    "responses": [
+                        ES_CONTAINER_STATS_RESP,
+                        {"error": {"type": "search_phase_execution_exception"}, "status": 400},
+                    ]
+                }
+            ),
+        ),
+    ]
+    batch.add(prepare_container_stats("aaaaaaaaaaaaaeiraaaaaaaaam"))
+    batch.add(prepare_container_random_releases("aaaaaaaaaaaaaeiraaaaaaaaam"))
+    with pytest.raises(FatcatSearchError):
+        batch.execute()
@@ -0,0 +1,347 @@
+import concurrent.futures
+import json
+import random
+import threading
+import time
+
+import pytest
+from fatcat_openapi_client import (
+    ApiClient,
+    ChangelogEntry,
+    ContainerEntity,
+    FileEntity,
+    FilesetEntity,
+    ReleaseEntity,
+    ReleaseExtIds,
+)
+
+from fatcat_tools.workers import ChangelogWorker, EntityCache, EntityUpdatesWorker
+
+
+class FakeProducer:
+    def __init__(self):
+        self.produced = []
+
+    def poll(self, timeout=None):
+        pass
+
+    def produce(self, topic, value, key=None, on_delivery=None):
+        self.produced.append((topic, key, json.loads(value.decode("utf-8"))))
+
+    def flush(self):
+        pass
+
+
+class FakeApi:
+    """
+    Stand-in for the fatcat API client, which returns minimal entities and
+    tracks the maximum number of concurrent fetches.
+    """
+
+    def __init__(self, delay=0.05):
+        self.api_client = ApiClient()
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.fetched = []
+
+    def _fetch(self, kind, ident):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.fetched.append((kind, ident))
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+
+    def get_file(self, ident, expand=None):
+        self._fetch("file", ident)
+        return FileEntity(
+            ident=ident,
+            revision="00000000-0000-0000-1111-fff000000001",
+            release_ids=["aaaaaaaaaaaaarceaaaaaaaaam"],
+        )
+
+    def get_fileset(self, ident, expand=None):
+        self._fetch("fileset", ident)
+        return FilesetEntity(ident=ident, release_ids=["aaaaaaaaaaaaarceaaaaaaaaaq"])
+
+    def get_container(self, ident):
+        self._fetch("container", ident)
+        return ContainerEntity(ident=ident, name="some journal")
+
+    def get_release(self, ident, expand=None):
+        self._fetch("release", ident)
+        return ReleaseEntity(
+            ident=ident,
+            revision="00000000-0000-0000-4444-fff000000001",
+            title="some title",
+            ext_ids=ReleaseExtIds(),
+            work_id="aaaaaaaaaaaaavkvaaaaaaaaai",
+        )
+
+
+def changelog_entry(index=123):
+    edits = dict(
+        releases=[dict(ident="aaaaaaaaaaaaarceaaaaaaaaai", prev_revision="abc")],
+        files=[
+            dict(ident="aaaaaaaaaaaaamztaaaaaaaaai"),
+            dict(ident="aaaaaaaaaaaaamztaaaaaaaaam"),
+        ],
+        filesets=[dict(ident="aaaaaaaaaaaaaztgaaaaaaaaai")],
+        webcaptures=[],
+        containers=[dict(ident="aaaaaaaaaaaaaeiraaaaaaaaai")],
+        works=[],
+    )
+    return dict(index=index, timestamp="2020-01-01T00:00:00Z", editgroup=dict(edits=edits))
+
+
+def make_worker(api):
+    return EntityUpdatesWorker(
+        api,
+        "dummy",
+        "fatcat-test.changelog",
+        release_topic="release-updates",
+        file_topic="file-updates",
+        container_topic="container-updates",
+        ingest_file_request_topic="ingest-requests",
+        work_ident_topic="work-ident-updates",
+    )
+
+
+def test_entity_updates_concurrent_fetch():
+
+    api = FakeApi()
+    worker = make_worker(api)
+    producer = FakeProducer()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        worker.process_changelog_entries([changelog_entry()], producer, executor, None)
+
+    # fetches overlapped
+    assert api.max_active > 1
+    # releases only fetched after files and filesets, and include the
+    # releases those entities point to
+    kinds = [kind for (kind, _) in api.fetched]
+    assert kinds.index("release") > max(kinds.index("file"), kinds.index("fileset"))
+    release_idents = sorted(ident for (kind, ident) in api.fetched if kind == "release")
+    assert release_idents == [
+        "aaaaaaaaaaaaarceaaaaaaaaai",
+        "aaaaaaaaaaaaarceaaaaaaaaam",
+        "aaaaaaaaaaaaarceaaaaaaaaaq",
+    ]
+
+    # messages produced grouped by topic, in the same order as sequential fetches
+    topics = [topic for (topic, _, _) in producer.produced]
+    assert topics == [
+        "file-updates",
+        "file-updates",
+        "container-updates",
+        "release-updates",
+        "release-updates",
+        "release-updates",
+        "work-ident-updates",
+    ]
+    for topic, key, doc in producer.produced[:6]:
+        assert key.decode("utf-8") == doc["ident"]
+    assert producer.produced[-1][2]["work_ident"] == "aaaaaaaaaaaaavkvaaaaaaaaai"
+    assert producer.produced[-1][2]["fatcat_changelog_index"] == 123
+
+
+def test_entity_updates_batch():
+
+    api = FakeApi(delay=0.0)
+    worker = make_worker(api)
+    producer = FakeProducer()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        worker.process_changelog_entries(
+            [changelog_entry(123), changelog_entry(124)], producer, executor, None
+        )
+
+    # entities touched by both entries are only fetched and published once
+    assert len(api.fetched) == 7
+    assert len(producer.produced) == 7
+    assert producer.produced[-1][2]["fatcat_changelog_index"] == 124
+
+
+class StopWorker(Exception):
+    pass
+
+
+class FakeMessage:
+    def __init__(self, value, offset):
+        self._value = value
+        self._offset = offset
+
+    def value(self):
+        return self._value
+
+    def offset(self):
+        return self._offset
+
+    def error(self):
+        return None
+
+
+class FakeConsumer:
+    def __init__(self, msgs):
+        self.msgs = list(msgs)
+        self.stored = []
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        pass
+
+    def poll(self, timeout=None):
+        if not self.msgs:
+            raise StopWorker()
+        return self.msgs.pop(0)
+
+    def consume(self, num_messages=1, timeout=None):
+        batch = self.msgs[:num_messages]
+        self.msgs = self.msgs[num_messages:]
+        return batch
+
+    def store_offsets(self, message=None):
+        self.stored.append(message.offset())
+
+
+def test_entity_updates_worker_run(mocker):
+
+    msgs = [FakeMessage(json.dumps(changelog_entry(i)).encode("utf-8"), i) for i in range(5)]
+    consumer = FakeConsumer(msgs)
+    producer = FakeProducer()
+    mocker.patch("fatcat_tools.workers.changelog.Consumer", return_value=consumer)
+    mocker.patch("fatcat_tools.workers.changelog.Producer", return_value=producer)
+
+    api = FakeApi(delay=0.0)
+    worker = make_worker(api)
+    worker.batch_size = 3
+    with pytest.raises(StopWorker):
+        worker.run()
+
+    # two groups (3 + 2 entries), each fetching the same 7 entities once
+    assert len(api.fetched) == 14
+    work_updates = [
+        doc for (topic, _, doc) in producer.produced if topic == "work-ident-updates"
+    ]
+    assert [doc["fatcat_changelog_index"] for doc in work_updates] == [2, 4]
+    assert consumer.stored == [0, 1, 2, 3, 4]
+
+
+REV1 = "00000000-0000-0000-4444-fff000000001"
+REV2 = "00000000-0000-0000-4444-fff000000002"
+REV3 = "00000000-0000-0000-4444-fff000000003"
+
+
+def test_entity_cache():
+
+    cache = EntityCache(max_size=2)
+    r1 = ReleaseEntity(
+        ident="aaaaaaaaaaaaarceaaaaaaaaai", revision=REV1, ext_ids=ReleaseExtIds()
+    )
+    r2 = ReleaseEntity(
+        ident="aaaaaaaaaaaaarceaaaaaaaaam", revision=REV2, ext_ids=ReleaseExtIds()
+    )
+    r3 = ReleaseEntity(
+        ident="aaaaaaaaaaaaarceaaaaaaaaaq", revision=REV3, ext_ids=ReleaseExtIds()
+    )
+
+    cache.put(
+        "release", r1, expand="files", depends_on=[("file", "aaaaaaaaaaaaamztaaaaaaaaai")]
+    )
+    assert cache.get("release", r1.ident, expand="files") is r1
+    assert cache.get("release", r1.ident) is None
+    # an edit to the same revision doesn't invalidate
+    cache.update_revision("release", r1.ident, REV1)
+    assert cache.get("release", r1.ident, expand="files") is r1
+    # an edit to a dependency does
+    cache.update_revision("file", "aaaaaaaaaaaaamztaaaaaaaaai", "frev2")
+    assert cache.get("release", r1.ident, expand="files") is None
+
+    cache.put("release", r1)
+    cache.update_revision("release", r1.ident, "rev1b")
+    assert cache.get("release", r1.ident) is None
+
+    # LRU eviction
+    cache.put("release", r1)
+    cache.put("release", r2)
+    assert cache.get("release", r1.ident) is r1
+    cache.put("release", r3)
+    assert len(cache) == 2
+    assert cache.get("release", r2.ident) is None
+    assert cache.get("release", r1.ident) is r1
+    assert cache.get("release", r3.ident) is r3
+
+
+def test_entity_updates_cached_release():
+
+    api = FakeApi(delay=0.0)
+    worker = make_worker(api)
+    worker.entity_cache = EntityCache()
+    producer = FakeProducer()
+    release_edit = dict(releases=[dict(ident="aaaaaaaaaaaaarceaaaaaaaaam", revision="abc")])
+    file_edit = dict(files=[dict(ident="aaaaaaaaaaaaamztaaaaaaaaai", revision="def")])
+    cles = []
+    for i, edits in enumerate([release_edit, file_edit]):
+        for entity_type in (
+            "releases",
+            "files",
+            "filesets",
+            "webcaptures",
+            "containers",
+            "works",
+        ):
+            edits.setdefault(entity_type, [])
+        cles.append(
+            dict(index=i, timestamp="2020-01-01T00:00:00Z", editgroup=dict(edits=edits))
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        for cle in cles:
+            worker.process_changelog_entries([cle], producer, executor, None)
+
+    # release only fetched once; second time it is taken from the cache, with
+    # the updated file attached
+    assert api.fetched == [
+        ("release", "aaaaaaaaaaaaarceaaaaaaaaam"),
+        ("file", "aaaaaaaaaaaaamztaaaaaaaaai"),
+    ]
+    releases = [doc for (topic, _, doc) in producer.produced if topic == "release-updates"]
+    assert len(releases) == 2
+    assert [f["ident"] for f in releases[1]["files"]] == ["aaaaaaaaaaaaamztaaaaaaaaai"]
+
+
+class FakeChangelogApi:
+    def __init__(self, latest):
+        self.api_client = ApiClient()
+        self.latest = latest
+
+    def get_changelog(self, limit=None):
+        return [self.get_changelog_entry(self.latest)]
+
+    def get_changelog_entry(self, index):
+        # responses arrive out of order (time.sleep() is mocked out in the test)
+        threading.Event().wait(random.random() * 0.01)
+        return ChangelogEntry(
+            index=index,
+            editgroup_id="aaaaaaaaaaaabo53aaaaaaaaae",
+            timestamp="2020-01-01T00:00:00Z",
+        )
+
+
+def test_changelog_worker_catch_up(mocker):
+
+    producer = FakeProducer()
+    mocker.patch("fatcat_tools.workers.changelog.Producer", return_value=producer)
+    mocker.patch("fatcat_tools.workers.changelog.time.sleep", side_effect=StopWorker())
+
+    worker = ChangelogWorker(
+        FakeChangelogApi(100), "dummy", "fatcat-test.changelog", offset=10, fetch_workers=4
+    )
+    with pytest.raises(StopWorker):
+        worker.run()
+
+    # published strictly in index order
+    assert [key for (_, key, _) in producer.produced] == [str(i) for i in range(11, 101)]
+    assert [doc["index"] for (_, _, doc) in producer.produced] == list(range(11, 101))
+    assert worker.offset == 100
@@ -0,0 +1,316 @@
+import json
+import time
+
+import pytest
+import responses
+
+from fatcat_tools.workers import (
+    ElasticsearchContainerWorker,
+    ElasticsearchMultiWorker,
+    ElasticsearchReleaseWorker,
+    coalesce_messages_by_key,
+)
+
+BULK_URL = "http://localhost:9200/fatcat_release/_bulk"
+
+
+class FakeMessage:
+    def __init__(self, value, offset, key=None, topic="fatcat-test.release-updates-v03"):
+        self._value = value
+        self._offset = offset
+        self._key = key
+        self._topic = topic
+
+    def value(self):
+        return self._value
+
+    def key(self):
+        return self._key
+
+    def offset(self):
+        return self._offset
+
+    def partition(self):
+        return 0
+
+    def topic(self):
+        return self._topic
+
+    def error(self):
+        return None
+
+
+class StopWorker(Exception):
+    pass
+
+
+class FakeConsumer:
+    """
+    Stand-in for a confluent_kafka Consumer. Returns the given batches (lists
+    of messages) from consume(), then a single empty batch, then raises
+    StopWorker.
+    """
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.stored = []
+        self.drained = False
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        self.topics = topics
+
+    def assignment(self):
+        return [0]
+
+    def consume(self, num_messages=1, timeout=None):
+        if not self.batches:
+            if timeout is not None and timeout < 1.0:
+                # short (eg, coalescing window) poll
+                time.sleep(timeout)
+                return []
+            if not self.drained:
+                # one final empty poll, to let the worker finish in-flight work
+                self.drained = True
+                return []
+            raise StopWorker()
+        return self.batches.pop(0)
+
+    def store_offsets(self, message=None):
+        self.stored.append(message.offset())
+
+
+def release_messages(offsets, keyed=True):
+    with open("tests/files/release_etodop5banbndg3faecnfm6ozi.json", "r") as f:
+        release = json.loads(f.read())
+    key = release["ident"] if keyed else None
+    msgs = []
+    for i in offsets:
+        msgs.append(FakeMessage(json.dumps(release).encode("utf-8"), i, key=key))
+    return msgs
+
+
+def bulk_callback(request):
+    lines = request.body.decode("utf-8").strip().split("\n")
+    items = [
+        {"index": {"_id": json.loads(line)["index"]["_id"], "status": 200}}
+        for line in lines[::2]
+    ]
+    return (200, {}, json.dumps({"took": 1, "errors": False, "items": items}))
+
+
+def run_worker(worker, consumer, mocker):
+    mocker.patch("fatcat_tools.workers.elasticsearch.Consumer", return_value=consumer)
+    with pytest.raises(StopWorker):
+        worker.run()
+
+
+@responses.activate
+def test_elasticsearch_release_worker(mocker):
+
+    responses.add_callback(responses.POST, BULK_URL, callback=bulk_callback)
+    consumer = FakeConsumer(
+        [
+            release_messages([0, 1]),
+            release_messages([2]),
+        ]
+    )
+    worker = ElasticsearchReleaseWorker(
+        "dummy",
+        "fatcat-test.release-updates-v03",
+        elasticsearch_index="fatcat_release",
+        # flush every batch
+        max_linger=0.0,
+    )
+    run_worker(worker, consumer, mocker)
+
+    assert len(responses.calls) == 2
+    body = responses.calls[0].request.body.decode("utf-8")
+    assert json.loads(body.split("\n")[0]) == {"index": {"_id": "etodop5banbndg3faecnfm6ozi"}}
+    assert json.loads(body.split("\n")[1])["ident"] == "etodop5banbndg3faecnfm6ozi"
+    # offsets only stored after bulk requests complete, and in order
+    assert consumer.stored == [0, 1, 2]
+    assert worker.metrics.counters["messages_consumed_total"] == {
+        (("topic", "fatcat-test.release-updates-v03"),): 3
+    }
+    # first batch was two updates of the same release, coalesced
+    assert worker.metrics.counters["documents_indexed_total"] == {(): 2}
+
+
+@responses.activate
+def test_elasticsearch_release_worker_errors(mocker):
+
+    responses.add(
+        responses.POST,
+        BULK_URL,
+        json={
+            "took": 1,
+            "errors": True,
+            "items": [
+                {
+                    "index": {
+                        "_id": "etodop5banbndg3faecnfm6ozi",
+                        "status": 400,
+                        "error": {"type": "mapper_parsing_exception"},
+                    }
+                }
+            ],
+        },
+    )
+    consumer = FakeConsumer([release_messages([0])])
+    worker = ElasticsearchReleaseWorker(
+        "dummy",
+        "fatcat-test.release-updates-v03",
+        elasticsearch_index="fatcat_release",
+    )
+    mocker.patch("fatcat_tools.workers.elasticsearch.Consumer", return_value=consumer)
+    with pytest.raises(Exception, match="Elasticsearch errors"):
+        worker.run()
+    assert consumer.stored == []
+
+
+def test_coalesce_messages_by_key():
+    msgs = [
+        FakeMessage(b"a1", 0, key=b"a"),
+        FakeMessage(b"b1", 1, key=b"b"),
+        FakeMessage(b"a2", 2, key=b"a"),
+        FakeMessage(b"x", 3, key=None),
+        FakeMessage(b"y", 4, key=None),
+        FakeMessage(b"a3", 5, key=b"a", topic="other-topic"),
+    ]
+    newest = coalesce_messages_by_key(msgs)
+    assert [m.value() for m in newest] == [b"b1", b"a2", b"x", b"y", b"a3"]
+    assert coalesce_messages_by_key([]) == []
+
+
+@responses.activate
+def test_elasticsearch_release_worker_coalesce(mocker):
+
+    responses.add_callback(responses.POST, BULK_URL, callback=bulk_callback)
+    consumer = FakeConsumer(
+        [
+            release_messages([0, 1, 2]),
+            release_messages([3]),
+        ]
+    )
+    worker = ElasticsearchReleaseWorker(
+        "dummy",
+        "fatcat-test.release-updates-v03",
+        elasticsearch_index="fatcat_release",
+        coalesce_window=0.1,
+    )
+    run_worker(worker, consumer, mocker)
+
+    # all four messages (same release ident) consumed within the window, and
+    # coalesced in to a single bulk action
+    assert len(responses.calls) == 1
+    assert len(responses.calls[0].request.body.decode("utf-8").strip().split("\n")) == 2
+    assert worker.counts["coalesced"] == 3
+    assert consumer.stored == [0, 1, 2, 3]
+
+
+@responses.activate
+def test_elasticsearch_multi_worker(mocker):
+
+    container_url = "http://localhost:9200/fatcat_container/_bulk"
+    responses.add_callback(responses.POST, BULK_URL, callback=bulk_callback)
+    responses.add_callback(responses.POST, container_url, callback=bulk_callback)
+    container = dict(
+        ident="aaaaaaaaaaaaaeiraaaaaaaaai",
+        revision="00000000-0000-0000-1111-fff000000002",
+        state="active",
+        name="some journal",
+    )
+    container_msgs = [
+        FakeMessage(
+            json.dumps(container).encode("utf-8"),
+            i,
+            key=container["ident"],
+            topic="fatcat-test.container-updates",
+        )
+        for i in (0, 1)
+    ]
+    consumer = FakeConsumer(
+        [
+            release_messages([0]) + container_msgs,
+            release_messages([1]),
+        ]
+    )
+    worker = ElasticsearchMultiWorker(
+        "dummy",
+        [
+            ElasticsearchReleaseWorker(
+                "dummy",
+                "fatcat-test.release-updates-v03",
+                elasticsearch_index="fatcat_release",
+            ),
+            ElasticsearchContainerWorker(
+                "dummy",
+                "fatcat-test.container-updates",
+                elasticsearch_index="fatcat_container",
+            ),
+        ],
+    )
+    run_worker(worker, consumer, mocker)
+
+    assert consumer.topics == [
+        "fatcat-test.release-updates-v03",
+        "fatcat-test.container-updates",
+    ]
+    urls = sorted([call.request.url for call in responses.calls])
+    assert urls == [container_url, BULK_URL, BULK_URL]
+    # the two container updates were coalesced
+    assert worker.counts["coalesced"] == 1
+    # offsets stored for every message, per topic
+    assert sorted(consumer.stored) == [0, 0, 1, 1]
+
+
+@responses.activate
+def test_elasticsearch_release_worker_flush_policy(mocker):
+
+    responses.add_callback(responses.POST, BULK_URL, callback=bulk_callback)
+
+    # batches accumulate until the linger time runs out (here, when the
+    # consumer has nothing more)
+    consumer = FakeConsumer(
+        [release_messages([0]), release_messages([1]), release_messages([2])]
+    )
+    worker = ElasticsearchReleaseWorker(
+        "dummy",
+        "fatcat-test.release-updates-v03",
+        elasticsearch_index="fatcat_release",
+        max_linger=60.0,
+    )
+    run_worker(worker, consumer, mocker)
+    assert len(responses.calls) == 1
+    assert len(responses.calls[0].request.body.decode("utf-8").strip().split("\n")) == 6
+    assert consumer.stored == [0, 1, 2]
+
+    # ... or until enough bytes accumulate, with bulk bodies split to fit
+    responses.calls.reset()
+    consumer = FakeConsumer([release_messages([0, 1, 2, 3], keyed=False)])
+    worker = ElasticsearchReleaseWorker(
+        "dummy",
+        "fatcat-test.release-updates-v03",
+        elasticsearch_index="fatcat_release",
+        max_linger=60.0,
+        max_bulk_bytes=1,
+    )
+    run_worker(worker, consumer, mocker)
+    assert len(responses.calls) == 4
+    assert consumer.stored == [0, 1, 2, 3]
+
+    # ... or until enough documents accumulate
+    responses.calls.reset()
+    consumer = FakeConsumer(
+        [release_messages([0]), release_messages([1, 2]), release_messages([3])]
+    )
+    worker = ElasticsearchReleaseWorker(
+        "dummy",
+        "fatcat-test.release-updates-v03",
+        elasticsearch_index="fatcat_release",
+        max_linger=60.0,
+        batch_size=2,
+    )
+    run_worker(worker, consumer, mocker)
+    assert len(responses.calls) == 2
+    assert consumer.stored == [0, 1, 2, 3]
@@ -0,0 +1,74 @@
+import json
+import socket
+import urllib.request
+
+import pytest
+
+from fatcat_tools.workers import WorkerMetrics
+
+
+def test_worker_metrics_prometheus():
+
+    metrics = WorkerMetrics(prefix="test")
+    metrics.inc("messages_consumed_total", 5, labels=dict(topic="release"))
+    metrics.inc("messages_consumed_total", 2, labels=dict(topic="release"))
+    metrics.set("changelog_index", 1234)
+    metrics.observe("batch_seconds", 0.02)
+    metrics.observe("batch_seconds", 3.0)
+    with pytest.raises(ValueError):
+        with metrics.timer("api_request_seconds", labels=dict(method="get_release")):
+            raise ValueError()
+
+    text = metrics.render_prometheus()
+    lines = text.split("\n")
+    assert "# TYPE test_messages_consumed_total counter" in lines
+    assert 'test_messages_consumed_total{topic="release"} 7' in lines
+    assert "test_changelog_index 1234" in lines
+    assert 'test_batch_seconds_bucket{le="0.01"} 0' in lines
+    assert 'test_batch_seconds_bucket{le="0.025"} 1' in lines
+    assert 'test_batch_seconds_bucket{le="5.0"} 2' in lines
+    assert 'test_batch_seconds_bucket{le="+Inf"} 2' in lines
+    assert "test_batch_seconds_count 2" in lines
+    assert 'test_errors_total{method="get_release",source="api_request_seconds"} 1' in lines
+
+    metrics.kafka_stats(
+        json.dumps(
+            {
+                "topics": {
+                    "fatcat-test.changelog": {
+                        "partitions": {
+                            "0": {"consumer_lag": 42},
+                            "1": {"consumer_lag": -1},
+                            "-1": {"consumer_lag": 0},
+                        }
+                    }
+                }
+            }
+        )
+    )
+    assert metrics.gauges["kafka_consumer_lag"] == {
+        (("partition", "0"), ("topic", "fatcat-test.changelog")): 42
+    }
+
+
+def test_worker_metrics_endpoints():
+
+    statsd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    statsd.bind(("127.0.0.1", 0))
+    statsd.settimeout(5.0)
+    metrics = WorkerMetrics(statsd_addr="127.0.0.1:{}".format(statsd.getsockname()[1]))
+    metrics.inc("messages_produced_total", labels=dict(topic="release"))
+    assert statsd.recv(1024) == b"fatcat_worker.messages_produced_total.release:1|c"
+
+    metrics.serve(0, host="127.0.0.1")
+    assert metrics.server
+    port = metrics.server.server_address[1]
+    try:
+        resp = urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(port))
+        assert resp.status == 200
+        assert 'fatcat_worker_messages_produced_total{topic="release"} 1' in resp.read().decode(
+            "utf-8"
+        )
+    finally:
+        metrics.server.shutdown()
+        statsd.close()